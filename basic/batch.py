@@ -0,0 +1,182 @@
+"""Play many scripted sessions of a BASIC program in parallel.
+
+    python -m basic.batch SCRIPT_DIR [-p PROGRAM] [-o RESULTS_DIR] [-j JOBS]
+                          [-d DATA_DIR]
+
+Every file in SCRIPT_DIR is fed to a fresh Interpreter as its input. Each
+session's stdout and stderr are saved in RESULTS_DIR as NAME.out and
+NAME.err, and summary.json records how every session ended.
+
+Each session runs in a temporary directory of its own, holding copies of
+the files the program opens with FILE, taken from DATA_DIR (by default the
+current directory). Sessions therefore all start from the same data, and
+what one writes can't affect another, or the originals.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from . import lang
+from .interpreter import Interpreter
+from .parser import Parser
+
+DEFAULT_PROGRAM = os.path.join(os.path.dirname(__file__), '..', 'dnd1.basic')
+
+
+def session_seed(base_seed: str, script_name: str) -> str:
+    # String seeds are hashed deterministically, so a session replays the
+    # same way regardless of which worker runs it or in what order.
+    return '{}:{}'.format(base_seed, script_name)
+
+
+def load_program(program_path: str) -> None:
+    # Pool initializer: parse the program once per worker process. Every
+    # Interpreter created afterwards gets it from the parser's memory cache.
+    with open(program_path) as f:
+        Parser().parse_file(program_path, f.read())
+
+
+def data_files(program_path: str) -> List[str]:
+    # The files opened by the program's FILE statements, which it looks for
+    # in the current directory.
+    with open(program_path) as f:
+        program = Parser().parse_file(program_path, f.read())
+    names = set()
+    for line in program.lines:
+        if isinstance(line.statement, lang.File):
+            names.update(fs.name.content for fs in line.statement.filespecs)
+    return sorted(names)
+
+
+def run_session(program_path: str, script_path: str, seed: str,
+                engine: str, data_paths: Sequence[str] = ()) -> Dict[str, Any]:
+    """Run the program with the script as its input and capture the output.
+
+    The program runs in a new temporary directory, removed afterwards,
+    holding copies of the files in data_paths.
+    """
+    with open(script_path) as f:
+        script = f.read()
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    result: Dict[str, Any] = {
+        'script': os.path.basename(script_path),
+        'seed': seed,
+    }
+    work_dir = tempfile.mkdtemp(prefix='basic-session-')
+    old_dir = os.getcwd()
+    start = time.perf_counter()
+    try:
+        for path in data_paths:
+            shutil.copy(path, work_dir)
+        os.chdir(work_dir)
+        interpreter = Interpreter(program_path, engine=engine,
+                                  stdin=script.splitlines(), stdout=stdout,
+                                  stderr=stderr, seed=seed)
+        interpreter.run()
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    else:
+        result['status'] = 'ok'
+    finally:
+        os.chdir(old_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    result['seconds'] = round(time.perf_counter() - start, 6)
+    result['stdout'] = stdout.getvalue()
+    result['stderr'] = stderr.getvalue()
+    return result
+
+
+def run_session_task(
+        task: Tuple[str, str, str, str, List[str]]) -> Dict[str, Any]:
+    return run_session(*task)
+
+
+def run_batch(program_path: str, script_dir: str, results_dir: str,
+              jobs: Optional[int] = None, base_seed: str = '0',
+              engine: str = 'closure',
+              data_dir: str = '.') -> List[Dict[str, Any]]:
+    """Run every script in script_dir and write the results to results_dir.
+
+    Returns the summary, one entry per script in name order.
+    """
+    program_path = os.path.abspath(program_path)
+    # Parsing the program here also warms the disk cache, and lets forked
+    # workers inherit the parsed program. Files missing from data_dir are
+    # left for the program to report.
+    data_paths = [os.path.abspath(os.path.join(data_dir, name))
+                  for name in data_files(program_path)]
+    data_paths = [path for path in data_paths if os.path.isfile(path)]
+    names = sorted(
+        name for name in os.listdir(script_dir)
+        if os.path.isfile(os.path.join(script_dir, name))
+    )
+    tasks = [
+        (program_path, os.path.join(script_dir, name),
+         session_seed(base_seed, name), engine, data_paths)
+        for name in names
+    ]
+    with multiprocessing.Pool(jobs, initializer=load_program,
+                              initargs=(program_path,)) as pool:
+        results = pool.map(run_session_task, tasks)
+    os.makedirs(results_dir, exist_ok=True)
+    summary = []
+    for result in results:
+        base = os.path.join(results_dir, result['script'])
+        with open(base + '.out', 'w') as f:
+            f.write(result.pop('stdout'))
+        with open(base + '.err', 'w') as f:
+            f.write(result.pop('stderr'))
+        summary.append(result)
+    with open(os.path.join(results_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+        f.write('\n')
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    arg_parser = argparse.ArgumentParser(
+        prog='python -m basic.batch',
+        description='Play scripted input sessions of a BASIC program.',
+    )
+    arg_parser.add_argument('script_dir',
+                            help='directory of input scripts, one per session')
+    arg_parser.add_argument('-p', '--program', default=DEFAULT_PROGRAM,
+                            help='BASIC program to run (default: dnd1.basic)')
+    arg_parser.add_argument('-o', '--results', default='batch-results',
+                            help='directory to write outputs and summary.json')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None,
+                            help='worker processes (default: CPU count)')
+    arg_parser.add_argument('-s', '--seed', default='0',
+                            help='base random seed, combined with each'
+                                 ' script name')
+    arg_parser.add_argument('-e', '--engine', default='closure',
+                            choices=Interpreter.ENGINES)
+    arg_parser.add_argument('-d', '--data-dir', default='.',
+                            help='directory holding the files the program'
+                                 ' opens (default: the current directory)')
+    args = arg_parser.parse_args(argv)
+    summary = run_batch(args.program, args.script_dir, args.results,
+                        jobs=args.jobs, base_seed=args.seed,
+                        engine=args.engine, data_dir=args.data_dir)
+    failures = 0
+    for result in summary:
+        if result['status'] == 'ok':
+            print('ok     {script}  {seconds:.3f}s'.format(**result))
+        else:
+            failures += 1
+            print('ERROR  {script}  {error}'.format(**result))
+    print('{} sessions, {} failed; results in {}'.format(
+        len(summary), failures, args.results))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
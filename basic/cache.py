@@ -0,0 +1,102 @@
+import hashlib
+import importlib.util
+import os
+import types
+from typing import Dict
+
+# Derived artifacts are kept in this directory alongside the BASIC source they
+# were produced from.
+CACHE_DIR_NAME = '__basiccache__'
+
+
+def cache_path(source_path: str, tag: str, key: str, ext: str) -> str:
+    source_path = os.path.abspath(source_path)
+    directory = os.path.join(os.path.dirname(source_path), CACHE_DIR_NAME)
+    return os.path.join(directory, artifact_name(
+        os.path.basename(source_path), tag, key, ext))
+
+
+def user_cache_dir() -> str:
+    """Return the directory for artifacts of this package itself, which
+    may be installed read-only: BASIC_CACHE_DIR if set, otherwise basic in
+    XDG_CACHE_HOME or ~/.cache."""
+    directory = os.getenv('BASIC_CACHE_DIR')
+    if directory:
+        return directory
+    base = os.getenv('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'basic')
+
+
+def user_cache_path(name: str, tag: str, key: str, ext: str) -> str:
+    return os.path.join(user_cache_dir(), artifact_name(name, tag, key, ext))
+
+
+def artifact_name(name: str, tag: str, key: str, ext: str) -> str:
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+    return '{}.{}-{}{}'.format(name, tag, digest, ext)
+
+
+# Digests of module source files, by path.
+_module_digests: Dict[str, str] = {}
+
+
+def source_digest(*modules: types.ModuleType) -> str:
+    """Return a digest of the source of the modules, for keys of artifacts
+    which depend on the code that produced them as well as on their input."""
+    digest = hashlib.sha256()
+    for module in modules:
+        path = module.__file__
+        try:
+            module_digest = _module_digests[path]
+        except KeyError:
+            with open(path, 'rb') as f:
+                module_digest = hashlib.sha256(f.read()).hexdigest()
+            _module_digests[path] = module_digest
+        digest.update(module_digest.encode('ascii'))
+    return digest.hexdigest()
+
+
+def write_atomic(path: str, data: bytes) -> bool:
+    # Caching is best-effort: report failure (e.g. a read-only source
+    # directory) rather than raising.
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    except OSError:
+        return False
+    return True
+
+
+def remove_stale(path: str) -> None:
+    """Delete the artifacts with the same source and tag as the one at path
+    but a different key, left behind by earlier versions of the source or
+    of whatever produced them."""
+    directory, name = os.path.split(path)
+    prefix, ext = name.rsplit('-', 1)[0] + '-', os.path.splitext(name)[1]
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for other in names:
+        digest = other[len(prefix):-len(ext)]
+        if (other == name or not other.startswith(prefix)
+                or not other.endswith(ext) or len(digest) != 16):
+            continue
+        stale = [os.path.join(directory, other)]
+        if ext == '.py':
+            # Also the bytecode CPython compiled from it on import.
+            stale.append(importlib.util.cache_from_source(stale[0]))
+        for stale_path in stale:
+            try:
+                os.unlink(stale_path)
+            except OSError:
+                pass
@@ -0,0 +1,180 @@
+"""Control flow graph of a BASIC program.
+
+ControlFlowGraph(program, line_map, next_indices) finds the successors of
+every line, groups lines into basic blocks, and works out which lines can be
+reached from the first. The interpreter uses it to route control past lines
+that do nothing at run time (see is_noop()) and to put off compiling
+unreachable lines.
+
+RETURN goes back to whichever GOSUB called it, so it has no successors of its
+own; instead each GOSUB has both its target and the line after it as
+successors. Likewise NEXT is taken to continue the loop of the FOR it is
+paired with, though at run time it continues the innermost active loop.
+"""
+import weakref
+from typing import Dict, List
+from . import lang
+
+# Graphs built by control_flow_graph(), by id() of the program, dropped when
+# it is.
+_graphs: Dict[int, 'ControlFlowGraph'] = {}
+
+
+def is_noop(statement: lang.Statement) -> bool:
+    """Return whether executing the statement has no effect."""
+    if isinstance(statement, lang.Base):
+        return statement.number == 0
+    return isinstance(statement, (lang.Comment, lang.Data))
+
+
+def skip_noops(lines: List[lang.Line]) -> List[int]:
+    """Return, for each line index, the index of the first line at or after
+    it which isn't a no-op. The list has one more entry than lines, for the
+    end of the program."""
+    indices = list(range(len(lines) + 1))
+    for i in range(len(lines) - 1, -1, -1):
+        if is_noop(lines[i].statement):
+            indices[i] = indices[i + 1]
+    return indices
+
+
+class BasicBlock:
+    """A maximal run of lines, from start up to but not including end, which
+    is only entered at its first line and only left after its last."""
+
+    def __init__(self, start: int, end: int) -> None:
+        self.start = start
+        self.end = end
+        # Start line indices of the blocks control may pass to next, and
+        # come from.
+        self.successors: List[int] = []
+        self.predecessors: List[int] = []
+        self.reachable = False
+
+    @property
+    def falls_through(self) -> bool:
+        # Whether control may run on into the next block in program order.
+        return self.end in self.successors
+
+    def __repr__(self):
+        return "BasicBlock({0.start}, {0.end})".format(self)
+
+
+class ControlFlowGraph:
+
+    def __init__(self, program: lang.Program, line_map: Dict[int, int],
+                 next_indices: Dict[int, int]) -> None:
+        """Build the graph. line_map (line numbers to indices) and
+        next_indices (FOR to NEXT line indices) are those worked out by
+        Interpreter.index_lines() and pair_loops()."""
+        self.lines = program.lines
+        self.line_map = line_map
+        self.next_indices = next_indices
+        self.for_indices = {n: f for f, n in next_indices.items()}
+        self.successors: List[List[int]] = [
+            self.line_successors(i) for i in range(len(self.lines))
+        ]
+        self.reachable = self.find_reachable()
+        self.blocks: List[BasicBlock] = self.find_blocks()
+        self.block_starts: Dict[int, BasicBlock] = {
+            block.start: block for block in self.blocks
+        }
+
+    def line_successors(self, index: int) -> List[int]:
+        # Indices of the lines that may run after this one; the end of the
+        # program isn't a line, so doesn't appear.
+        statement = self.lines[index].statement
+        following = [index + 1] if index + 1 < len(self.lines) else []
+        if isinstance(statement, (lang.Goto, lang.Gosub, lang.If)):
+            target = self.line_map.get(statement.line_number)
+            targets = [target] if target is not None else []
+            if isinstance(statement, lang.Goto):
+                return targets
+            return targets + [i for i in following if i not in targets]
+        if isinstance(statement, (lang.Return, lang.End, lang.Stop)):
+            return []
+        if isinstance(statement, lang.For) and index in self.next_indices:
+            exit_index = self.next_indices[index] + 1
+            if exit_index < len(self.lines):
+                return following + [exit_index]
+        if isinstance(statement, lang.Next) and index in self.for_indices:
+            return [self.for_indices[index] + 1] + following
+        return following
+
+    def find_reachable(self) -> List[bool]:
+        reachable = [False] * len(self.lines)
+        pending = [0] if self.lines else []
+        while pending:
+            index = pending.pop()
+            if reachable[index]:
+                continue
+            reachable[index] = True
+            pending.extend(self.successors[index])
+        return reachable
+
+    def find_blocks(self) -> List[BasicBlock]:
+        num_lines = len(self.lines)
+        # A block starts at the first line, at every jump target, and after
+        # every line that doesn't simply continue to the next.
+        leaders = {0} if num_lines else set()
+        for i, successors in enumerate(self.successors):
+            if successors != [i + 1]:
+                leaders.update(successors)
+                if i + 1 < num_lines:
+                    leaders.add(i + 1)
+        starts = sorted(leaders)
+        blocks = [BasicBlock(start, end)
+                  for start, end in zip(starts, starts[1:] + [num_lines])]
+        by_start = {block.start: block for block in blocks}
+        for block in blocks:
+            block.successors = list(self.successors[block.end - 1])
+            block.reachable = self.reachable[block.start]
+            for start in block.successors:
+                by_start[start].predecessors.append(block.start)
+        return blocks
+
+    def block_of(self, index: int) -> BasicBlock:
+        """Return the block containing the line index."""
+        low, high = 0, len(self.blocks)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.blocks[middle].start <= index:
+                low = middle
+            else:
+                high = middle
+        return self.blocks[low]
+
+    def unreachable_lines(self) -> List[int]:
+        return [i for i, reachable in enumerate(self.reachable)
+                if not reachable]
+
+    def noop_lines(self) -> List[int]:
+        return [i for i, line in enumerate(self.lines)
+                if is_noop(line.statement)]
+
+    def fall_through_chains(self) -> List[List[BasicBlock]]:
+        """Return the blocks grouped into runs in which each block may fall
+        through into the next."""
+        chains: List[List[BasicBlock]] = []
+        chain: List[BasicBlock] = []
+        for block in self.blocks:
+            chain.append(block)
+            if not block.falls_through:
+                chains.append(chain)
+                chain = []
+        if chain:
+            chains.append(chain)
+        return chains
+
+
+def control_flow_graph(program: lang.Program, line_map: Dict[int, int],
+                       next_indices: Dict[int, int]) -> ControlFlowGraph:
+    """Return the graph of the program, building it once per program."""
+    key = id(program)
+    try:
+        return _graphs[key]
+    except KeyError:
+        pass
+    graph = _graphs[key] = ControlFlowGraph(program, line_map, next_indices)
+    weakref.finalize(program, _graphs.pop, key, None)
+    return graph
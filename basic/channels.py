@@ -0,0 +1,123 @@
+import asyncio
+import collections
+from typing import Any, Deque, Iterable, Optional, Union
+
+
+class InputRequired(Exception):
+    """Raised by an input channel with no line ready.
+
+    It propagates out of Interpreter.run() with the program stopped at the
+    INPUT statement; calling run() again once a line is available resumes
+    the program there.
+    """
+
+
+class LineInput:
+    """Input channel reading lines from any iterable of strings.
+
+    This covers lists of lines, open files and io.StringIO objects. A
+    trailing newline is removed from each line, as input() does.
+    """
+
+    def __init__(self, lines: Iterable[str]) -> None:
+        self.lines = iter(lines)
+
+    def read_line(self) -> str:
+        try:
+            line = next(self.lines)
+        except StopIteration:
+            raise EOFError
+        if line.endswith('\n'):
+            line = line[:-1]
+        return line
+
+
+class QueueInput:
+    """Input channel taking lines from a queue.Queue, blocking until one
+    arrives. Putting None on the queue ends the input."""
+
+    def __init__(self, queue: Any) -> None:
+        self.queue = queue
+
+    def read_line(self) -> str:
+        line = self.queue.get()
+        if line is None:
+            raise EOFError
+        return line
+
+
+class QueueOutput:
+    """Output channel putting each chunk of output text on a queue.
+
+    Works with both queue.Queue and asyncio.Queue, as it only calls
+    put_nowait().
+    """
+
+    def __init__(self, queue: Any) -> None:
+        self.queue = queue
+
+    def write(self, text: str) -> None:
+        self.queue.put_nowait(text)
+
+
+class FeedInput:
+    """Input channel holding lines fed to it by the program's driver.
+
+    Reading when no line has been fed raises InputRequired, which suspends
+    the interpreter. After close() reading at the end raises EOFError.
+    """
+
+    def __init__(self) -> None:
+        self.lines: Deque[str] = collections.deque()
+        self.closed = False
+
+    def feed(self, line: str) -> None:
+        self.lines.append(line)
+
+    def close(self) -> None:
+        self.closed = True
+
+    def read_line(self) -> str:
+        if self.lines:
+            return self.lines.popleft()
+        if self.closed:
+            raise EOFError
+        raise InputRequired
+
+
+class AsyncQueueInput(FeedInput):
+    """Input channel for Interpreter.run_async() taking lines from an
+    asyncio.Queue. Putting None on the queue ends the input."""
+
+    def __init__(self, queue: 'asyncio.Queue[Optional[str]]') -> None:
+        super().__init__()
+        self.queue = queue
+
+    def read_line(self) -> str:
+        if not self.lines and not self.closed:
+            try:
+                self.put(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                pass
+        return super().read_line()
+
+    async def wait(self) -> None:
+        # Called by run_async() whenever the interpreter is suspended.
+        self.put(await self.queue.get())
+
+    def put(self, line: Optional[str]) -> None:
+        if line is None:
+            self.close()
+        else:
+            self.feed(line)
+
+
+InputChannel = Union[LineInput, QueueInput, FeedInput]
+
+
+def as_input_channel(source: Any) -> Optional[InputChannel]:
+    """Return source as an input channel; anything with a read_line() method
+    is one already, and any other iterable is read as lines."""
+    if source is None or hasattr(source, 'read_line'):
+        return source
+    return LineInput(source)
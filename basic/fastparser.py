@@ -0,0 +1,683 @@
+from collections.abc import Sequence
+from typing import Any, List, Optional, Tuple, Union
+from . import lang
+
+# Each rule method takes a position in the current line and returns a
+# (result, new position) pair, or None if the rule doesn't match there.
+Match = Optional[Tuple[Any, int]]
+
+
+class BasicSyntaxError(Exception):
+    "The program text could not be parsed."
+
+
+class FastParser:
+    """Hand-written parser equivalent to the Parsley grammar in basic.parser.
+
+    The rules mirror the grammar one for one, including its ordered choices,
+    so both produce identical lang trees; bin/compare_parsers.py checks this.
+    Since every statement fits on one line, lines are parsed independently.
+    """
+
+    def __init__(self) -> None:
+        self.text = ''
+        self.end = 0
+        self.statement_rules = [
+            self.comment, self.base, self.restore, self.let, self.print,
+            self.dim, self.read, self.write, self.file, self.data,
+            self.input, self.for_, self.next, self.if_, self.goto,
+            self.gosub, self.return_, self.stop, self.end_,
+        ]
+
+    def parse(self, text: str) -> lang.Program:
+        chunks = self.split_chunks(text)
+        lines = [self.parse_line(chunk, n) for n, chunk in enumerate(chunks, 1)]
+        return lang.Program(lines)
+
+    def parse_lazy(self, text: str) -> lang.Program:
+        """Parse only the line numbers; see LazyLines."""
+        return lang.Program(LazyLines(self, self.split_chunks(text)))
+
+    def split_chunks(self, text: str) -> List[str]:
+        chunks = text.split('\n')
+        if chunks[-1]:
+            msg = "Line {} is not terminated by a newline".format(len(chunks))
+            raise BasicSyntaxError(msg)
+        return chunks[:-1]
+
+    def parse_line(self, text: str, source_line: int = 1) -> lang.Line:
+        # text is the line without its terminating newline.
+        number, pos = self.split_line(text, source_line)
+        statement = self.parse_statement(text, pos, source_line)
+        return lang.Line(number, statement)
+
+    def split_line(self, text: str, source_line: int = 1) -> Tuple[int, int]:
+        """Return the line's number and the position its statement starts at."""
+        self.text = text
+        self.end = len(text)
+        pos = self.sp(0)
+        m = self.integer(pos)
+        if m is None or not text.startswith(' ', m[1]):
+            self.error(source_line, pos)
+        number, pos = m
+        return number, self.sp(pos + 1)
+
+    def parse_statement(self, text: str, pos: int,
+                        source_line: int = 1) -> lang.Statement:
+        self.text = text
+        self.end = len(text)
+        for rule in self.statement_rules:
+            m = rule(pos)
+            if m is not None:
+                break
+        else:
+            self.error(source_line, pos)
+        statement, pos = m
+        pos = self.sp(pos)
+        if pos != self.end:
+            self.error(source_line, pos)
+        return statement
+
+    def error(self, source_line: int, pos: int) -> None:
+        msg = "Syntax error at line {}, column {}:\n{}\n{}^".format(
+            source_line, pos, self.text, ' ' * pos)
+        raise BasicSyntaxError(msg)
+
+    # Lexical rules.
+
+    def sp(self, pos: int) -> int:
+        text = self.text
+        while pos < self.end and text[pos] == ' ':
+            pos += 1
+        return pos
+
+    def ws(self, pos: int) -> int:
+        text = self.text
+        while pos < self.end and text[pos].isspace():
+            pos += 1
+        return pos
+
+    def digits(self, pos: int) -> int:
+        text = self.text
+        while pos < self.end and text[pos].isdigit():
+            pos += 1
+        return pos
+
+    def integer(self, pos: int) -> Match:
+        end = self.digits(pos)
+        if end == pos:
+            return None
+        return int(self.text[pos:end]), end
+
+    def number(self, pos: int) -> Match:
+        text = self.text
+        int_end = self.digits(pos)
+        if text.startswith('.', int_end):
+            frac_end = self.digits(int_end + 1)
+            if int_end > pos or frac_end > int_end + 1:
+                return float(text[pos:frac_end]), frac_end
+        if int_end > pos:
+            return int(text[pos:int_end]), int_end
+        return None
+
+    def varname(self, pos: int) -> Match:
+        text = self.text
+        if pos < self.end and text[pos].isalpha():
+            end = pos + 1
+            while end < self.end and text[end].isalnum():
+                end += 1
+            return text[pos:end], end
+        return None
+
+    def strvar(self, pos: int) -> Match:
+        m = self.varname(pos)
+        if m is not None and self.text.startswith('$', m[1]):
+            return m[0] + '$', m[1] + 1
+        return None
+
+    def string(self, pos: int) -> Match:
+        text = self.text
+        if text.startswith('"', pos):
+            close = text.find('"', pos + 1)
+            if close > pos + 1:
+                return lang.StringLiteral(text[pos + 1:close]), close + 1
+        return None
+
+    def literal(self, pos: int) -> Match:
+        m = self.number(pos)
+        if m is None:
+            m = self.string(pos)
+        return m
+
+    # Expressions.
+
+    def value(self, pos: int) -> Match:
+        for rule in (self.number, self.builtin, self.num_ref, self.parens,
+                     self.negation):
+            m = rule(pos)
+            if m is not None:
+                return m
+        return None
+
+    def parens(self, pos: int) -> Match:
+        # Quoted tokens in the grammar skip any leading whitespace.
+        pos = self.ws(pos)
+        if self.text.startswith('(', pos):
+            m = self.expr(pos + 1)
+            if m is not None:
+                end = self.ws(m[1])
+                if self.text.startswith(')', end):
+                    return lang.Parens(m[0]), end + 1
+        return None
+
+    def negation(self, pos: int) -> Match:
+        if self.text.startswith('-', pos):
+            m = self.value(pos + 1)
+            if m is not None:
+                return lang.Negation(m[0]), m[1]
+        return None
+
+    BUILTINS = (
+        ('INT', lang.Int), ('ABS', lang.Abs), ('RND', lang.Rnd),
+        ('CLK', lang.Clk),
+    )
+
+    def builtin(self, pos: int) -> Match:
+        text = self.text
+        for name, builtin_class in self.BUILTINS:
+            if text.startswith(name, pos):
+                if text.startswith('(', pos + 3):
+                    m = self.expr(pos + 4)
+                    if m is not None and text.startswith(')', m[1]):
+                        return builtin_class(m[0]), m[1] + 1
+                return None
+        return None
+
+    def expr(self, pos: int) -> Match:
+        m = self.expr2(pos)
+        if m is None:
+            return None
+        left, pos = m
+        text = self.text
+        while True:
+            op_pos = self.ws(pos)
+            if text.startswith('+', op_pos):
+                op_class = lang.Add
+            elif text.startswith('-', op_pos):
+                op_class = lang.Sub
+            else:
+                break
+            m = self.expr2(self.ws(op_pos + 1))
+            if m is None:
+                break
+            left, pos = op_class(left, m[0]), m[1]
+        return left, pos
+
+    def expr2(self, pos: int) -> Match:
+        m = self.value(pos)
+        if m is None:
+            return None
+        left, pos = m
+        text = self.text
+        while True:
+            op_pos = self.ws(pos)
+            if text.startswith('*', op_pos):
+                op_class = lang.Mul
+            elif text.startswith('/', op_pos):
+                op_class = lang.Div
+            else:
+                break
+            m = self.value(self.ws(op_pos + 1))
+            if m is None:
+                break
+            left, pos = op_class(left, m[0]), m[1]
+        return left, pos
+
+    def str_value(self, pos: int) -> Match:
+        m = self.string(pos)
+        if m is None:
+            m = self.str_ref(pos)
+        return m
+
+    def bool(self, pos: int) -> Match:
+        # The grammar's "bool AND bool" and "bool OR bool" alternatives
+        # group to the right, with AND and OR at the same precedence.
+        m = self.bool2(pos)
+        if m is None:
+            return None
+        left, pos = m
+        op_pos = self.sp(pos)
+        for keyword, op_class in (('AND', lang.And), ('OR', lang.Or)):
+            if self.text.startswith(keyword, op_pos):
+                m = self.bool(self.sp(op_pos + len(keyword)))
+                if m is not None:
+                    return op_class(left, m[0]), m[1]
+        return left, pos
+
+    STRING_COMPARISONS = (
+        ('=', lang.StringEqual), ('<>', lang.StringNotEqual),
+    )
+    NUMERIC_COMPARISONS = (
+        ('=', lang.Equal), ('<>', lang.NotEqual), ('<=', lang.LessOrEqual),
+        ('<', lang.Less), ('>=', lang.GreaterOrEqual), ('>', lang.Greater),
+    )
+
+    def bool2(self, pos: int) -> Match:
+        for operand, comparisons in ((self.str_value, self.STRING_COMPARISONS),
+                                     (self.expr, self.NUMERIC_COMPARISONS)):
+            m = operand(pos)
+            if m is None:
+                continue
+            left, left_end = m
+            op_pos = self.sp(left_end)
+            for symbol, op_class in comparisons:
+                if self.text.startswith(symbol, op_pos):
+                    m = operand(self.sp(op_pos + len(symbol)))
+                    if m is not None:
+                        return op_class(left, m[0]), m[1]
+        return None
+
+    # References.
+
+    def indices(self, pos: int) -> Match:
+        text = self.text
+        if not text.startswith('(', pos):
+            return None
+        m = self.expr(pos + 1)
+        if m is None:
+            return None
+        first, pos = m
+        if text.startswith(',', pos):
+            m = self.expr(pos + 1)
+            if m is not None and text.startswith(')', m[1]):
+                return [first, m[0]], m[1] + 1
+        if text.startswith(')', pos):
+            return [first], pos + 1
+        return None
+
+    def num_ref(self, pos: int) -> Match:
+        m = self.varname(pos)
+        if m is None:
+            return None
+        var, pos = m
+        m = self.indices(pos)
+        if m is not None:
+            return lang.Reference(var, m[0]), m[1]
+        return lang.Reference(var), pos
+
+    def num_ref_scalar(self, pos: int) -> Match:
+        m = self.varname(pos)
+        if m is None:
+            return None
+        return lang.Reference(m[0]), m[1]
+
+    def str_ref(self, pos: int) -> Match:
+        m = self.strvar(pos)
+        if m is None:
+            return None
+        var, pos = m
+        m = self.indices(pos)
+        if m is not None:
+            return lang.Reference(var, m[0]), m[1]
+        return lang.Reference(var, None), pos
+
+    def any_ref(self, pos: int) -> Match:
+        m = self.str_ref(pos)
+        if m is None:
+            m = self.num_ref(pos)
+        return m
+
+    def dim_ref(self, pos: int) -> Match:
+        m = self.strvar(pos)
+        if m is None:
+            m = self.varname(pos)
+            if m is None:
+                return None
+        var, pos = m
+        text = self.text
+        if not text.startswith('(', pos):
+            return None
+        m = self.integer(pos + 1)
+        if m is None:
+            return None
+        d1, pos = m
+        if text.startswith(',', pos):
+            m = self.integer(pos + 1)
+            if m is not None and text.startswith(')', m[1]):
+                return lang.Reference(var, [d1, m[0]]), m[1] + 1
+        if text.startswith(')', pos):
+            return lang.Reference(var, [d1]), pos + 1
+        return None
+
+    def fh_literal(self, pos: int) -> Match:
+        if self.text.startswith('#', pos):
+            return self.integer(pos + 1)
+        return None
+
+    def fh_ref(self, pos: int) -> Match:
+        if self.text.startswith('#', pos):
+            m = self.num_ref(pos + 1)
+            if m is not None:
+                return m
+        return self.fh_literal(pos)
+
+    def ref_list(self, rule, pos: int) -> Match:
+        # rule (sp ',' sp rule)*
+        m = rule(pos)
+        if m is None:
+            return None
+        items = [m[0]]
+        pos = m[1]
+        while True:
+            sep = self.sp(pos)
+            if not self.text.startswith(',', sep):
+                break
+            m = rule(self.sp(sep + 1))
+            if m is None:
+                break
+            items.append(m[0])
+            pos = m[1]
+        return items, pos
+
+    # Statements.
+
+    def keyword(self, word: str, pos: int) -> Optional[int]:
+        if self.text.startswith(word, pos):
+            return pos + len(word)
+        return None
+
+    def comment(self, pos: int) -> Match:
+        pos = self.keyword('REM', pos)
+        if pos is None:
+            return None
+        if self.text.startswith(' ', pos):
+            pos = self.sp(pos + 1)
+            return lang.Comment(self.text[pos:]), self.end
+        return lang.Comment(''), pos
+
+    def base(self, pos: int) -> Match:
+        pos = self.keyword('BASE ', pos)
+        if pos is None:
+            return None
+        m = self.integer(self.sp(pos))
+        if m is None:
+            return None
+        return lang.Base(m[0]), m[1]
+
+    def restore(self, pos: int) -> Match:
+        pos = self.keyword('RESTORE ', pos)
+        if pos is None:
+            return None
+        m = self.fh_ref(self.sp(pos))
+        if m is None:
+            return None
+        return lang.Restore(m[0]), m[1]
+
+    def let(self, pos: int) -> Match:
+        after_let = self.keyword('LET ', pos)
+        if after_let is not None:
+            pos = self.sp(after_let)
+        m = self.num_ref(pos)
+        if m is None:
+            return None
+        ref, pos = m
+        pos = self.sp(pos)
+        if not self.text.startswith('=', pos):
+            return None
+        m = self.expr(self.sp(pos + 1))
+        if m is None:
+            return None
+        return lang.Let(ref, m[0]), m[1]
+
+    def print_arg(self, pos: int) -> Match:
+        m = self.str_value(pos)
+        if m is None:
+            m = self.expr(pos)
+        return m
+
+    def print(self, pos: int) -> Match:
+        text = self.text
+        after_print = self.keyword('PRINT ', pos)
+        if after_print is not None:
+            m = self.print_arg(self.sp(after_print))
+            if m is not None:
+                arg1, arg1_end = m
+                pos = self.sp(arg1_end)
+                for separator, control in ((',', lang.Print.ZONE),
+                                           (';', lang.Print.IMMEDIATE)):
+                    args = [arg1]
+                    args_end = pos
+                    while text.startswith(separator, args_end):
+                        m = self.print_arg(self.sp(args_end + 1))
+                        if m is None:
+                            break
+                        args.append(m[0])
+                        args_end = m[1]
+                    if len(args) > 1:
+                        end = self.sp(args_end)
+                        newline = not text.startswith(separator, end)
+                        if not newline:
+                            end += 1
+                        return lang.Print(args, control, newline), end
+                if text.startswith(',', pos):
+                    return lang.Print([arg1], lang.Print.ZONE, False), pos + 1
+                if text.startswith(';', pos):
+                    return (lang.Print([arg1], lang.Print.IMMEDIATE, False),
+                            pos + 1)
+                return lang.Print([arg1], lang.Print.ZONE, True), arg1_end
+        pos = self.keyword('PRINT', pos)
+        if pos is None:
+            return None
+        return lang.Print(), pos
+
+    def dim(self, pos: int) -> Match:
+        pos = self.keyword('DIM ', pos)
+        if pos is None:
+            return None
+        m = self.ref_list(self.dim_ref, self.sp(pos))
+        if m is None:
+            return None
+        return lang.Dim(m[0]), m[1]
+
+    def file_refs(self, word: str, pos: int) -> Match:
+        # Shared by READ and WRITE, which take an optional file handle.
+        pos = self.keyword(word, pos)
+        if pos is None:
+            return None
+        fh = None
+        m = self.fh_ref(self.sp(pos))
+        if m is not None:
+            sep = self.sp(m[1])
+            if self.text.startswith(',', sep):
+                fh = m[0]
+                pos = sep + 1
+        m = self.ref_list(self.any_ref, self.sp(pos))
+        if m is None:
+            return None
+        return (fh, m[0]), m[1]
+
+    def read(self, pos: int) -> Match:
+        m = self.file_refs('READ ', pos)
+        if m is None:
+            return None
+        return lang.Read(*m[0]), m[1]
+
+    def write(self, pos: int) -> Match:
+        m = self.file_refs('WRITE ', pos)
+        if m is None:
+            return None
+        return lang.Write(*m[0]), m[1]
+
+    def filespec(self, pos: int) -> Match:
+        m = self.fh_literal(pos)
+        if m is None or not self.text.startswith('=', m[1]):
+            return None
+        handle = m[0]
+        m = self.string(m[1] + 1)
+        if m is None:
+            return None
+        return lang.FileSpec(handle, m[0]), m[1]
+
+    def file(self, pos: int) -> Match:
+        pos = self.keyword('FILE ', pos)
+        if pos is None:
+            return None
+        m = self.ref_list(self.filespec, self.sp(pos))
+        if m is None:
+            return None
+        return lang.File(m[0]), m[1]
+
+    def data(self, pos: int) -> Match:
+        pos = self.keyword('DATA ', pos)
+        if pos is None:
+            return None
+        m = self.ref_list(self.literal, self.sp(pos))
+        if m is None:
+            return None
+        return lang.Data(m[0]), m[1]
+
+    def input(self, pos: int) -> Match:
+        pos = self.keyword('INPUT ', pos)
+        if pos is None:
+            return None
+        m = self.ref_list(self.any_ref, self.sp(pos))
+        if m is None:
+            return None
+        return lang.Input(m[0]), m[1]
+
+    def for_(self, pos: int) -> Match:
+        pos = self.keyword('FOR ', pos)
+        if pos is None:
+            return None
+        m = self.num_ref_scalar(self.sp(pos))
+        if m is None:
+            return None
+        ref, pos = m
+        pos = self.sp(pos)
+        if not self.text.startswith('=', pos):
+            return None
+        m = self.expr(pos + 1)
+        if m is None:
+            return None
+        start, pos = m
+        pos = self.keyword('TO', self.sp(pos))
+        if pos is None:
+            return None
+        m = self.expr(self.sp(pos))
+        if m is None:
+            return None
+        return lang.For(ref, start, m[0]), m[1]
+
+    def next(self, pos: int) -> Match:
+        pos = self.keyword('NEXT ', pos)
+        if pos is None:
+            return None
+        m = self.num_ref_scalar(self.sp(pos))
+        if m is None:
+            return None
+        return lang.Next(m[0]), m[1]
+
+    def go_to(self, pos: int, space_after: bool) -> Optional[int]:
+        # 'GO' ' '? 'TO', optionally followed by a mandatory space.
+        pos = self.keyword('GO', pos)
+        if pos is None:
+            return None
+        if self.text.startswith(' ', pos):
+            pos += 1
+        return self.keyword('TO ' if space_after else 'TO', pos)
+
+    def if_(self, pos: int) -> Match:
+        pos = self.keyword('IF ', pos)
+        if pos is None:
+            return None
+        m = self.bool(self.sp(pos))
+        if m is None:
+            return None
+        expr, pos = m
+        pos = self.sp(pos)
+        after = self.keyword('THEN', pos)
+        if after is None:
+            after = self.go_to(pos, False)
+            if after is None:
+                return None
+        m = self.integer(self.sp(after))
+        if m is None:
+            return None
+        return lang.If(expr, m[0]), m[1]
+
+    def goto(self, pos: int) -> Match:
+        pos = self.go_to(pos, True)
+        if pos is None:
+            return None
+        m = self.integer(self.sp(pos))
+        if m is None:
+            return None
+        return lang.Goto(m[0]), m[1]
+
+    def gosub(self, pos: int) -> Match:
+        pos = self.keyword('GOSUB ', pos)
+        if pos is None:
+            return None
+        m = self.integer(self.sp(pos))
+        if m is None:
+            return None
+        return lang.Gosub(m[0]), m[1]
+
+    def return_(self, pos: int) -> Match:
+        pos = self.keyword('RETURN', pos)
+        if pos is None:
+            return None
+        return lang.Return(), pos
+
+    def stop(self, pos: int) -> Match:
+        pos = self.keyword('STOP', pos)
+        if pos is None:
+            return None
+        return lang.Stop(), pos
+
+    def end_(self, pos: int) -> Match:
+        pos = self.keyword('END', pos)
+        if pos is None:
+            return None
+        return lang.End(), pos
+
+
+class LazyLines(Sequence):
+    """The lines of a program, each parsed the first time it is accessed.
+
+    Only the line numbers are read up front, so a syntax error in a line is
+    reported when that line is first used rather than at load time. Code
+    scanning for particular statements can call may_be() to skip lines
+    without parsing them.
+    """
+
+    def __init__(self, parser: FastParser, chunks: List[str]) -> None:
+        self.parser = parser
+        self.chunks = chunks
+        self.numbers: List[int] = []
+        self.offsets: List[int] = []
+        for source_line, chunk in enumerate(chunks, 1):
+            number, pos = parser.split_line(chunk, source_line)
+            self.numbers.append(number)
+            self.offsets.append(pos)
+        self.lines: List[Optional[lang.Line]] = [None] * len(chunks)
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        line = self.lines[index]
+        if line is None:
+            if index < 0:
+                index += len(self)
+            statement = self.parser.parse_statement(
+                self.chunks[index], self.offsets[index], index + 1
+            )
+            line = self.lines[index] = lang.Line(self.numbers[index], statement)
+        return line
+
+    def may_be(self, index: int, keywords: Union[str, Tuple[str, ...]]) -> bool:
+        """Return False if line index can't start with any of the keywords."""
+        return self.chunks[index].startswith(keywords, self.offsets[index])
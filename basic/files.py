@@ -0,0 +1,91 @@
+import mmap
+import os
+from typing import List, Optional
+
+
+class FileChannel:
+    """A file opened by the FILE statement, for READ # and WRITE #.
+
+    The file is a sequence of records, one value per line of text. Rather
+    than going to the OS for every value, the whole file is loaded into a
+    list of records when the program first touches it, READ # and WRITE #
+    work on that list, and changes are written back in one go by flush().
+    The interpreter flushes on RESTORE # and whenever run() returns.
+
+    With use_mmap the file is loaded and saved through a memory map instead
+    of read() and write(), which saves copying large files through an
+    intermediate buffer.
+    """
+
+    def __init__(self, path: str, use_mmap: bool = False) -> None:
+        # Fail now, at the FILE statement, if the file can't be opened.
+        with open(path, 'r+b'):
+            pass
+        self.path = path
+        self.use_mmap = use_mmap
+        # Loaded on first use, so FILE itself is cheap.
+        self.records: Optional[List[str]] = None
+        # Index of the record the next READ # or WRITE # applies to.
+        self.position = 0
+        self.dirty = False
+
+    def load(self) -> List[str]:
+        with open(self.path, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            if self.use_mmap and size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    text = str(memoryview(m), 'utf-8')
+            else:
+                text = f.read().decode('utf-8')
+        self.records = text.splitlines()
+        return self.records
+
+    def read(self) -> str:
+        records = self.records
+        if records is None:
+            records = self.load()
+        try:
+            record = records[self.position]
+        except IndexError:
+            raise EOFError
+        self.position += 1
+        return record
+
+    def write(self, record: str) -> None:
+        records = self.records
+        if records is None:
+            records = self.load()
+        if self.position < len(records):
+            records[self.position] = record
+        else:
+            records.append(record)
+        self.position += 1
+        self.dirty = True
+
+    def restore(self) -> None:
+        self.flush()
+        self.position = 0
+
+    def flush(self) -> None:
+        if not self.dirty:
+            return
+        data = ''.join(record + '\n' for record in self.records).encode('utf-8')
+        with open(self.path, 'r+b') as f:
+            if self.use_mmap and data:
+                f.truncate(len(data))
+                with mmap.mmap(f.fileno(), len(data)) as m:
+                    m[:] = data
+                    m.flush()
+            else:
+                f.write(data)
+                f.truncate()
+        self.dirty = False
+
+    def copy(self) -> 'FileChannel':
+        # For Interpreter.fork(): the copy reads and writes independently,
+        # though both write back to the same file.
+        channel = object.__new__(type(self))
+        channel.__dict__.update(self.__dict__)
+        if self.records is not None:
+            channel.records = list(self.records)
+        return channel
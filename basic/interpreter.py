@@ -1,187 +1,758 @@
 import sys
+import copy
+import io
 import os
+import multiprocessing
 import random
+import hashlib
+import time
+import pickle
+import zlib
 import operator
-from typing import Optional, Union, Dict, List, IO
+import array
+from typing import (
+    Optional, Union, Dict, List, IO, Callable, Any, Generator, Tuple
+)
 from . import Parser, lang
+from .fastparser import LazyLines
+from .output import OutputBuffer, NumberFormatter
+from .channels import FeedInput, InputRequired, as_input_channel
+from .files import FileChannel
+from .profiler import Profiler
+from .optimize import optimize_program, optimize_statement
+from .cfg import ControlFlowGraph, control_flow_graph, skip_noops
 
 
 class Interpreter:
 
-    def __init__(self, source_path: str, trace: Optional[bool] = None):
+    ENGINES = ('closure', 'vm', 'python')
+    FILE_BACKENDS = ('buffered', 'mmap')
+    DEFAULT_TRACE_SIZE = 1000
+
+    def __init__(self, source_path: str, trace: Optional[bool] = None,
+                 engine: str = 'closure', lazy: bool = False,
+                 buffer_size: Optional[int] = None, stdin: Any = None,
+                 stdout: Optional[IO[str]] = None,
+                 stderr: Optional[IO[str]] = None,
+                 file_backend: str = 'buffered',
+                 profile: Optional[bool] = None,
+                 profile_output: Optional[str] = None,
+                 trace_size: Optional[int] = None, seed: Any = None):
         self.source_path: str = source_path
+        if engine not in self.ENGINES:
+            raise ValueError("Unknown engine '{}'".format(engine))
+        # BASIC_TRACE and BASIC_PROFILE turn tracing and profiling on where
+        # they aren't given explicitly, but only for the engine that supports
+        # them; the other engines ignore them.
         if trace is None:
-            trace = len(os.getenv('BASIC_TRACE', '')) > 0
+            trace = (engine == 'closure'
+                     and len(os.getenv('BASIC_TRACE', '')) > 0)
+        if trace_size is None and os.getenv('BASIC_TRACE_SIZE'):
+            trace_size = int(os.getenv('BASIC_TRACE_SIZE'))
         self.trace: bool = trace
-
-        self.parser: Parser = Parser()
-        self.scalar_symbols: Dict[str, Union[int, float, str]] = {}
-        self.array_symbols: Dict[str, Array]  = {}
+        if trace and engine != 'closure':
+            raise ValueError("Tracing requires the 'closure' engine")
+        if lazy and engine != 'closure':
+            raise ValueError("Lazy parsing requires the 'closure' engine")
+        if profile is None:
+            profile = (engine == 'closure' and not trace
+                       and len(os.getenv('BASIC_PROFILE', '')) > 0)
+        if profile and engine != 'closure':
+            raise ValueError("Profiling requires the 'closure' engine")
+        if profile and trace:
+            raise ValueError("Profiling and tracing can't be combined")
+        if file_backend not in self.FILE_BACKENDS:
+            raise ValueError("Unknown file backend '{}'".format(file_backend))
+        self.engine: str = engine
+        # Parse and compile each line only when it is first executed.
+        self.lazy: bool = lazy
+
+        self.parser: Parser = Parser(lazy=lazy)
+        if buffer_size is None:
+            buffer_size = OutputBuffer.DEFAULT_LIMIT
+        # INPUT reads lines from stdin, which is an iterable of lines or an
+        # object with a read_line() method (see basic.channels); PRINT writes
+        # to stdout and diagnostics go to stderr. Each defaults to the
+        # corresponding sys stream.
+        self.stdin = as_input_channel(stdin)
+        # Set while suspended at an INPUT whose prompt was already written.
+        self.input_suspended: bool = False
+        self.output: OutputBuffer = OutputBuffer(stdout, limit=buffer_size)
+        self.stderr: Optional[IO[str]] = stderr
+        self.number_formatter: NumberFormatter = NumberFormatter()
+        # RND draws from this, seeded with seed (by default, from the OS), so
+        # that interpreters sharing a process don't disturb one another.
+        self.random: random.Random = random.Random(seed)
+        # Variables are resolved to fixed slots in these lists as the program
+        # is compiled, so that reading or writing one is a plain index.
+        self.scalar_slots: Dict[str, int] = {}
+        self.scalars: List[Union[int, float, str]] = []
+        self.array_slots: Dict[str, int] = {}
+        self.arrays: List[Array] = []
         self.line_index: int = 0
-        self.data_line_index: int = 0
-        self.data_item_index: int = 0
+        # Index of the next item in data_pool for READ to take.
+        self.data_cursor: int = 0
         self.loop_stack: List[LoopFrame] = []
         self.sub_stack: List[SubFrame] = []
-        self.files: Dict[int, IO[str]] = {}
+        # Files opened by FILE, by handle; see basic.files.
+        self.files: Dict[int, FileChannel] = {}
+        self.file_backend: str = file_backend
+        # When tracing, the last lines executed are kept in this ring buffer
+        # as (line index, time.perf_counter()) pairs, overwriting the oldest
+        # once it is full. Nothing is formatted until dump_trace(). Its size
+        # is trace_size, else BASIC_TRACE_SIZE, else DEFAULT_TRACE_SIZE.
+        if trace_size is None:
+            trace_size = self.DEFAULT_TRACE_SIZE
+        self.trace_buffer: List[Optional[Tuple[int, float]]] = (
+            [None] * max(trace_size, 1))
+        # Total number of lines traced.
+        self.trace_count: int = 0
 
         self.parse_source()
+        self.profiler: Optional[Profiler] = None
+        if profile:
+            self.profiler = Profiler(len(self.program.lines))
+            # When the program ends, the report goes to stderr, and the
+            # statistics to PREFIX.json and, for flame graphs, PREFIX.folded.
+            if profile_output is None:
+                profile_output = os.getenv('BASIC_PROFILE_OUTPUT') or (
+                    os.path.basename(source_path) + '.profile')
+            self.profile_output: str = profile_output
+        if engine == 'vm':
+            from .vm import VM
+            self.vm = VM(self)
+        elif engine == 'python':
+            from .transpile import load_module
+            self.transpiled = load_module(self)
+        else:
+            self.compile_program()
 
     def parse_source(self) -> None:
         with open(self.source_path) as f:
-            self.program = self.parser.parse(f.read())
+            self.source_text: str = f.read()
+        # The program as written, for showing lines to the user.
+        self.source_program = self.parser.parse_file(self.source_path,
+                                                     self.source_text)
+        if self.lazy:
+            # Lazy lines are optimized as they are compiled instead.
+            self.program = self.source_program
+        else:
+            self.program = optimize_program(self.source_program)
+        self.index_lines()
+        self.pair_loops()
+        self.collect_data()
+        if self.lazy:
+            # Building it would parse every line.
+            self.cfg: Optional[ControlFlowGraph] = None
+        else:
+            self.cfg = control_flow_graph(self.program, self.line_map,
+                                          self.next_indices)
+
+    def index_lines(self) -> None:
+        # Map line numbers to indices once, and resolve the target of every
+        # branching statement so GOTO/GOSUB/IF don't have to search for it.
+        lines = self.program.lines
+        if isinstance(lines, LazyLines):
+            self.line_numbers: List[int] = lines.numbers
+        else:
+            self.line_numbers = [line.number for line in lines]
+        self.line_map: Dict[int, int] = {}
+        for i, number in enumerate(self.line_numbers):
+            self.line_map.setdefault(number, i)
+        # Control passing to a line which does nothing (a REM, DATA, etc.)
+        # goes straight on to the next line which does something. In lazy
+        # mode the lines aren't known in advance, so none are skipped.
+        if self.lazy:
+            self.skip_to: List[int] = list(range(len(lines) + 1))
+        else:
+            self.skip_to = skip_noops(lines)
+        self.jump_targets: Dict[int, int] = {}
+        if self.lazy:
+            # Resolved as each line is compiled instead.
+            return
+        for i, line in enumerate(lines):
+            if isinstance(line.statement, (lang.Goto, lang.Gosub, lang.If)):
+                self.jump_target(i)
+
+    def jump_target(self, index: int) -> int:
+        try:
+            return self.jump_targets[index]
+        except KeyError:
+            pass
+        line = self.program.lines[index]
+        try:
+            target = self.line_map[line.statement.line_number]
+        except KeyError:
+            msg = ("Line {} referenced on line {} does not exist in"
+                   " this program".format(line.statement.line_number,
+                                          line.number))
+            raise BasicRuntimeError(msg)
+        target = self.jump_targets[index] = self.skip_to[target]
+        return target
+
+    def next_line(self, index: int) -> int:
+        # Index of the line to run after the one at index, if it doesn't
+        # jump.
+        return self.skip_to[index + 1]
+
+    def pair_loops(self) -> None:
+        # Pair every FOR with the NEXT that closes it, matching them like
+        # brackets, so that loops never have to search for their end.
+        self.next_indices: Dict[int, int] = {}
+        lines = self.program.lines
+        open_loops: List[int] = []
+        for i in range(len(lines)):
+            if not self.may_be(i, ('FOR', 'NEXT')):
+                continue
+            st = lines[i].statement
+            if isinstance(st, lang.For):
+                open_loops.append(i)
+            elif isinstance(st, lang.Next):
+                if not open_loops:
+                    msg = ("NEXT statement on line {} has no matching FOR"
+                           .format(self.line_numbers[i]))
+                    raise BasicRuntimeError(msg)
+                for_index = open_loops.pop()
+                for_var = lines[for_index].statement.var_ref.variable
+                if st.var_ref.variable != for_var:
+                    msg = ("NEXT statement on line {} has mismatched variable"
+                           .format(self.line_numbers[i]))
+                    raise BasicRuntimeError(msg)
+                self.next_indices[for_index] = i
+        if open_loops:
+            msg = ("FOR statement on line {} has no matching NEXT"
+                   .format(self.line_numbers[open_loops[0]]))
+            raise BasicRuntimeError(msg)
+
+    def collect_data(self) -> None:
+        # Flatten the values of every DATA statement, in program order, into
+        # a single pool which READ steps through with data_cursor.
+        self.data_pool: List[Union[int, float, str]] = []
+        lines = self.program.lines
+        for i in range(len(lines)):
+            if not self.may_be(i, 'DATA'):
+                continue
+            st = lines[i].statement
+            if isinstance(st, lang.Data):
+                for value in st.values:
+                    if isinstance(value, lang.StringLiteral):
+                        value = value.content
+                    self.data_pool.append(value)
+
+    def may_be(self, index: int, keywords) -> bool:
+        # Lets scans for particular statements skip unparsed lazy lines that
+        # can't match. keywords is a string or tuple of statement prefixes.
+        lines = self.program.lines
+        return not isinstance(lines, LazyLines) or lines.may_be(index, keywords)
+
+    def compile_program(self) -> None:
+        if self.lazy:
+            self.code: List[Callable[[], int]] = [
+                self.compile_on_first_run(i)
+                for i in range(len(self.program.lines))
+            ]
+            return
+        # Lines the control flow graph finds unreachable are compiled only if
+        # they are run after all, e.g. on resuming a snapshot.
+        reachable = self.cfg.reachable
+        self.code = [
+            self.compile_line(i, line) if reachable[i]
+            else self.compile_on_first_run(i)
+            for i, line in enumerate(self.program.lines)
+        ]
+
+    def compile_on_first_run(self, index: int) -> Callable[[], int]:
+        # Placeholder which swaps the compiled line into the code list.
+        def compile_and_run():
+            line = self.program.lines[index]
+            closure = self.code[index] = self.compile_line(index, line)
+            return closure()
+        return compile_and_run
 
     def run(self) -> None:
+        # If the input channel raises InputRequired, it propagates from here
+        # with line_index still on the INPUT statement, and calling run()
+        # again resumes the program.
         try:
-            while self.line_index < len(self.program.lines):
-                self.step()
+            if self.engine == 'vm':
+                self.vm.run()
+            elif self.engine == 'python':
+                self.transpiled.run(self)
+            elif self.profiler is not None:
+                self.profiler.run(self)
+            elif self.trace:
+                self.run_traced()
+            else:
+                code = self.code
+                num_lines = len(code)
+                while self.line_index < num_lines:
+                    self.line_index = code[self.line_index]()
         except ProgramStop:
             pass
-        print("\n< Program terminated >")
+        except InputRequired:
+            raise
+        except (Exception, KeyboardInterrupt):
+            if self.trace:
+                self.dump_trace()
+            raise
+        finally:
+            self.output.flush()
+            self.flush_files()
+            if self.profiler is not None and not self.input_suspended:
+                self.write_profile()
+        self.output.write("\n< Program terminated >\n")
+        self.output.flush()
+
+    async def run_async(self) -> None:
+        """Run the program, awaiting input instead of blocking on it.
+
+        stdin must be a channel with a wait() coroutine which makes a line
+        (or the end of input) available, such as channels.AsyncQueueInput.
+        """
+        while True:
+            try:
+                self.run()
+                return
+            except InputRequired:
+                await self.stdin.wait()
+
+    def run_until_input(self, line: Optional[str] = None) -> Tuple[str, bool]:
+        """Run the program until it waits for input or ends.
+
+        line, if given, is fed to the program first. Returns the text the
+        program wrote since the last call, ending with the INPUT prompt if
+        it is waiting, and whether it is waiting. The text includes any
+        diagnostics, and isn't written to stdout or stderr.
+        """
+        if self.stdin is None:
+            self.stdin = FeedInput()
+        if line is not None:
+            if not isinstance(self.stdin, FeedInput):
+                raise ValueError("Feeding input requires a FeedInput channel")
+            self.stdin.feed(line)
+        captured = io.StringIO()
+        stream, self.output.stream = self.output.stream, captured
+        stderr, self.stderr = self.stderr, captured
+        try:
+            self.run()
+            waiting = False
+        except InputRequired:
+            waiting = True
+        finally:
+            self.output.stream = stream
+            self.stderr = stderr
+        return captured.getvalue(), waiting
+
+    def end_input(self) -> None:
+        """Signal the end of input to a program driven by run_until_input()."""
+        if self.stdin is None:
+            self.stdin = FeedInput()
+        self.stdin.close()
+
+    def session(self) -> Generator[str, Optional[str], str]:
+        """Run the program as a generator.
+
+        Each time the program waits for input, the generator yields the
+        output so far and receives the line to give it via send(); sending
+        None ends the input. The output after the last prompt is the
+        generator's return value.
+        """
+        output, waiting = self.run_until_input()
+        while waiting:
+            line = yield output
+            if line is None:
+                self.end_input()
+            output, waiting = self.run_until_input(line)
+        return output
+
+    def run_traced(self) -> None:
+        code = self.code
+        num_lines = len(code)
+        buffer = self.trace_buffer
+        size = len(buffer)
+        clock = time.perf_counter
+        count = self.trace_count
+        try:
+            while self.line_index < num_lines:
+                index = self.line_index
+                buffer[count % size] = (index, clock())
+                count += 1
+                self.line_index = code[index]()
+        finally:
+            self.trace_count = count
 
     def step(self) -> None:
-        line = self.program.lines[self.line_index]
-        self.exec_line(line)
+        # Executes the current line. The other engines only run whole
+        # programs.
+        if self.engine != 'closure':
+            raise ValueError("Stepping requires the 'closure' engine")
+        if self.trace:
+            self.trace_buffer[self.trace_count % len(self.trace_buffer)] = (
+                self.line_index, time.perf_counter())
+            self.trace_count += 1
+        self.line_index = self.code[self.line_index]()
+
+    def traced_lines(self) -> List[Tuple[int, float]]:
+        """Return the (line index, time.perf_counter()) of each line in the
+        trace buffer, oldest first."""
+        buffer = self.trace_buffer
+        start = self.trace_count % len(buffer)
+        return [entry for entry in buffer[start:] + buffer[:start]
+                if entry is not None]
+
+    def dump_trace(self, stream: Optional[IO[str]] = None) -> None:
+        """Write the lines in the trace buffer to stream (by default
+        stderr), oldest first, with their times relative to the last."""
+        if stream is None:
+            self.output.flush()
+            stream = self.stderr if self.stderr is not None else sys.stderr
+        entries = self.traced_lines()
+        if not entries:
+            return
+        lines = self.source_program.lines
+        stream.write('Last {} of {} lines executed:\n'.format(
+            len(entries), self.trace_count))
+        last_time = entries[-1][1]
+        for index, timestamp in entries:
+            stream.write('{:+.6f}s {:>7} {}\n'.format(
+                timestamp - last_time, self.line_numbers[index],
+                lines[index].statement))
+
+    def write_profile(self) -> None:
+        stream = self.stderr if self.stderr is not None else sys.stderr
+        self.profiler.write_report(self, stream)
+        self.profiler.write_json(self, self.profile_output + '.json')
+        self.profiler.write_collapsed(self, self.profile_output + '.folded')
 
     def current_line_number(self) -> int:
-        return self.program.lines[self.line_index].number
+        return self.line_numbers[self.line_index]
+
+    # Snapshots start with this, followed by the zlib-compressed pickle of a
+    # dict holding only plain data (see snapshot()).
+    SNAPSHOT_MAGIC = b'BASICSNAP1\n'
+
+    def snapshot(self) -> bytes:
+        """Serialize the state of the running program.
+
+        This covers variables, arrays, the current line, the FOR and GOSUB
+        stacks, the DATA cursor, the state of the random number generator
+        and the positions of open files; it doesn't cover the input and output
+        channels. Take it while the program isn't running, e.g. between
+        run_until_input() calls.
+        """
+        self.output.flush()
+        self.flush_files()
+        arrays = {}
+        for name, slot in self.array_slots.items():
+            entry = self.arrays[slot]
+            if isinstance(entry, Array):
+                arrays[name] = entry.state()
+        state = {
+            'program': self.program_digest(),
+            'scalars': {name: self.scalars[slot]
+                        for name, slot in self.scalar_slots.items()},
+            'arrays': arrays,
+            'line_index': self.line_index,
+            'loops': [(frame.for_index, frame.start, frame.end)
+                      for frame in self.loop_stack],
+            'subs': [frame.gosub_index for frame in self.sub_stack],
+            'data_cursor': self.data_cursor,
+            'random': self.random.getstate(),
+            'files': {handle: (f.path, f.position)
+                      for handle, f in self.files.items()},
+            'input_suspended': self.input_suspended,
+        }
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        return self.SNAPSHOT_MAGIC + zlib.compress(data)
+
+    def restore(self, blob: bytes) -> None:
+        """Restore state saved by snapshot() from an interpreter running the
+        same program, so that running continues from where it was taken."""
+        magic = self.SNAPSHOT_MAGIC
+        if not blob.startswith(magic):
+            raise ValueError("Not an interpreter snapshot")
+        state = SnapshotUnpickler(io.BytesIO(zlib.decompress(
+            blob[len(magic):]))).load()
+        if state['program'] != self.program_digest():
+            raise ValueError("Snapshot was taken from a different program")
+        # Compiled code holds references to these containers, so they are
+        # updated in place rather than replaced.
+        for name, value in state['scalars'].items():
+            self.scalars[self.scalar_slot(name)] = value
+        for name, slot in self.array_slots.items():
+            self.arrays[slot] = UndimensionedArray(name)
+        for name, array_state in state['arrays'].items():
+            array_class = StringArray if name.endswith('$') else NumericArray
+            self.arrays[self.array_slot(name)] = array_class.from_state(
+                array_state)
+        self.line_index = state['line_index']
+        lines = self.program.lines
+        self.loop_stack[:] = []
+        for for_index, start, end in state['loops']:
+            var_ref = lines[for_index].statement.var_ref
+            self.loop_stack.append(LoopFrame(
+                var_ref, self.scalar_slot(var_ref.variable), start, end,
+                for_index, self.next_indices[for_index]))
+        self.sub_stack[:] = [SubFrame(index) for index in state['subs']]
+        self.data_cursor = state['data_cursor']
+        self.random.setstate(state['random'])
+        self.flush_files()
+        self.files.clear()
+        for handle, (path, position) in state['files'].items():
+            f = self.files[handle] = self.open_file(path)
+            f.position = position
+        self.input_suspended = state['input_suspended']
+
+    def program_digest(self) -> str:
+        return hashlib.sha256(self.source_text.encode('utf-8')).hexdigest()
+
+    def fork(self) -> 'Interpreter':
+        """Return a copy of this interpreter which continues independently
+        from the current state.
+
+        The copy shares the parsed program and everything derived from it.
+        Arrays are shared until either interpreter writes to one, which
+        then gets its own copy; scalars and the FOR and GOSUB stacks are
+        small enough to copy outright. The child's random number generator
+        starts in the same state as this one's, so the RND values of a
+        branch don't depend on what ran before it. With the closure engine
+        the child compiles each line as it first runs it. A FeedInput
+        channel is replaced by a new empty one; other channels are shared.
+        """
+        self.output.flush()
+        child = object.__new__(type(self))
+        child.__dict__.update(self.__dict__)
+        child.scalar_slots = dict(self.scalar_slots)
+        child.scalars = list(self.scalars)
+        child.array_slots = dict(self.array_slots)
+        for entry in self.arrays:
+            if isinstance(entry, Array):
+                entry.shared = True
+        child.arrays = list(self.arrays)
+        child.loop_stack = list(self.loop_stack)
+        child.sub_stack = list(self.sub_stack)
+        child.files = {handle: f.copy() for handle, f in self.files.items()}
+        child.trace_buffer = list(self.trace_buffer)
+        child.random = random.Random()
+        child.random.setstate(self.random.getstate())
+        child.output = OutputBuffer(self.output.stream, self.output.limit)
+        if isinstance(self.stdin, FeedInput):
+            child.stdin = FeedInput()
+        if self.engine == 'vm':
+            child.vm = copy.copy(self.vm)
+            child.vm.interpreter = child
+        elif self.engine == 'closure':
+            child.code = [child.compile_on_first_run(i)
+                          for i in range(len(self.program.lines))]
+        return child
+
+    def fork_map(self, lines: List[str],
+                 processes: Optional[int] = None) -> List[Tuple[str, bool]]:
+        """Feed each line to its own fork of this interpreter, and return
+        what run_until_input() returned for each.
+
+        The branches run in a pool of worker processes started with
+        os.fork(), so each worker inherits this interpreter with its memory
+        shared copy-on-write by the OS, and only the lines and results are
+        pickled. Needs a platform supporting the 'fork' start method.
+        """
+        global _fork_map_parent
+        self.output.flush()
+        context = multiprocessing.get_context('fork')
+        _fork_map_parent = self
+        try:
+            with context.Pool(processes) as pool:
+                return pool.map(run_fork_branch, lines)
+        finally:
+            _fork_map_parent = None
 
-    def exec_line(self, line: lang.Line):
-        if self.trace:
-            print('>>> {}'.format(line), file=sys.stderr)
+    # Each stmt_* handler compiles a statement into a closure which executes
+    # it and returns the index of the next line to run. Likewise each term_*
+    # handler compiles an expression into a closure returning its value.
+
+    def compile_line(self, index: int, line: lang.Line) -> Callable[[], int]:
         statement = line.statement
+        if self.lazy:
+            statement = optimize_statement(statement)
         statement_name = type(statement).__name__
         handler_name = 'stmt_' + statement_name
         try:
             handler = getattr(self, handler_name)
         except AttributeError:
-            msg = "Interpreter does not implement '{0}'".format(statement_name)
-            raise BasicNotImplementedError(msg)
-        flow_changed = handler(statement)
-        if not flow_changed:
-            self.line_index += 1
+            return self.unimplemented(statement_name)
+        return handler(statement, index)
 
-    def jump_to_line(self, line_number: int):
-        line_iter = (i for i, l in enumerate(self.program.lines)
-                     if l.number == line_number)
+    def compile_expr(self, expr) -> Callable[[], Any]:
+        term_name = type(expr).__name__
+        handler_name = 'term_' + term_name
         try:
-            line_index = next(line_iter)
-        except StopIteration:
-            msg = "Line {} does not exist in this program".format(line_number)
-            raise BasicRuntimeError(msg)
-        self.line_index = line_index
+            handler = getattr(self, handler_name)
+        except AttributeError:
+            return self.unimplemented(term_name)
+        if self.profiler is not None:
+            return self.profiler.time_term(handler_name, handler(expr))
+        return handler(expr)
 
-    def stmt_Base(self, st: lang.Base) -> bool:
-        if st.number != 0:
-            raise BasicNotImplementedError(
-                'Only "Base 0" is currently implemented')
-        return False
+    def unimplemented(self, name: str) -> Callable[[], Any]:
+        # Defer the error until the construct is actually executed.
+        msg = "Interpreter does not implement '{0}'".format(name)
+        def fail():
+            raise BasicNotImplementedError(msg)
+        return fail
+
+    def scalar_slot(self, name: str) -> int:
+        try:
+            return self.scalar_slots[name]
+        except KeyError:
+            slot = self.scalar_slots[name] = len(self.scalars)
+            self.scalars.append('' if name.endswith('$') else 0.0)
+            return slot
 
-    def stmt_Comment(self, st: lang.Comment) -> bool:
-        return False
+    def array_slot(self, name: str) -> int:
+        try:
+            return self.array_slots[name]
+        except KeyError:
+            slot = self.array_slots[name] = len(self.arrays)
+            self.arrays.append(UndimensionedArray(name))
+            return slot
 
-    def stmt_Data(self, st: lang.Data) -> bool:
+    def stmt_Base(self, st: lang.Base, index: int) -> Callable[[], int]:
+        if st.number != 0:
+            msg = 'Only "Base 0" is currently implemented'
+            def base():
+                raise BasicNotImplementedError(msg)
+            return base
+        next_index = self.next_line(index)
+        return lambda: next_index
+
+    def stmt_Comment(self, st: lang.Comment, index: int) -> Callable[[], int]:
+        next_index = self.next_line(index)
+        return lambda: next_index
+
+    def stmt_Data(self, st: lang.Data, index: int) -> Callable[[], int]:
         # This has no direct effect, rather we will scan for Data statements
         # upon execution of Read statements.
-        return False
+        next_index = self.next_line(index)
+        return lambda: next_index
 
-    def stmt_Dim(self, st: lang.Dim) -> bool:
+    def stmt_Dim(self, st: lang.Dim, index: int) -> Callable[[], int]:
+        arrays = []
         for ref in st.var_refs:
             name = ref.variable
             dims = [i + 1 for i in ref.indices]
             array_class = StringArray if name.endswith('$') else NumericArray
             if len(dims) == 1:
                 dims.append(1)
-            array = array_class(dims)
-            self.array_symbols[name] = array
-        return False
-
-    def stmt_End(self, st: lang.End) -> bool:
-        raise ProgramStop
-
-    def stmt_File(self, st: lang.File) -> bool:
-        for fs in st.filespecs:
+            arrays.append((self.array_slot(name), array_class, dims))
+        next_index = self.next_line(index)
+        array_storage = self.arrays
+        def dim():
+            for slot, array_class, dims in arrays:
+                array_storage[slot] = array_class(dims)
+            return next_index
+        return dim
+
+    def stmt_End(self, st: lang.End, index: int) -> Callable[[], int]:
+        def end():
+            raise ProgramStop
+        return end
+
+    def stmt_File(self, st: lang.File, index: int) -> Callable[[], int]:
+        next_index = self.next_line(index)
+        def file():
+            self.open_files(st.filespecs)
+            return next_index
+        return file
+
+    def open_files(self, filespecs: List[lang.FileSpec]) -> None:
+        for fs in filespecs:
             if fs.handle in self.files:
                 msg = "File #{0} already opened".format(fs.handle)
                 raise BasicRuntimeError(msg)
-            name = fs.name.content
-            f = open(name, 'r+')
-            self.files[fs.handle] = f
-        return False
-
-    def stmt_For(self, st: lang.For) -> bool:
-        if (not self.loop_stack or
-            self.loop_stack[-1].for_index != self.line_index):
-            frame = LoopFrame(st.var_ref, self.eval_expr(st.start),
-                              self.eval_expr(st.end), self.line_index,
-                              self.find_next_index(st))
-            self.loop_stack.append(frame)
-            self.write_reference(frame.var_ref, frame.start)
-        else:
-            frame = self.loop_stack[-1]
-        counter = self.read_reference(frame.var_ref)
-        if counter > frame.end:
-            self.line_index = frame.next_index + 1
-            self.loop_stack.pop()
-            return True
-        else:
-            return False
-
-    def find_next_index(self, st: lang.For) -> int:
-        for_var = st.var_ref.variable
-        depth = 0
-        for i, line in enumerate(self.program.lines[self.line_index+1:],
-                                 self.line_index+1):
-            if isinstance(line.statement, lang.For):
-                depth += 1
-            if isinstance(line.statement, lang.Next):
-                if depth > 0:
-                    depth -= 1
-                    continue
-                next_var = line.statement.var_ref.variable
-                if next_var is not None and next_var != for_var:
-                    msg = ("NEXT statement on line {} has mismatched variable"
-                           .format(line.number))
-                    raise BasicRuntimeError(msg)
-                else:
-                    return i
-        msg = ("FOR statement on line {} has no matching NEXT"
-               .format(self.current_line_number()))
-        raise BasicRuntimeError(msg)
-
-    def stmt_Gosub(self, st):
-        frame = SubFrame(self.line_index)
-        self.sub_stack.append(frame)
-        self.jump_to_line(st.line_number)
-        return True
-
-    def stmt_Goto(self, st):
-        self.jump_to_line(st.line_number)
-        return True
-
-    def stmt_If(self, st):
-        result = self.eval_expr(st.expr)
-        if result:
-            self.jump_to_line(st.line_number)
-            return True
-        else:
-            return False
+            self.files[fs.handle] = self.open_file(fs.name.content)
+
+    def open_file(self, path: str) -> FileChannel:
+        try:
+            return FileChannel(path, use_mmap=self.file_backend == 'mmap')
+        except OSError as e:
+            msg = "Can't open file {0}: {1}".format(path, e.strerror)
+            raise BasicRuntimeError(msg)
+
+    def stmt_For(self, st: lang.For, index: int) -> Callable[[], int]:
+        start = self.compile_expr(st.start)
+        end = self.compile_expr(st.end)
+        slot = self.scalar_slot(st.var_ref.variable)
+        scalars = self.scalars
+        next_index = self.next_line(index)
+        loop_next_index = self.next_indices[index]
+        exit_index = self.next_line(loop_next_index)
+        loop_stack = self.loop_stack
+        def for_():
+            # Jumping back to the FOR of the innermost active loop continues
+            # that loop rather than restarting it.
+            if not loop_stack or loop_stack[-1].for_index != index:
+                frame = LoopFrame(st.var_ref, slot, start(), end(), index,
+                                  loop_next_index)
+                loop_stack.append(frame)
+                scalars[slot] = frame.start
+            else:
+                frame = loop_stack[-1]
+            if scalars[slot] > frame.end:
+                loop_stack.pop()
+                return exit_index
+            else:
+                return next_index
+        return for_
+
+    def stmt_Gosub(self, st, index):
+        target = self.jump_target(index)
+        sub_stack = self.sub_stack
+        def gosub():
+            sub_stack.append(SubFrame(index))
+            return target
+        return gosub
+
+    def stmt_Goto(self, st, index):
+        target = self.jump_target(index)
+        return lambda: target
+
+    def stmt_If(self, st, index):
+        target = self.jump_target(index)
+        next_index = self.next_line(index)
+        expr = self.compile_expr(st.expr)
+        def if_():
+            if expr():
+                return target
+            else:
+                return next_index
+        return if_
 
-    def stmt_Input(self, st):
-        num_vars = len(st.var_refs)
+    def stmt_Input(self, st, index):
         is_numeric = [not n.variable.endswith('$') for n in st.var_refs]
+        writers = [self.compile_write(ref) for ref in st.var_refs]
+        next_index = self.next_line(index)
+        def input_():
+            values = self.input_values(is_numeric)
+            for write, value in zip(writers, values):
+                write(value)
+            return next_index
+        return input_
+
+    def input_values(self, is_numeric: List[bool]) -> List[Union[float, str]]:
+        num_vars = len(is_numeric)
         values = []
         while True:
             try:
-                content = input('?')
+                content = self.read_line('?')
             except EOFError:
                 raise ProgramStop
             # FIXME This is wrong - invalid chars terminate numbers and CR
             # terminates strings.
             values = content.split(',')
             if len(values) < num_vars:
-                print("Too few values", file=sys.stderr)
+                self.write_error("Too few values")
             elif len(values) > num_vars:
-                print("Too few values", file=sys.stderr)
+                self.write_error("Too few values")
             else:
                 break
         for i, v in enumerate(values):
@@ -193,102 +764,204 @@ class Interpreter:
                     # Return 0 when we can't parse input as a number.
                     v = 0.0
                 values[i] = v
-        for ref, value in zip(st.var_refs, values):
-            self.write_reference(ref, value)
-        return False
-
-    def stmt_Let(self, st):
-        value = self.eval_expr(st.expression)
-        self.write_reference(st.reference, value)
-        return False
-
-    def stmt_Next(self, st):
-        frame = self.loop_stack[-1]
-        counter = self.read_reference(frame.var_ref)
-        self.write_reference(frame.var_ref, counter + 1)
-        self.line_index = frame.for_index
-        return True
-
-    def stmt_Print(self, st):
-        for arg in st.args:
-            value = self.eval_expr(arg)
-            if not isinstance(value, str):
-                value = "{: .7g}".format(value)
-            if st.control == st.ZONE:
-                sys.stdout.write('%-14s' % value)
+        return values
+
+    def read_line(self, prompt: str) -> str:
+        # Raises EOFError at the end of the input. Whatever supplies the
+        # input may be waiting to see the prompt, so it is flushed first.
+        if not self.input_suspended:
+            self.output.write(prompt)
+        self.output.flush()
+        if self.stdin is None:
+            return input()
+        try:
+            line = self.stdin.read_line()
+        except InputRequired:
+            # Suspend with the prompt showing; resuming doesn't repeat it.
+            self.input_suspended = True
+            raise
+        self.input_suspended = False
+        return line
+
+    def write_error(self, message: str) -> None:
+        # Flush first so the message appears after the output preceding it.
+        self.output.flush()
+        stream = self.stderr if self.stderr is not None else sys.stderr
+        stream.write(message + '\n')
+
+    def stmt_Let(self, st, index):
+        next_index = self.next_line(index)
+        expr = self.compile_expr(st.expression)
+        write = self.compile_write(st.reference)
+        def let():
+            write(expr())
+            return next_index
+        return let
+
+    def stmt_Next(self, st, index):
+        loop_stack = self.loop_stack
+        scalars = self.scalars
+        skip_to = self.skip_to
+        def next_():
+            frame = loop_stack[-1]
+            slot = frame.slot
+            value = scalars[slot] = scalars[slot] + 1
+            if value > frame.end:
+                loop_stack.pop()
+                return skip_to[frame.next_index + 1]
             else:
-                sys.stdout.write(value)
-        if st.newline:
-            sys.stdout.write('\n')
-        return False
-
-    def stmt_Read(self, st):
-        if st.fh is None:
-            for ref in st.var_refs:
-                self.write_reference(ref, self.read_data())
-        else:
-            raise BasicNotImplementedError("Read #X not implemented")
+                return skip_to[frame.for_index + 1]
+        return next_
+
+    def stmt_Print(self, st, index):
+        next_index = self.next_line(index)
+        args = [self.compile_expr(arg) for arg in st.args]
+        zone = st.control == st.ZONE
+        newline = st.newline
+        print_values = self.print_values
+        def print_():
+            print_values([arg() for arg in args], zone, newline)
+            return next_index
+        return print_
+
+    def print_values(self, values: List[Any], zone: bool,
+                     newline: bool) -> None:
+        format_number = self.number_formatter.format
+        parts = []
+        for value in values:
+            if not isinstance(value, str):
+                value = format_number(value)
+            if zone:
+                value = '%-14s' % value
+            parts.append(value)
+        if newline:
+            parts.append('\n')
+        self.output.write(''.join(parts))
+
+    def stmt_Read(self, st, index):
+        next_index = self.next_line(index)
+        writers = [self.compile_write(ref) for ref in st.var_refs]
+        if st.fh is not None:
+            fh = self.compile_expr(st.fh)
+            is_numeric = [not r.variable.endswith('$') for r in st.var_refs]
+            def read_file():
+                values = self.read_file(fh(), is_numeric)
+                for write, value in zip(writers, values):
+                    write(value)
+                return next_index
+            return read_file
+        def read():
+            for write in writers:
+                write(self.read_data())
+            return next_index
+        return read
 
     def read_data(self):
-        while (self.data_line_index < len(self.program.lines)
-               and (not isinstance(self.program.lines[self.data_line_index].statement,
-                                   lang.Data)
-                    or (self.data_item_index >=
-                        len(self.program.lines[self.data_line_index].statement.values)))):
-            self.data_line_index += 1
-            self.data_item_index = 0
-        if self.data_line_index == len(self.program.lines):
+        try:
+            value = self.data_pool[self.data_cursor]
+        except IndexError:
             msg = ("Insufficient DATA statements for READ on line {}"
                    .format(self.current_line_number()))
             raise BasicRuntimeError(msg)
-        data_stmt = self.program.lines[self.data_line_index].statement
-        value = data_stmt.values[self.data_item_index]
-        self.data_item_index += 1
-        if isinstance(value, lang.StringLiteral):
-            value = value.content
+        self.data_cursor += 1
         return value
 
-    def stmt_Restore(self, st):
-        handle = self.eval_expr(st.fh)
-        if handle not in self.files:
+    def stmt_Restore(self, st, index):
+        fh = self.compile_expr(st.fh)
+        next_index = self.next_line(index)
+        def restore():
+            self.restore_file(fh())
+            return next_index
+        return restore
+
+    def restore_file(self, handle) -> None:
+        self.file_channel(int(handle)).restore()
+
+    def stmt_Return(self, st, index):
+        sub_stack = self.sub_stack
+        skip_to = self.skip_to
+        def return_():
+            frame = sub_stack.pop()
+            return skip_to[frame.gosub_index + 1]
+        return return_
+
+    def stmt_Stop(self, st, index):
+        def stop():
+            raise ProgramStop
+        return stop
+
+    def stmt_Write(self, st, index):
+        fh = self.compile_expr(st.fh)
+        args = [self.compile_expr(ref) for ref in st.var_refs]
+        next_index = self.next_line(index)
+        def write_file():
+            self.write_file(fh(), [arg() for arg in args])
+            return next_index
+        return write_file
+
+    def file_channel(self, handle: int) -> FileChannel:
+        try:
+            return self.files[handle]
+        except KeyError:
             raise BasicRuntimeError("File #{0} not open".format(handle))
-        self.files[handle].seek(0)
-        return False
 
-    def stmt_Return(self, st):
-        frame = self.sub_stack.pop()
-        self.line_index = frame.gosub_index + 1
-        return True
+    def read_file(self, handle, is_numeric: List[bool]) -> List[Any]:
+        # Handles computed by expressions arrive as floats.
+        handle = int(handle)
+        f = self.file_channel(handle)
+        values = []
+        for numeric in is_numeric:
+            try:
+                record = f.read()
+            except EOFError:
+                msg = "End of file #{0} on line {1}".format(
+                    handle, self.current_line_number())
+                raise BasicRuntimeError(msg)
+            if numeric:
+                try:
+                    values.append(float(record))
+                except ValueError:
+                    msg = ("Non-numeric value '{0}' in file #{1} on line {2}"
+                           .format(record, handle,
+                                   self.current_line_number()))
+                    raise BasicRuntimeError(msg)
+            else:
+                values.append(record)
+        return values
 
-    def stmt_Stop(self, st):
-        raise ProgramStop
+    def write_file(self, handle, values: List[Any]) -> None:
+        f = self.file_channel(int(handle))
+        for value in values:
+            f.write(value if isinstance(value, str) else repr(value))
 
-    def eval_expr(self, expr):
-        term_name = type(expr).__name__
-        handler_name = 'term_' + term_name
-        try:
-            handler = getattr(self, handler_name)
-        except AttributeError:
-            msg = "Interpreter does not implement '{0}'".format(term_name)
-            raise BasicNotImplementedError(msg)
-        return handler(expr)
+    def flush_files(self) -> None:
+        for f in self.files.values():
+            f.flush()
 
     def term_int(self, expr):
-        return float(expr)
+        # The optimizer makes integer literals floats, so this is a folded
+        # INT, and stays an int as INT's result would.
+        return lambda: expr
 
     def term_float(self, expr):
-        return expr
+        return lambda: expr
 
     def term_StringLiteral(self, expr):
-        return expr.content
+        content = expr.content
+        return lambda: content
 
     def term_Reference(self, expr):
-        return self.read_reference(expr)
+        return self.compile_read(expr)
 
     def math_op(self, expr, op):
-        a = self.eval_expr(expr.a)
-        b = self.eval_expr(expr.b)
-        return op(a, b)
+        a = self.compile_expr(expr.a)
+        # Fold numeric literals on the right-hand side straight into the
+        # closure, as in "X+1".
+        if isinstance(expr.b, (int, float)):
+            b_value = float(expr.b)
+            return lambda: op(a(), b_value)
+        b = self.compile_expr(expr.b)
+        return lambda: op(a(), b())
 
     def term_Add(self, expr):
         return self.math_op(expr, operator.add)
@@ -300,7 +973,7 @@ class Interpreter:
         return self.math_op(expr, operator.mul)
 
     def term_Div(self, expr):
-        return self.math_op(expr, operator.div)
+        return self.math_op(expr, operator.truediv)
 
     def term_Equal(self, expr):
         return self.math_op(expr, operator.eq)
@@ -321,9 +994,12 @@ class Interpreter:
         return self.math_op(expr, operator.ge)
 
     def string_op(self, expr, op):
-        a = self.eval_expr(expr.a).lower()
-        b = self.eval_expr(expr.b).lower()
-        return op(a, b)
+        a = self.compile_expr(expr.a)
+        if isinstance(expr.b, lang.StringLiteral):
+            b_value = expr.b.content.lower()
+            return lambda: op(a().lower(), b_value)
+        b = self.compile_expr(expr.b)
+        return lambda: op(a().lower(), b().lower())
 
     def term_StringEqual(self, expr):
         return self.string_op(expr, operator.eq)
@@ -334,80 +1010,193 @@ class Interpreter:
     # It's unclear what this is supposed to do, and it's only used in dnd1 as an
     # arg to RND (whose arg is explicitly ignored).
     def term_Clk(self, expr):
-        return 0
+        return lambda: 0
 
     def term_Rnd(self, expr):
+        return self.rnd
+
+    def rnd(self) -> float:
         # Produce random floats in the open interval (0, 1)
+        rand = self.random.random
         r = 0.0
         while r == 0.0:
-            r = random.random()
+            r = rand()
         return r
 
     def term_Int(self, expr):
-        return int(self.eval_expr(expr.expression))
-
-    def read_reference(self, reference):
-        name, indices = self.resolve_reference(reference)
-        if indices is None:
-            value = self.scalar_symbols[name]
-        else:
-            value = self.array_symbols[name][indices]
-        return value
-
-    def write_reference(self, reference, value):
-        name, indices = self.resolve_reference(reference)
-        if indices is None:
-            self.scalar_symbols[name] = value
-        else:
-            self.array_symbols[name][indices] = value
+        arg = self.compile_expr(expr.expression)
+        return lambda: int(arg())
 
-    def resolve_reference(self, reference):
-        name = reference.variable
+    def compile_read(self, reference):
         if reference.indices is None:
-            indices = None
-        else:
-            indices = [int(self.eval_expr(i)) for i in reference.indices]
-            if len(indices) == 1:
-                indices.append(0)
-        return name, indices
+            slot = self.scalar_slot(reference.variable)
+            scalars = self.scalars
+            return lambda: scalars[slot]
+        slot = self.array_slot(reference.variable)
+        arrays = self.arrays
+        i1, i2 = self.compile_indices(reference)
+        return lambda: arrays[slot].get(int(i1()), int(i2()))
+
+    def compile_write(self, reference):
+        if reference.indices is None:
+            slot = self.scalar_slot(reference.variable)
+            scalars = self.scalars
+            def write_scalar(value):
+                scalars[slot] = value
+            return write_scalar
+        slot = self.array_slot(reference.variable)
+        arrays = self.arrays
+        i1, i2 = self.compile_indices(reference)
+        def write_element(value):
+            writable_array(arrays, slot).set(int(i1()), int(i2()), value)
+        return write_element
+
+    def compile_indices(self, reference):
+        indices = [self.compile_expr(i) for i in reference.indices]
+        if len(indices) == 1:
+            indices.append(lambda: 0)
+        return indices
 
 
 class Array:
 
+    # An array is shared when interpreters forked from one another all refer
+    # to it. They must then write to a copy instead; see writable_array().
+    __slots__ = ('dim1', 'dim2', 'data', 'shared')
+
     def __init__(self, dims):
         self.dim1, self.dim2 = dims
-        self.data = [self.FILL] * (self.dim1 * self.dim2)
+        self.data = self.allocate(self.dim1 * self.dim2)
+        self.shared = False
+
+    def offset(self, i1, i2):
+        if not (0 <= i1 < self.dim1 and 0 <= i2 < self.dim2):
+            msg = "Array index ({}, {}) out of bounds".format(i1, i2)
+            raise BasicRuntimeError(msg)
+        return i1 * self.dim2 + i2
+
+    def get(self, i1, i2):
+        return self.data[self.offset(i1, i2)]
+
+    def set(self, i1, i2, value):
+        self.data[self.offset(i1, i2)] = value
 
     def __getitem__(self, indices):
-        i1, i2 = indices
-        return self.data[i1 * self.dim2 + i2]
+        return self.get(*indices)
 
     def __setitem__(self, indices, value):
-        i1, i2 = indices
-        self.data[i1 * self.dim2 + i2] = value
+        self.set(*indices, value)
+
+    def state(self):
+        # Plain-data form of the array, for Interpreter.snapshot().
+        return self.dim1, self.dim2, self.pack(self.data)
+
+    @classmethod
+    def from_state(cls, state):
+        other = object.__new__(cls)
+        other.dim1, other.dim2, packed = state
+        other.data = cls.unpack(packed)
+        other.shared = False
+        return other
+
+    def copy(self):
+        other = object.__new__(type(self))
+        other.dim1 = self.dim1
+        other.dim2 = self.dim2
+        other.data = self.data[:]
+        other.shared = False
+        return other
 
     def __repr__(self):
         if self.dim2 == 1:
-            return repr(self.data)
+            return repr(list(self.data))
         else:
             return ',\n'.join([
-                repr(self.data[i * self.dim2 : (i + 1) * self.dim2])
+                repr(list(self.data[i * self.dim2 : (i + 1) * self.dim2]))
                 for i in range(self.dim1)
             ])
 
 
 class NumericArray(Array):
-    FILL = 0
+
+    __slots__ = ()
+
+    # Elements are stored unboxed as C doubles.
+    @staticmethod
+    def allocate(size):
+        return array.array('d', bytes(size * 8))
+
+    @staticmethod
+    def pack(data):
+        return data.tobytes()
+
+    @staticmethod
+    def unpack(packed):
+        return array.array('d', packed)
 
 
 class StringArray(Array):
-    FILL = ''
+
+    __slots__ = ()
+
+    @staticmethod
+    def allocate(size):
+        return [''] * size
+
+    @staticmethod
+    def pack(data):
+        return list(data)
+
+    @staticmethod
+    def unpack(packed):
+        return list(packed)
+
+
+class UndimensionedArray:
+    "Placeholder occupying an array's slot until its DIM statement runs."
+
+    __slots__ = ('name',)
+
+    shared = False
+
+    def __init__(self, name):
+        self.name = name
+
+    def get(self, i1, i2):
+        raise BasicRuntimeError("Array {} used before DIM".format(self.name))
+
+    def set(self, i1, i2, value):
+        raise BasicRuntimeError("Array {} used before DIM".format(self.name))
+
+    def __getitem__(self, indices):
+        return self.get(*indices)
+
+    def __setitem__(self, indices, value):
+        self.set(*indices, value)
+
+
+# The interpreter whose fork_map() is running, inherited by its workers.
+_fork_map_parent: Optional[Interpreter] = None
+
+
+def run_fork_branch(line: str) -> Tuple[str, bool]:
+    return _fork_map_parent.fork().run_until_input(line)
+
+
+def writable_array(arrays, slot):
+    # Return the array in the slot, first replacing it with a private copy if
+    # it is shared with a forked interpreter.
+    array = arrays[slot]
+    if array.shared:
+        array = arrays[slot] = array.copy()
+    return array
 
 
 class LoopFrame:
 
-    def __init__(self, var_ref, start, end, for_index, next_index):
+    def __init__(self, var_ref, slot, start, end, for_index, next_index):
         self.var_ref = var_ref
+        self.slot = slot
         self.start = start
         self.end = end
         self.for_index = for_index
@@ -420,6 +1209,14 @@ class SubFrame:
         self.gosub_index = gosub_index
 
 
+class SnapshotUnpickler(pickle.Unpickler):
+    "Unpickler for snapshots, which refuses anything but plain data."
+
+    def find_class(self, module, name):
+        msg = "Snapshots can't contain {}.{}".format(module, name)
+        raise pickle.UnpicklingError(msg)
+
+
 class ProgramStop(Exception):
     "Signal that the program has executed the STOP statement."
 
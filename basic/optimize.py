@@ -0,0 +1,213 @@
+"""Simplify the expressions in a parsed program before it is compiled.
+
+optimize_program() returns a copy of a program in which every expression has
+been rewritten as follows:
+
+- Integer literals become floats, as all arithmetic is done in floats.
+- Parens nodes are dropped; the tree already encodes the grouping.
+- Arithmetic, comparisons, INT and ABS with constant operands are
+  evaluated, giving a value of the same type as at run time: INT gives an
+  int. Division by zero is left for run time, to fail on its line.
+- Operations which can't change their operand are dropped: X*1, 1*X,
+  X/1, X-0 and --X, where X is known to be a float. (An int X, from INT,
+  would become a float. X+0 and X-(-0) are kept, as each turns -0 into 0.)
+- Negation of anything else becomes multiplication by -1, which gives
+  identical results, so engines need not handle Negation themselves.
+
+Programs are shared between interpreters (see parser._parsed), so nothing is
+modified in place: changed statements are copied, and unchanged lines and
+subtrees are shared with the original.
+"""
+import copy
+import math
+import operator
+import weakref
+from typing import Any, Callable, Dict, Optional, Union
+from . import lang
+
+Number = Union[int, float]
+
+ARITHMETIC = {
+    lang.Add: operator.add,
+    lang.Sub: operator.sub,
+    lang.Mul: operator.mul,
+    lang.Div: operator.truediv,
+}
+
+COMPARISONS = {
+    lang.Equal: operator.eq,
+    lang.NotEqual: operator.ne,
+    lang.Less: operator.lt,
+    lang.LessOrEqual: operator.le,
+    lang.Greater: operator.gt,
+    lang.GreaterOrEqual: operator.ge,
+}
+
+STRING_COMPARISONS = {
+    lang.StringEqual: operator.eq,
+    lang.StringNotEqual: operator.ne,
+}
+
+# As evaluated at run time.
+BUILTINS: Dict[type, Callable[[Number], Number]] = {
+    lang.Int: int,
+    lang.Abs: abs,
+}
+
+# Optimized programs by id() of the original, dropped when it is.
+_optimized: Dict[int, lang.Program] = {}
+
+
+def optimize_program(program: lang.Program) -> lang.Program:
+    key = id(program)
+    try:
+        return _optimized[key]
+    except KeyError:
+        pass
+    lines = []
+    for line in program.lines:
+        statement = optimize_statement(line.statement)
+        if statement is not line.statement:
+            line = lang.Line(line.number, statement)
+        lines.append(line)
+    optimized = lang.Program(lines)
+    _optimized[key] = optimized
+    weakref.finalize(program, _optimized.pop, key, None)
+    return optimized
+
+
+def optimize_statement(statement: Any) -> Any:
+    """Return the statement with its expressions optimized; the statement
+    itself if none changed, otherwise a copy."""
+    changes = {}
+    for name in ('expression', 'expr', 'start', 'end', 'fh'):
+        value = getattr(statement, name, None)
+        if value is not None:
+            changes[name] = optimize_expr(value)
+    if isinstance(statement, lang.Let):
+        changes['reference'] = optimize_reference(statement.reference)
+    elif isinstance(statement, lang.Print):
+        changes['args'] = [optimize_expr(arg) for arg in statement.args]
+    elif isinstance(statement, (lang.Input, lang.Read, lang.Write)):
+        changes['var_refs'] = [optimize_reference(ref)
+                               for ref in statement.var_refs]
+    # DIM's indices are the array bounds, which stay integers.
+    changed = {name: value for name, value in changes.items()
+               if not same(value, getattr(statement, name))}
+    if not changed:
+        return statement
+    statement = copy.copy(statement)
+    for name, value in changed.items():
+        setattr(statement, name, value)
+    return statement
+
+
+def same(a: Any, b: Any) -> bool:
+    if isinstance(a, list):
+        return len(a) == len(b) and all(x is y for x, y in zip(a, b))
+    return a is b
+
+
+def optimize_reference(reference: lang.Reference) -> lang.Reference:
+    if reference.indices is None:
+        return reference
+    indices = [optimize_expr(i) for i in reference.indices]
+    if same(indices, reference.indices):
+        return reference
+    return lang.Reference(reference.variable, indices)
+
+
+def constant(expr: Any) -> Optional[Number]:
+    # Literals are all floats by now; an int is a folded INT. bool is an int
+    # too, but never appears in a parsed program.
+    if isinstance(expr, (int, float)):
+        return expr
+    return None
+
+
+def is_float(expr: Any) -> bool:
+    """Return whether the optimized expression always has a float value.
+
+    Variables may hold ints, from INT, so this is only known of constants
+    and of arithmetic on them.
+    """
+    expr_type = type(expr)
+    if expr_type is float or expr_type is lang.Div or expr_type is lang.Rnd:
+        return True
+    if expr_type in ARITHMETIC:
+        return is_float(expr.a) or is_float(expr.b)
+    return False
+
+
+def optimize_expr(expr: Any) -> Any:
+    expr_type = type(expr)
+    if expr_type is int:
+        return float(expr)
+    if expr_type is lang.Parens:
+        return optimize_expr(expr.expression)
+    if expr_type is lang.Negation:
+        operand = optimize_expr(expr.expression)
+        if constant(operand) is not None:
+            # Like the multiplication below, this makes an int a float.
+            return operand * -1.0
+        if (type(operand) is lang.Mul and operand.b == -1.0
+                and is_float(operand.a)):
+            # An optimized negation.
+            return operand.a
+        return lang.Mul(operand, -1.0)
+    if expr_type in ARITHMETIC:
+        return optimize_arithmetic(expr)
+    if expr_type in COMPARISONS:
+        a = optimize_expr(expr.a)
+        b = optimize_expr(expr.b)
+        if constant(a) is not None and constant(b) is not None:
+            # Only tested by IF, so truth is all that matters.
+            return float(COMPARISONS[expr_type](a, b))
+        return rebuild(expr, a, b)
+    if expr_type in STRING_COMPARISONS:
+        a, b = expr.a, expr.b
+        if type(a) is lang.StringLiteral and type(b) is lang.StringLiteral:
+            return float(STRING_COMPARISONS[expr_type](
+                a.content.lower(), b.content.lower()))
+        return rebuild(expr, optimize_expr(a), optimize_expr(b))
+    if isinstance(expr, lang.BooleanOperator):
+        return rebuild(expr, optimize_expr(expr.a), optimize_expr(expr.b))
+    if isinstance(expr, lang.Builtin):
+        operand = optimize_expr(expr.expression)
+        if expr_type in BUILTINS and constant(operand) is not None:
+            try:
+                return BUILTINS[expr_type](operand)
+            except (OverflowError, ValueError):
+                # INT of infinity or NaN; leave it to fail on its line.
+                pass
+        if operand is expr.expression:
+            return expr
+        return expr_type(operand)
+    if expr_type is lang.Reference:
+        return optimize_reference(expr)
+    return expr
+
+
+def optimize_arithmetic(expr: Any) -> Any:
+    expr_type = type(expr)
+    a = optimize_expr(expr.a)
+    b = optimize_expr(expr.b)
+    a_value = constant(a)
+    b_value = constant(b)
+    if a_value is not None and b_value is not None:
+        if not (expr_type is lang.Div and b_value == 0):
+            return ARITHMETIC[expr_type](a_value, b_value)
+    if b_value == 1.0 and expr_type in (lang.Mul, lang.Div) and is_float(a):
+        return a
+    if a_value == 1.0 and expr_type is lang.Mul and is_float(b):
+        return b
+    if (b_value == 0.0 and math.copysign(1.0, b_value) > 0
+            and expr_type is lang.Sub and is_float(a)):
+        return a
+    return rebuild(expr, a, b)
+
+
+def rebuild(expr: Any, a: Any, b: Any) -> Any:
+    if a is expr.a and b is expr.b:
+        return expr
+    return type(expr)(a, b)
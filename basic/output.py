@@ -0,0 +1,63 @@
+import sys
+from typing import Dict, List, Optional, TextIO, Union
+
+
+class OutputBuffer:
+    """Collects program output in memory and writes it out in large chunks.
+
+    The buffer is flushed when it holds at least limit characters, and
+    whenever flush() is called; the interpreter does so before reading
+    input and when the program ends. A limit of 0 writes through at once.
+    """
+
+    DEFAULT_LIMIT = 8192
+
+    def __init__(self, stream: Optional[TextIO] = None,
+                 limit: int = DEFAULT_LIMIT) -> None:
+        # None means whatever sys.stdout is at the time of each flush.
+        self.stream = stream
+        self.limit = limit
+        self.parts: List[str] = []
+        self.size = 0
+
+    def write(self, text: str) -> None:
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.limit:
+            self.flush()
+
+    def flush(self) -> None:
+        stream = self.stream if self.stream is not None else sys.stdout
+        if self.parts:
+            stream.write(''.join(self.parts))
+            self.parts.clear()
+            self.size = 0
+        # Output channels need only provide write().
+        flush = getattr(stream, 'flush', None)
+        if flush is not None:
+            flush()
+
+
+class NumberFormatter:
+    """Formats numbers for PRINT, caching the text of recently seen values.
+
+    Programs tend to print the same small set of numbers over and over, and
+    a dict lookup is much cheaper than str.format.
+    """
+
+    MAX_ENTRIES = 4096
+
+    def __init__(self) -> None:
+        self.cache: Dict[Union[int, float], str] = {}
+
+    def format(self, value: Union[int, float]) -> str:
+        try:
+            return self.cache[value]
+        except KeyError:
+            pass
+        text = "{: .7g}".format(value)
+        # -0.0 and 0.0 are equal as keys but print differently, and NaN never
+        # matches itself, so leave both out of the cache.
+        if value and value == value and len(self.cache) < self.MAX_ENTRIES:
+            self.cache[value] = text
+        return text
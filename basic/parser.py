@@ -1,5 +1,14 @@
-from . import lang
+import importlib.util
+import os
+import pickle
+import sys
+import threading
+from typing import Dict
+from . import cache, fastparser, lang
+from .fastparser import FastParser
 import parsley # type: ignore
+from ometa.grammar import OMeta # type: ignore
+from ometa.runtime import OMetaBase, writePython # type: ignore
 
 grammar_source = """
 sp = ' '*
@@ -116,13 +125,127 @@ program = line*:lines -> basic.Program(lines)
 
 """
 
+_grammar = None
+_grammar_lock = threading.Lock()
+
+
+def get_grammar(use_cache: bool = True):
+    """Return the Parsley grammar class, building it once per process.
+
+    Compiling grammar_source takes over a second, so the generated Python
+    module is also cached on disk, in cache.user_cache_dir(), and imported
+    from there. If that directory can't be written, the module is only kept
+    in memory.
+    """
+    global _grammar
+    if _grammar is None:
+        with _grammar_lock:
+            if _grammar is None:
+                _grammar = load_grammar(use_cache)
+    return _grammar
+
+
+def load_grammar(use_cache: bool):
+    key = '\0'.join([parsley.__version__, grammar_source])
+    path = cache.user_cache_path('basic', 'grammar', key, '.py')
+    if not (use_cache and os.path.exists(path)):
+        tree = OMeta(grammar_source).parseGrammar('Grammar')
+        source = writePython(tree, grammar_source)
+        if use_cache and cache.write_atomic(path, source.encode('utf-8')):
+            cache.remove_stale(path)
+        else:
+            path = None
+    if path is None:
+        module = {}
+        exec(compile(source, '<basic_grammar>', 'exec'), module)
+        create_parser_class = module['createParserClass']
+    else:
+        spec = importlib.util.spec_from_file_location('basic_grammar', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        create_parser_class = module.createParserClass
+    # The same steps as parsley.makeGrammar, minus the grammar compilation.
+    parser_class = create_parser_class(OMetaBase, {'basic': lang})
+    return parsley.wrapGrammar(parser_class)
+
+
+class ProgramUnpickler(pickle.Unpickler):
+    """Unpickler for the parse cache, which refuses anything but programs.
+
+    Anyone able to write to the cache directory can usually edit the source
+    beside it too, but a planted or corrupt cache file still shouldn't be
+    able to run code.
+    """
+
+    def find_class(self, module, name):
+        if module == lang.__name__ and isinstance(getattr(lang, name, None),
+                                                  type):
+            return getattr(lang, name)
+        msg = "Parsed programs can't contain {}.{}".format(module, name)
+        raise pickle.UnpicklingError(msg)
+
+
+# Programs already parsed or loaded by this process, keyed like the parse
+# cache, so that running many interpreters of one program only loads it once.
+# Interpreters never modify the program tree, so they can share it.
+_parsed: Dict[str, lang.Program] = {}
+
+
 class Parser:
 
-    def __init__(self) -> None:
-        self.grammar = parsley.makeGrammar(
-            grammar_source, {'basic': lang}
-        )
+    # 'fast' is the hand-written FastParser, 'parsley' the grammar above. Both
+    # produce identical programs (see bin/compare_parsers.py).
+    BACKENDS = ('fast', 'parsley')
+
+    def __init__(self, use_cache: bool = True, backend: str = 'fast',
+                 lazy: bool = False) -> None:
+        if backend not in self.BACKENDS:
+            raise ValueError("Unknown parser backend: {}".format(backend))
+        if lazy and backend != 'fast':
+            raise ValueError("Lazy parsing requires the 'fast' backend")
+        self.use_cache = use_cache
+        self.backend = backend
+        # In lazy mode the program's lines are a fastparser.LazyLines, which
+        # parses each statement on first access.
+        self.lazy = lazy
 
     def parse(self, text: str) -> lang.Program:
-        parsley_parser = self.grammar(text)
+        if self.lazy:
+            return FastParser().parse_lazy(text)
+        if self.backend == 'fast':
+            return FastParser().parse(text)
+        # Fetched on first use, so that loading a cached parse never needs it.
+        parsley_parser = get_grammar(self.use_cache)(text)
         return parsley_parser.program()
+
+    def parse_file(self, path: str, text: str) -> lang.Program:
+        """Parse the source text read from path, using the parse cache.
+
+        The pickled program is stored in the cache directory next to the
+        source, keyed on the source text, the backend and the source of the
+        parser and lang modules, and also kept in memory for the rest of the
+        process.
+        """
+        if not self.use_cache or self.lazy:
+            # Splitting a program into lines is cheaper than unpickling it.
+            return self.parse(text)
+        key = '\0'.join([self.backend, cache.source_digest(
+            sys.modules[__name__], fastparser, lang), text])
+        try:
+            return _parsed[key]
+        except KeyError:
+            pass
+        # Tagged with the backend too, so that each keeps its own entry.
+        cache_path = cache.cache_path(path, 'parse.' + self.backend, key,
+                                      '.pickle')
+        try:
+            with open(cache_path, 'rb') as f:
+                program = ProgramUnpickler(f).load()
+        except Exception:
+            # Missing, truncated, stale or refused; fall back to parsing.
+            program = self.parse(text)
+            data = pickle.dumps(program, protocol=pickle.HIGHEST_PROTOCOL)
+            if cache.write_atomic(cache_path, data):
+                cache.remove_stale(cache_path)
+        _parsed[key] = program
+        return program
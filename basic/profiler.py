@@ -0,0 +1,153 @@
+import collections
+import json
+import time
+from typing import Any, Callable, Dict, IO, List, Tuple
+
+
+class Profiler:
+    """Collects statistics on where a program spends its time.
+
+    Interpreter(profile=True), or BASIC_PROFILE=1 in the environment, runs
+    the program through run() below instead of the usual loop. It records,
+    per line, how often it ran and the wall time spent in it; per stmt_*
+    and term_* handler the same (term_* times include those of nested
+    terms); how often each jump between lines was taken; and time by GOSUB
+    call stack, for flame graphs.
+    """
+
+    def __init__(self, num_lines: int) -> None:
+        self.line_counts: List[int] = [0] * num_lines
+        self.line_times: List[float] = [0.0] * num_lines
+        # Keyed by (line index, next line index), for every transfer of
+        # control other than falling through to the next line (skipping
+        # any no-ops, as the interpreter does).
+        self.edges: Dict[Tuple[int, int], int] = collections.Counter()
+        # Keyed by (GOSUB line indices, line index).
+        self.stack_times: Dict[Tuple[Tuple[int, ...], int], float] = (
+            collections.defaultdict(float))
+        # Handler name -> [count, time]; lines are added up by statement
+        # type when the results are gathered.
+        self.term_stats: Dict[str, List[Any]] = {}
+
+    def run(self, interpreter: Any) -> None:
+        code = interpreter.code
+        num_lines = len(code)
+        skip_to = interpreter.skip_to
+        sub_stack = interpreter.sub_stack
+        line_counts = self.line_counts
+        line_times = self.line_times
+        edges = self.edges
+        stack_times = self.stack_times
+        clock = time.perf_counter
+        while interpreter.line_index < num_lines:
+            index = interpreter.line_index
+            line_counts[index] += 1
+            stack = tuple(frame.gosub_index for frame in sub_stack)
+            start = clock()
+            try:
+                next_index = code[index]()
+            finally:
+                # Also timed when the line raises, as END and STOP do.
+                elapsed = clock() - start
+                line_times[index] += elapsed
+                stack_times[stack, index] += elapsed
+            interpreter.line_index = next_index
+            if next_index != skip_to[index + 1]:
+                edges[index, next_index] += 1
+
+    def time_term(self, name: str,
+                  closure: Callable[[], Any]) -> Callable[[], Any]:
+        stats = self.term_stats.setdefault(name, [0, 0.0])
+        clock = time.perf_counter
+        def timed():
+            start = clock()
+            value = closure()
+            stats[0] += 1
+            stats[1] += clock() - start
+            return value
+        return timed
+
+    def results(self, interpreter: Any) -> Dict[str, Any]:
+        """Return the statistics as plain data, with line numbers rather
+        than indices, hottest first."""
+        numbers = interpreter.line_numbers
+        lines = interpreter.source_program.lines
+        line_results = []
+        handlers: Dict[str, List[Any]] = {}
+        for index, count in enumerate(self.line_counts):
+            if not count:
+                continue
+            statement = lines[index].statement
+            name = 'stmt_' + type(statement).__name__
+            line_time = self.line_times[index]
+            line_results.append({
+                'line': numbers[index],
+                'statement': str(statement),
+                'handler': name,
+                'count': count,
+                'time': line_time,
+            })
+            stats = handlers.setdefault(name, [0, 0.0])
+            stats[0] += count
+            stats[1] += line_time
+        handlers.update((name, stats) for name, stats in self.term_stats.items()
+                        if stats[0])
+        line_results.sort(key=lambda r: r['time'], reverse=True)
+        edge_results = [
+            {'from': numbers[a], 'to': numbers[b] if b < len(numbers) else None,
+             'count': count}
+            for (a, b), count in self.edges.items()
+        ]
+        edge_results.sort(key=lambda r: r['count'], reverse=True)
+        return {
+            'program': interpreter.source_path,
+            'total_time': sum(self.line_times),
+            'lines': line_results,
+            'handlers': {
+                name: {'count': count, 'time': handler_time}
+                for name, (count, handler_time) in sorted(
+                    handlers.items(), key=lambda item: item[1][1],
+                    reverse=True)
+            },
+            'edges': edge_results,
+        }
+
+    def write_report(self, interpreter: Any, stream: IO[str],
+                     limit: int = 20) -> None:
+        results = self.results(interpreter)
+        total = results['total_time'] or 1.0
+        write = stream.write
+        write('Profile of {}: {} lines run in {:.6f}s\n'.format(
+            results['program'], sum(self.line_counts), results['total_time']))
+        write('\n{:>7} {:>10} {:>11} {:>7}  {}\n'.format(
+            'line', 'count', 'time (s)', '%', 'statement'))
+        for r in results['lines'][:limit]:
+            write('{:>7} {:>10} {:>11.6f} {:>6.1f}%  {}\n'.format(
+                r['line'], r['count'], r['time'], 100 * r['time'] / total,
+                r['statement']))
+        write('\n{:<20} {:>10} {:>11}\n'.format('handler', 'count',
+                                                 'time (s)'))
+        for name, stats in list(results['handlers'].items())[:limit]:
+            write('{:<20} {:>10} {:>11.6f}\n'.format(name, stats['count'],
+                                                     stats['time']))
+        write('\n{:>7} {:>7} {:>10}\n'.format('from', 'to', 'count'))
+        for r in results['edges'][:limit]:
+            write('{:>7} {:>7} {:>10}\n'.format(
+                r['from'], 'end' if r['to'] is None else r['to'], r['count']))
+
+    def write_json(self, interpreter: Any, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.results(interpreter), f, indent=2)
+            f.write('\n')
+
+    def write_collapsed(self, interpreter: Any, path: str) -> None:
+        # One "frame;frame;frame weight" line per stack, the format read by
+        # flamegraph.pl and speedscope. Frames are GOSUB lines and then the
+        # line itself; weights are in microseconds.
+        numbers = interpreter.line_numbers
+        with open(path, 'w') as f:
+            for (stack, index), stack_time in sorted(self.stack_times.items()):
+                frames = ['GOSUB {}'.format(numbers[i]) for i in stack]
+                frames.append('line {}'.format(numbers[index]))
+                f.write('{} {}\n'.format(';'.join(frames),
+                                         int(stack_time * 1e6)))
@@ -0,0 +1,425 @@
+import importlib.util
+import os
+import sys
+import types
+from typing import Dict, List, Set
+from . import lang, cache, cfg, fastparser, optimize, parser
+from . import interpreter as interpreter_module
+from .interpreter import (
+    LoopFrame, SubFrame, NumericArray, StringArray, BasicNotImplementedError,
+    writable_array
+)
+
+def fail(msg):
+    raise BasicNotImplementedError(msg)
+
+
+# Globals made available to generated modules.
+RUNTIME = {
+    'LoopFrame': LoopFrame,
+    'SubFrame': SubFrame,
+    'NumericArray': NumericArray,
+    'StringArray': StringArray,
+    'fail': fail,
+    'writable_array': writable_array,
+}
+
+
+class Transpiler:
+    """Translates a program into the source of a Python module.
+
+    The module defines run(interpreter), a state machine over the program's
+    basic blocks: a binary search on the current line index selects the block
+    to execute, and control falls straight through the lines within it.
+    Scalars are held in Python locals for the duration of the run.
+    """
+
+    def __init__(self, interpreter) -> None:
+        self.interpreter = interpreter
+        self.program: lang.Program = interpreter.program
+        self.lines: List[str] = []
+        self.scalar_names: Dict[int, str] = {}
+        self.for_slots: List[int] = []
+
+    def transpile(self) -> str:
+        # Generate the body first, so that every local it uses is known when
+        # writing the prologue and epilogue.
+        interpreter = self.interpreter
+        body: List[str] = []
+        self.lines = body
+        starts = self.block_starts()
+        self.emit_dispatch(starts, 0, len(starts), 3)
+        self.lines = []
+        self.emit(0, '# Generated from {} by basic.transpile; do not edit.'
+                  .format(interpreter.source_path))
+        self.emit(0, 'SCALARS = {!r}'.format(
+            sorted(interpreter.scalar_slots, key=interpreter.scalar_slots.get)))
+        self.emit(0, 'ARRAYS = {!r}'.format(
+            sorted(interpreter.array_slots, key=interpreter.array_slots.get)))
+        self.emit(0, '')
+        self.emit(0, 'def run(interpreter):')
+        for name in ('scalars', 'arrays', 'loop_stack', 'sub_stack',
+                     'print_values', 'input_values', 'read_data',
+                     'open_files', 'restore_file', 'read_file', 'write_file',
+                     'rnd'):
+            self.emit(1, '{0} = interpreter.{0}'.format(name))
+        self.emit(1, 'lines = interpreter.program.lines')
+        for slot in sorted(self.scalar_names):
+            self.emit(1, '{} = scalars[{}]'.format(self.scalar_names[slot],
+                                                   slot))
+        self.emit(1, 'L = interpreter.line_index')
+        self.emit(1, 'try:')
+        self.emit(2, 'while True:')
+        self.lines.extend(body)
+        self.emit(1, 'finally:')
+        self.emit(2, 'interpreter.line_index = L')
+        for slot in sorted(self.scalar_names):
+            self.emit(2, 'scalars[{}] = {}'.format(slot,
+                                                   self.scalar_names[slot]))
+        self.emit(0, '')
+        return '\n'.join(self.lines)
+
+    def emit(self, depth: int, text: str) -> None:
+        self.lines.append('    ' * depth + text)
+
+    def scalar(self, name: str) -> str:
+        slot = self.interpreter.scalar_slot(name)
+        if slot not in self.scalar_names:
+            if name.endswith('$'):
+                local = 's_' + name[:-1]
+            else:
+                local = 'v_' + name
+            self.scalar_names[slot] = local
+        return self.scalar_names[slot]
+
+    def block_starts(self) -> List[int]:
+        # A block starts wherever control can arrive other than by falling
+        # through: jump targets, the lines following FOR, GOSUB and NEXT
+        # (jumped to by NEXT, RETURN and loop exits respectively), and INPUT
+        # lines, where a suspended program resumes.
+        interpreter = self.interpreter
+        starts: Set[int] = {0, len(self.program.lines)}
+        starts.update(interpreter.jump_targets.values())
+        for i, line in enumerate(self.program.lines):
+            st = line.statement
+            if isinstance(st, lang.For):
+                starts.add(i + 1)
+                slot = interpreter.scalar_slot(st.var_ref.variable)
+                if slot not in self.for_slots:
+                    self.for_slots.append(slot)
+                self.scalar(st.var_ref.variable)
+            elif isinstance(st, (lang.Gosub, lang.Next)):
+                starts.add(i + 1)
+            elif isinstance(st, lang.Input):
+                starts.add(i)
+        return sorted(starts)
+
+    def emit_dispatch(self, starts: List[int], lo: int, hi: int,
+                      depth: int) -> None:
+        if hi - lo == 1:
+            self.emit_block(starts, lo, depth)
+            return
+        mid = (lo + hi) // 2
+        self.emit(depth, 'if L < {}:'.format(starts[mid]))
+        self.emit_dispatch(starts, lo, mid, depth + 1)
+        self.emit(depth, 'else:')
+        self.emit_dispatch(starts, mid, hi, depth + 1)
+
+    def emit_block(self, starts: List[int], block: int, depth: int) -> None:
+        first = starts[block]
+        num_lines = len(self.program.lines)
+        if first == num_lines:
+            self.emit(depth, 'break')
+            return
+        last = starts[block + 1]
+        for i in range(first, last):
+            line = self.program.lines[i]
+            self.emit(depth, '# {}'.format(line))
+            self.emit(depth, 'L = {}'.format(i))
+            self.emit_statement(i, line.statement, depth)
+            if isinstance(line.statement, (lang.Goto, lang.Return, lang.Next,
+                                           lang.Stop, lang.End)):
+                return
+        self.emit(depth, 'L = {}'.format(last))
+        self.emit(depth, 'continue')
+
+    def emit_statement(self, index: int, st, depth: int) -> None:
+        statement_name = type(st).__name__
+        try:
+            handler = getattr(self, 'stmt_' + statement_name)
+        except AttributeError:
+            self.unimplemented(statement_name, depth)
+            return
+        handler(st, index, depth)
+
+    def unimplemented(self, name: str, depth: int) -> None:
+        msg = "Interpreter does not implement '{0}'".format(name)
+        self.emit(depth, 'fail({!r})'.format(msg))
+
+    def expr(self, expr) -> str:
+        term_name = type(expr).__name__
+        try:
+            handler = getattr(self, 'term_' + term_name)
+        except AttributeError:
+            msg = "Interpreter does not implement '{0}'".format(term_name)
+            return 'fail({!r})'.format(msg)
+        return handler(expr)
+
+    def emit_store(self, reference: lang.Reference, value: str,
+                   depth: int) -> None:
+        if reference.indices is None:
+            self.emit(depth, '{} = {}'.format(self.scalar(reference.variable),
+                                              value))
+        else:
+            slot = self.interpreter.array_slot(reference.variable)
+            i1, i2 = self.indices(reference)
+            self.emit(depth, 'writable_array(arrays, {}).set({}, {}, {})'
+                      .format(slot, i1, i2, value))
+
+    def indices(self, reference: lang.Reference) -> List[str]:
+        indices = ['int({})'.format(self.expr(i)) for i in reference.indices]
+        if len(indices) == 1:
+            indices.append('0')
+        return indices
+
+    def emit_jump(self, target: str, depth: int) -> None:
+        self.emit(depth, 'L = {}'.format(target))
+        self.emit(depth, 'continue')
+
+    def stmt_Base(self, st, index, depth):
+        if st.number != 0:
+            msg = 'Only "Base 0" is currently implemented'
+            self.emit(depth, 'fail({!r})'.format(msg))
+
+    def stmt_Comment(self, st, index, depth):
+        pass
+
+    def stmt_Data(self, st, index, depth):
+        pass
+
+    def stmt_Dim(self, st, index, depth):
+        for ref in st.var_refs:
+            name = ref.variable
+            dims = [i + 1 for i in ref.indices]
+            if len(dims) == 1:
+                dims.append(1)
+            array_class = 'StringArray' if name.endswith('$') else 'NumericArray'
+            slot = self.interpreter.array_slot(name)
+            self.emit(depth, 'arrays[{}] = {}({!r})'
+                      .format(slot, array_class, dims))
+
+    def stmt_End(self, st, index, depth):
+        self.emit(depth, 'break')
+
+    def stmt_File(self, st, index, depth):
+        self.emit(depth, 'open_files(lines[{}].statement.filespecs)'
+                  .format(index))
+
+    def stmt_For(self, st, index, depth):
+        var = self.scalar(st.var_ref.variable)
+        slot = self.interpreter.scalar_slot(st.var_ref.variable)
+        self.emit(depth, 'if not loop_stack or loop_stack[-1].for_index != {}:'
+                  .format(index))
+        self.emit(depth + 1, 'st = lines[{}].statement'.format(index))
+        self.emit(depth + 1, 'frame = LoopFrame(st.var_ref, {}, {}, {}, {}, {})'
+                  .format(slot, self.expr(st.start), self.expr(st.end), index,
+                          self.interpreter.next_indices[index]))
+        self.emit(depth + 1, 'loop_stack.append(frame)')
+        self.emit(depth + 1, '{} = frame.start'.format(var))
+        self.emit(depth, 'else:')
+        self.emit(depth + 1, 'frame = loop_stack[-1]')
+        self.emit(depth, 'if {} > frame.end:'.format(var))
+        self.emit(depth + 1, 'loop_stack.pop()')
+        self.emit_jump('frame.next_index + 1', depth + 1)
+
+    def stmt_Gosub(self, st, index, depth):
+        self.emit(depth, 'sub_stack.append(SubFrame({}))'.format(index))
+        self.emit_jump(str(self.interpreter.jump_targets[index]), depth)
+
+    def stmt_Goto(self, st, index, depth):
+        self.emit_jump(str(self.interpreter.jump_targets[index]), depth)
+
+    def stmt_If(self, st, index, depth):
+        self.emit(depth, 'if {}:'.format(self.expr(st.expr)))
+        self.emit_jump(str(self.interpreter.jump_targets[index]), depth + 1)
+
+    def stmt_Input(self, st, index, depth):
+        is_numeric = [not n.variable.endswith('$') for n in st.var_refs]
+        self.emit(depth, 'values = input_values({!r})'.format(is_numeric))
+        for i, ref in enumerate(st.var_refs):
+            self.emit_store(ref, 'values[{}]'.format(i), depth)
+
+    def stmt_Let(self, st, index, depth):
+        if st.reference.indices is None:
+            self.emit_store(st.reference, self.expr(st.expression), depth)
+        else:
+            # The value is evaluated before the indices.
+            self.emit(depth, 'value = {}'.format(self.expr(st.expression)))
+            self.emit_store(st.reference, 'value', depth)
+
+    def stmt_Next(self, st, index, depth):
+        # The loop variable is that of the innermost active loop, which is
+        # only known at run time.
+        if not self.for_slots:
+            # No FOR to continue; Interpreter.pair_loops() rejects such
+            # programs anyway.
+            msg = 'NEXT without FOR on line {}'.format(
+                self.interpreter.line_numbers[index])
+            self.emit(depth, 'fail({!r})'.format(msg))
+            return
+        self.emit(depth, 'frame = loop_stack[-1]')
+        for n, slot in enumerate(self.for_slots):
+            keyword = 'if' if n == 0 else 'elif'
+            self.emit(depth, '{} frame.slot == {}:'.format(keyword, slot))
+            var = self.scalar_names[slot]
+            self.emit(depth + 1, '{} += 1'.format(var))
+            self.emit(depth + 1, 'done = {} > frame.end'.format(var))
+        self.emit(depth, 'if done:')
+        self.emit(depth + 1, 'loop_stack.pop()')
+        self.emit_jump('frame.next_index + 1', depth + 1)
+        self.emit_jump('frame.for_index + 1', depth)
+
+    def stmt_Print(self, st, index, depth):
+        args = ', '.join(self.expr(arg) for arg in st.args)
+        self.emit(depth, 'print_values([{}], {!r}, {!r})'
+                  .format(args, st.control == st.ZONE, st.newline))
+
+    def stmt_Read(self, st, index, depth):
+        self.emit(depth, 'interpreter.line_index = {}'.format(index))
+        if st.fh is not None:
+            is_numeric = [not r.variable.endswith('$') for r in st.var_refs]
+            self.emit(depth, 'values = read_file({}, {!r})'
+                      .format(self.expr(st.fh), is_numeric))
+            for i, ref in enumerate(st.var_refs):
+                self.emit_store(ref, 'values[{}]'.format(i), depth)
+            return
+        for ref in st.var_refs:
+            self.emit(depth, 'value = read_data()')
+            self.emit_store(ref, 'value', depth)
+
+    def stmt_Restore(self, st, index, depth):
+        self.emit(depth, 'restore_file({})'.format(self.expr(st.fh)))
+
+    def stmt_Return(self, st, index, depth):
+        self.emit_jump('sub_stack.pop().gosub_index + 1', depth)
+
+    def stmt_Stop(self, st, index, depth):
+        self.emit(depth, 'break')
+
+    def stmt_Write(self, st, index, depth):
+        args = ', '.join(self.expr(ref) for ref in st.var_refs)
+        self.emit(depth, 'write_file({}, [{}])'.format(self.expr(st.fh), args))
+
+    def term_int(self, expr):
+        # A folded INT; see Interpreter.term_int().
+        return repr(expr)
+
+    def term_float(self, expr):
+        return repr(expr)
+
+    def term_StringLiteral(self, expr):
+        return repr(expr.content)
+
+    def term_Reference(self, expr):
+        if expr.indices is None:
+            return self.scalar(expr.variable)
+        slot = self.interpreter.array_slot(expr.variable)
+        i1, i2 = self.indices(expr)
+        return 'arrays[{}].get({}, {})'.format(slot, i1, i2)
+
+    def math_op(self, expr, op):
+        return '({} {} {})'.format(self.expr(expr.a), op, self.expr(expr.b))
+
+    def term_Add(self, expr):
+        return self.math_op(expr, '+')
+
+    def term_Sub(self, expr):
+        return self.math_op(expr, '-')
+
+    def term_Mul(self, expr):
+        return self.math_op(expr, '*')
+
+    def term_Div(self, expr):
+        return self.math_op(expr, '/')
+
+    def term_Equal(self, expr):
+        return self.math_op(expr, '==')
+
+    def term_NotEqual(self, expr):
+        return self.math_op(expr, '!=')
+
+    def term_Less(self, expr):
+        return self.math_op(expr, '<')
+
+    def term_LessOrEqual(self, expr):
+        return self.math_op(expr, '<=')
+
+    def term_Greater(self, expr):
+        return self.math_op(expr, '>')
+
+    def term_GreaterOrEqual(self, expr):
+        return self.math_op(expr, '>=')
+
+    def string_op(self, expr, op):
+        if isinstance(expr.b, lang.StringLiteral):
+            b = repr(expr.b.content.lower())
+        else:
+            b = '{}.lower()'.format(self.expr(expr.b))
+        return '({}.lower() {} {})'.format(self.expr(expr.a), op, b)
+
+    def term_StringEqual(self, expr):
+        return self.string_op(expr, '==')
+
+    def term_StringNotEqual(self, expr):
+        return self.string_op(expr, '!=')
+
+    def term_Clk(self, expr):
+        return '0'
+
+    def term_Rnd(self, expr):
+        return 'rnd()'
+
+    def term_Int(self, expr):
+        return 'int({})'.format(self.expr(expr.expression))
+
+
+def generator_digest():
+    # The generated code depends on the parser, the optimizer, the control
+    # flow graph and the interpreter's tables as well as on this module, so
+    # cached modules are keyed on the source of all of them.
+    return cache.source_digest(sys.modules[__name__], lang, parser,
+                               fastparser, optimize, cfg, interpreter_module)
+
+
+def load_module(interpreter):
+    """Return the transpiled module for the interpreter's program.
+
+    The generated source is cached in the cache directory next to the BASIC
+    source, keyed on the source text and on the code generating it (see
+    generator_digest()), and imported from there so that CPython also caches
+    its bytecode.
+    """
+    key = '\0'.join([generator_digest(), interpreter.source_text])
+    path = cache.cache_path(interpreter.source_path, 'python', key, '.py')
+    if not os.path.exists(path):
+        source = Transpiler(interpreter).transpile()
+        if cache.write_atomic(path, source.encode('utf-8')):
+            cache.remove_stale(path)
+        else:
+            path = None
+    if path is None:
+        module = types.ModuleType('basic_transpiled')
+        module.__dict__.update(RUNTIME)
+        exec(compile(source, '<basic_transpiled>', 'exec'), module.__dict__)
+    else:
+        spec = importlib.util.spec_from_file_location('basic_transpiled', path)
+        module = importlib.util.module_from_spec(spec)
+        module.__dict__.update(RUNTIME)
+        spec.loader.exec_module(module)
+    # A cached module was generated against the same slot layout, which a
+    # fresh interpreter reproduces by allocating the slots in order.
+    for name in module.SCALARS:
+        interpreter.scalar_slot(name)
+    for name in module.ARRAYS:
+        interpreter.array_slot(name)
+    return module
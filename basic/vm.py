@@ -0,0 +1,581 @@
+import bisect
+from typing import Any, Dict, List, Tuple
+from . import lang
+from .interpreter import (
+    LoopFrame, SubFrame, NumericArray, StringArray, BasicNotImplementedError
+)
+
+# Opcodes. Operands, where an instruction has any, follow it inline in the
+# code list. Register operands (d for the destination, a and b for sources)
+# index the register file; jump operands are code offsets; line operands
+# are indices into the program's lines; k operands index the constant pool.
+# Opcodes are numbered in groups of eight, most frequently executed first,
+# for the dispatch in VM.run().
+ADD = 0          # d, a, b
+NEXT = 1         # increments and tests the loop variable itself
+LOAD_ELEM = 2    # d, array slot, i1, i2
+STORE_ELEM = 3   # array slot, i1, i2, a
+MOVE = 4         # d, a
+SUB = 5          # d, a, b
+MUL = 6          # d, a, b
+JUMP = 7         # target
+# Comparisons fused with IF's jump: a, b, target.
+JUMP_LT = 8
+JUMP_EQ = 9
+JUMP_NE = 10
+JUMP_STR_EQ = 11  # the operands are lower-cased first
+JUMP_STR_NE = 12
+JUMP_GT = 13
+JUMP_LE = 14
+JUMP_GE = 15
+GOSUB = 16       # line, target
+RETURN = 17
+INT = 18         # d, a
+DIV = 19         # d, a, b
+READ_DATA = 20   # line, d
+FOR_TEST = 21    # scalar slot
+FOR_START = 22   # line, target of the FOR_TEST if the loop is already active
+FOR_ENTER = 23   # k of the For statement, scalar slot, line, start, end
+RND = 24         # d
+PRINT = 25       # count, k of (zone, newline), then count registers
+JUMP_IF = 26     # a, target
+INPUT = 27       # k of the is_numeric list, first of consecutive registers
+DIM = 28         # k of [(slot, array class, dims), ...]
+EQ = 29          # d, a, b
+NE = 30          # d, a, b
+LT = 31          # d, a, b
+LE = 32          # d, a, b
+GT = 33          # d, a, b
+GE = 34          # d, a, b
+STR_EQ = 35      # d, a, b; the operands are lower-cased first
+STR_NE = 36      # d, a, b
+FILE = 37        # k of the filespecs
+RESTORE = 38     # a (the handle)
+READ_FILE = 39   # line, handle, k of the is_numeric list, first register
+WRITE_FILE = 40  # handle, count, then count registers
+FAIL = 41        # k of the error message
+HALT = 42
+
+ARITHMETIC = {
+    lang.Add: ADD, lang.Sub: SUB, lang.Mul: MUL, lang.Div: DIV,
+    lang.Equal: EQ, lang.NotEqual: NE, lang.Less: LT,
+    lang.LessOrEqual: LE, lang.Greater: GT, lang.GreaterOrEqual: GE,
+    lang.StringEqual: STR_EQ, lang.StringNotEqual: STR_NE,
+}
+
+CONDITIONAL_JUMPS = {
+    lang.Equal: JUMP_EQ, lang.NotEqual: JUMP_NE, lang.Less: JUMP_LT,
+    lang.LessOrEqual: JUMP_LE, lang.Greater: JUMP_GT,
+    lang.GreaterOrEqual: JUMP_GE, lang.StringEqual: JUMP_STR_EQ,
+    lang.StringNotEqual: JUMP_STR_NE,
+}
+
+
+class VM:
+    """Register machine executing a program lowered to linear bytecode.
+
+    The register file holds the program's scalar variables, in their
+    interpreter slots, followed by its constants and then temporaries for
+    intermediate results. Each instruction reads its operands from registers
+    and writes its result straight to one, so a statement such as
+    "LET T=T+J" or "IF K<300 THEN 40" is a single instruction.
+
+    The VM shares its arrays, stacks, files and I/O with the interpreter
+    that created it. Scalars are copied into the register file when run()
+    starts and back when it returns, so either engine sees the same program
+    state between runs.
+    """
+
+    def __init__(self, interpreter) -> None:
+        self.interpreter = interpreter
+        self.code: List[int] = []
+        self.consts: List[Any] = []
+        self.const_index: Dict[Tuple[type, Any], int] = {}
+        # Values of the constant registers, and where each is.
+        self.const_values: List[Any] = []
+        self.const_registers: Dict[Tuple[type, str], int] = {}
+        self.num_temps = 0
+        self.max_temps = 0
+        # Code offset at which each line starts, plus the offset of the final
+        # HALT for falling off the end of the program.
+        self.line_offsets: List[int] = []
+        self.fixups: List[int] = []
+        self.lower(interpreter.program)
+
+    def lower(self, program: lang.Program) -> None:
+        for i, line in enumerate(program.lines):
+            self.line_offsets.append(len(self.code))
+            self.num_temps = 0
+            self.lower_statement(i, line.statement)
+        self.line_offsets.append(len(self.code))
+        self.code.append(HALT)
+        # Jumps were emitted with line indices; turn them into code offsets.
+        for pos in self.fixups:
+            self.code[pos] = self.line_offsets[self.code[pos]]
+        # Constant and temporary registers were emitted as negative numbers
+        # (see const_register() and temp()), as the number of scalars
+        # preceding them wasn't known until now.
+        self.num_scalars = len(self.interpreter.scalars)
+        num_consts = len(self.const_values)
+        code = self.code
+        for pos, word in enumerate(code):
+            if word < 0:
+                if word % 2:
+                    code[pos] = self.num_scalars + (-word - 1) // 2
+                else:
+                    code[pos] = self.num_scalars + num_consts + (-word - 2) // 2
+        # The register file after the scalars, as each run starts with it.
+        self.registers = self.const_values + [None] * self.max_temps
+
+    def emit(self, *words: int) -> None:
+        self.code.extend(words)
+
+    def emit_jump(self, op: int, *operands: int) -> None:
+        # The last operand is the target line index.
+        self.code.append(op)
+        self.code.extend(operands)
+        self.fixups.append(len(self.code) - 1)
+
+    def const(self, value: Any) -> int:
+        key = (type(value), value)
+        try:
+            return self.const_index[key]
+        except (KeyError, TypeError):
+            pass
+        self.consts.append(value)
+        index = len(self.consts) - 1
+        try:
+            self.const_index[key] = index
+        except TypeError:
+            # Unhashable constants (lists of filespecs etc.) aren't shared.
+            pass
+        return index
+
+    def const_register(self, value: Any) -> int:
+        # Keyed on repr() so that 0.0 and -0.0 get separate registers.
+        key = (type(value), repr(value))
+        try:
+            index = self.const_registers[key]
+        except KeyError:
+            index = self.const_registers[key] = len(self.const_values)
+            self.const_values.append(value)
+        return -(2 * index + 1)
+
+    def temp(self) -> int:
+        # Temporaries are reused from one statement to the next.
+        index = self.num_temps
+        self.num_temps += 1
+        self.max_temps = max(self.max_temps, self.num_temps)
+        return -(2 * index + 2)
+
+    def emit_fail(self, msg: str) -> None:
+        self.emit(FAIL, self.const(msg))
+
+    def unimplemented(self, name: str) -> None:
+        self.emit_fail("Interpreter does not implement '{0}'".format(name))
+
+    def lower_statement(self, index: int, st: lang.Statement) -> None:
+        statement_name = type(st).__name__
+        try:
+            handler = getattr(self, 'stmt_' + statement_name)
+        except AttributeError:
+            self.unimplemented(statement_name)
+            return
+        handler(st, index)
+
+    def value(self, expr) -> int:
+        """Return the register holding the value of expr, emitting code to
+        compute it into a temporary if it isn't in one already."""
+        expr_type = type(expr)
+        if expr_type is lang.Reference and expr.indices is None:
+            return self.interpreter.scalar_slot(expr.variable)
+        if expr_type is int:
+            # A folded INT; see Interpreter.term_int().
+            return self.const_register(expr)
+        if expr_type is float:
+            return self.const_register(expr)
+        if expr_type is lang.StringLiteral:
+            return self.const_register(expr.content)
+        if expr_type is lang.Clk:
+            return self.const_register(0)
+        register = self.temp()
+        self.lower_expr(expr, register)
+        return register
+
+    def lower_expr(self, expr, dest: int) -> None:
+        # Emit code computing expr into the register dest.
+        term_name = type(expr).__name__
+        try:
+            handler = getattr(self, 'term_' + term_name)
+        except AttributeError:
+            self.unimplemented(term_name)
+            return
+        handler(expr, dest)
+
+    def lower_store(self, reference: lang.Reference, register: int) -> None:
+        if reference.indices is None:
+            slot = self.interpreter.scalar_slot(reference.variable)
+            self.emit(MOVE, slot, register)
+        else:
+            i1, i2 = self.indices(reference)
+            self.emit(STORE_ELEM, self.interpreter.array_slot(
+                reference.variable), i1, i2, register)
+
+    def indices(self, reference: lang.Reference) -> List[int]:
+        indices = [self.value(i) for i in reference.indices]
+        if len(indices) == 1:
+            indices.append(self.const_register(0))
+        return indices
+
+    def stmt_Base(self, st, index):
+        if st.number != 0:
+            self.emit_fail('Only "Base 0" is currently implemented')
+
+    def stmt_Comment(self, st, index):
+        pass
+
+    def stmt_Data(self, st, index):
+        pass
+
+    def stmt_Dim(self, st, index):
+        arrays = []
+        for ref in st.var_refs:
+            name = ref.variable
+            dims = [i + 1 for i in ref.indices]
+            array_class = StringArray if name.endswith('$') else NumericArray
+            if len(dims) == 1:
+                dims.append(1)
+            slot = self.interpreter.array_slot(name)
+            arrays.append((slot, array_class, dims))
+        self.emit(DIM, self.const(arrays))
+
+    def stmt_End(self, st, index):
+        self.emit(HALT)
+
+    def stmt_File(self, st, index):
+        self.emit(FILE, self.const(st.filespecs))
+
+    def stmt_For(self, st, index):
+        slot = self.interpreter.scalar_slot(st.var_ref.variable)
+        self.emit(FOR_START, index, 0)
+        start_pos = len(self.code) - 1
+        start = self.value(st.start)
+        end = self.value(st.end)
+        self.emit(FOR_ENTER, self.const(st), slot, index, start, end)
+        self.code[start_pos] = len(self.code)
+        self.emit(FOR_TEST, slot)
+
+    def stmt_Gosub(self, st, index):
+        self.emit_jump(GOSUB, index, self.interpreter.jump_targets[index])
+
+    def stmt_Goto(self, st, index):
+        self.emit_jump(JUMP, self.interpreter.jump_targets[index])
+
+    def stmt_If(self, st, index):
+        target = self.interpreter.jump_targets[index]
+        expr = st.expr
+        if type(expr) in CONDITIONAL_JUMPS:
+            a = self.value(expr.a)
+            b = self.value(expr.b)
+            self.emit_jump(CONDITIONAL_JUMPS[type(expr)], a, b, target)
+        else:
+            self.emit_jump(JUMP_IF, self.value(expr), target)
+
+    def stmt_Input(self, st, index):
+        is_numeric = [not n.variable.endswith('$') for n in st.var_refs]
+        registers = [self.temp() for _ in st.var_refs]
+        self.emit(INPUT, self.const(is_numeric), registers[0])
+        for ref, register in zip(st.var_refs, registers):
+            self.lower_store(ref, register)
+
+    def stmt_Let(self, st, index):
+        reference = st.reference
+        if reference.indices is None:
+            slot = self.interpreter.scalar_slot(reference.variable)
+            self.lower_expr(st.expression, slot)
+        else:
+            # The value is evaluated before the indices.
+            self.lower_store(reference, self.value(st.expression))
+
+    def stmt_Next(self, st, index):
+        self.emit(NEXT)
+
+    def stmt_Print(self, st, index):
+        registers = [self.value(arg) for arg in st.args]
+        flags = (st.control == st.ZONE, st.newline)
+        self.emit(PRINT, len(registers), self.const(flags), *registers)
+
+    def stmt_Read(self, st, index):
+        if st.fh is not None:
+            is_numeric = [not r.variable.endswith('$') for r in st.var_refs]
+            handle = self.value(st.fh)
+            registers = [self.temp() for _ in st.var_refs]
+            self.emit(READ_FILE, index, handle, self.const(is_numeric),
+                      registers[0])
+            for ref, register in zip(st.var_refs, registers):
+                self.lower_store(ref, register)
+            return
+        for ref in st.var_refs:
+            if ref.indices is None:
+                slot = self.interpreter.scalar_slot(ref.variable)
+                self.emit(READ_DATA, index, slot)
+            else:
+                register = self.temp()
+                self.emit(READ_DATA, index, register)
+                self.lower_store(ref, register)
+
+    def stmt_Restore(self, st, index):
+        self.emit(RESTORE, self.value(st.fh))
+
+    def stmt_Return(self, st, index):
+        self.emit(RETURN)
+
+    def stmt_Stop(self, st, index):
+        self.emit(HALT)
+
+    def stmt_Write(self, st, index):
+        handle = self.value(st.fh)
+        registers = [self.value(ref) for ref in st.var_refs]
+        self.emit(WRITE_FILE, handle, len(registers), *registers)
+
+    def move(self, expr, dest):
+        self.emit(MOVE, dest, self.value(expr))
+
+    term_int = move
+    term_float = move
+    term_StringLiteral = move
+    term_Clk = move
+
+    def term_Reference(self, expr, dest):
+        if expr.indices is None:
+            self.move(expr, dest)
+            return
+        i1, i2 = self.indices(expr)
+        self.emit(LOAD_ELEM, dest, self.interpreter.array_slot(expr.variable),
+                  i1, i2)
+
+    def binary_op(self, expr, dest):
+        a = self.value(expr.a)
+        b = self.value(expr.b)
+        self.emit(ARITHMETIC[type(expr)], dest, a, b)
+
+    term_Add = binary_op
+    term_Sub = binary_op
+    term_Mul = binary_op
+    term_Div = binary_op
+    term_Equal = binary_op
+    term_NotEqual = binary_op
+    term_Less = binary_op
+    term_LessOrEqual = binary_op
+    term_Greater = binary_op
+    term_GreaterOrEqual = binary_op
+    term_StringEqual = binary_op
+    term_StringNotEqual = binary_op
+
+    def term_Rnd(self, expr, dest):
+        self.emit(RND, dest)
+
+    def term_Int(self, expr, dest):
+        self.emit(INT, dest, self.value(expr.expression))
+
+    def run(self) -> None:
+        interpreter = self.interpreter
+        code = self.code
+        consts = self.consts
+        offsets = self.line_offsets
+        num_scalars = self.num_scalars
+        scalars = interpreter.scalars
+        regs = scalars[:num_scalars]
+        regs.extend(self.registers)
+        arrays = interpreter.arrays
+        loop_stack = interpreter.loop_stack
+        sub_stack = interpreter.sub_stack
+        next_indices = interpreter.next_indices
+        rnd = interpreter.rnd
+        pc = offsets[interpreter.line_index]
+        try:
+            while True:
+                op = code[pc]
+                # A chain of comparisons is the fastest dispatch CPython
+                # offers; checking the group first keeps each chain short.
+                if op < 8:
+                    if op == ADD:
+                        regs[code[pc + 1]] = (regs[code[pc + 2]]
+                                              + regs[code[pc + 3]])
+                        pc += 4
+                    elif op == NEXT:
+                        frame = loop_stack[-1]
+                        slot = frame.slot
+                        value = regs[slot] = regs[slot] + 1
+                        if value > frame.end:
+                            loop_stack.pop()
+                            pc = offsets[frame.next_index + 1]
+                        else:
+                            pc = offsets[frame.for_index + 1]
+                    elif op == LOAD_ELEM:
+                        regs[code[pc + 1]] = arrays[code[pc + 2]].get(
+                            int(regs[code[pc + 3]]), int(regs[code[pc + 4]]))
+                        pc += 5
+                    elif op == STORE_ELEM:
+                        # writable_array(), inlined: the call costs a
+                        # quarter of a loop storing to an array.
+                        slot = code[pc + 1]
+                        array = arrays[slot]
+                        if array.shared:
+                            array = arrays[slot] = array.copy()
+                        array.set(int(regs[code[pc + 2]]),
+                                  int(regs[code[pc + 3]]), regs[code[pc + 4]])
+                        pc += 5
+                    elif op == MOVE:
+                        regs[code[pc + 1]] = regs[code[pc + 2]]
+                        pc += 3
+                    elif op == SUB:
+                        regs[code[pc + 1]] = (regs[code[pc + 2]]
+                                              - regs[code[pc + 3]])
+                        pc += 4
+                    elif op == MUL:
+                        regs[code[pc + 1]] = (regs[code[pc + 2]]
+                                              * regs[code[pc + 3]])
+                        pc += 4
+                    else:
+                        pc = code[pc + 1]
+                elif op < 16:
+                    a = regs[code[pc + 1]]
+                    b = regs[code[pc + 2]]
+                    if op == JUMP_LT:
+                        taken = a < b
+                    elif op == JUMP_EQ:
+                        taken = a == b
+                    elif op == JUMP_NE:
+                        taken = a != b
+                    elif op == JUMP_STR_EQ:
+                        taken = a.lower() == b.lower()
+                    elif op == JUMP_STR_NE:
+                        taken = a.lower() != b.lower()
+                    elif op == JUMP_GT:
+                        taken = a > b
+                    elif op == JUMP_LE:
+                        taken = a <= b
+                    else:
+                        taken = a >= b
+                    if taken:
+                        pc = code[pc + 3]
+                    else:
+                        pc += 4
+                elif op < 24:
+                    if op == GOSUB:
+                        sub_stack.append(SubFrame(code[pc + 1]))
+                        pc = code[pc + 2]
+                    elif op == RETURN:
+                        frame = sub_stack.pop()
+                        pc = offsets[frame.gosub_index + 1]
+                    elif op == INT:
+                        regs[code[pc + 1]] = int(regs[code[pc + 2]])
+                        pc += 3
+                    elif op == DIV:
+                        regs[code[pc + 1]] = (regs[code[pc + 2]]
+                                              / regs[code[pc + 3]])
+                        pc += 4
+                    elif op == READ_DATA:
+                        interpreter.line_index = code[pc + 1]
+                        regs[code[pc + 2]] = interpreter.read_data()
+                        pc += 3
+                    elif op == FOR_TEST:
+                        frame = loop_stack[-1]
+                        if regs[code[pc + 1]] > frame.end:
+                            loop_stack.pop()
+                            pc = offsets[frame.next_index + 1]
+                        else:
+                            pc += 2
+                    elif op == FOR_START:
+                        if (loop_stack
+                                and loop_stack[-1].for_index == code[pc + 1]):
+                            pc = code[pc + 2]
+                        else:
+                            pc += 3
+                    else:
+                        st = consts[code[pc + 1]]
+                        slot = code[pc + 2]
+                        index = code[pc + 3]
+                        start = regs[code[pc + 4]]
+                        frame = LoopFrame(st.var_ref, slot, start,
+                                          regs[code[pc + 5]], index,
+                                          next_indices[index])
+                        loop_stack.append(frame)
+                        regs[slot] = start
+                        pc += 6
+                elif op == RND:
+                    regs[code[pc + 1]] = rnd()
+                    pc += 2
+                elif op == PRINT:
+                    count = code[pc + 1]
+                    zone, newline = consts[code[pc + 2]]
+                    start = pc + 3
+                    interpreter.print_values(
+                        [regs[r] for r in code[start:start + count]],
+                        zone, newline)
+                    pc = start + count
+                elif op == JUMP_IF:
+                    if regs[code[pc + 1]]:
+                        pc = code[pc + 2]
+                    else:
+                        pc += 3
+                elif op == INPUT:
+                    values = interpreter.input_values(consts[code[pc + 1]])
+                    first = code[pc + 2]
+                    regs[first:first + len(values)] = values
+                    pc += 3
+                elif op == DIM:
+                    for slot, array_class, dims in consts[code[pc + 1]]:
+                        arrays[slot] = array_class(dims)
+                    pc += 2
+                elif op < FILE:
+                    a = regs[code[pc + 2]]
+                    b = regs[code[pc + 3]]
+                    if op == EQ:
+                        value = a == b
+                    elif op == NE:
+                        value = a != b
+                    elif op == LT:
+                        value = a < b
+                    elif op == LE:
+                        value = a <= b
+                    elif op == GT:
+                        value = a > b
+                    elif op == GE:
+                        value = a >= b
+                    elif op == STR_EQ:
+                        value = a.lower() == b.lower()
+                    else:
+                        value = a.lower() != b.lower()
+                    regs[code[pc + 1]] = value
+                    pc += 4
+                elif op == FILE:
+                    interpreter.open_files(consts[code[pc + 1]])
+                    pc += 2
+                elif op == RESTORE:
+                    interpreter.restore_file(regs[code[pc + 1]])
+                    pc += 2
+                elif op == READ_FILE:
+                    interpreter.line_index = code[pc + 1]
+                    values = interpreter.read_file(regs[code[pc + 2]],
+                                                   consts[code[pc + 3]])
+                    first = code[pc + 4]
+                    regs[first:first + len(values)] = values
+                    pc += 5
+                elif op == WRITE_FILE:
+                    count = code[pc + 2]
+                    start = pc + 3
+                    interpreter.write_file(
+                        regs[code[pc + 1]],
+                        [regs[r] for r in code[start:start + count]])
+                    pc = start + count
+                elif op == FAIL:
+                    raise BasicNotImplementedError(consts[code[pc + 1]])
+                else:
+                    break
+        finally:
+            scalars[:num_scalars] = regs[:num_scalars]
+            # Leave the interpreter pointing at the line being executed, for
+            # error reporting.
+            interpreter.line_index = bisect.bisect_right(offsets, pc) - 1
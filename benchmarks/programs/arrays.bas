@@ -0,0 +1,14 @@
+10 REM ARRAY READS AND WRITES
+20 DIM A(100),D(50,50)
+30 LET T=0
+40 FOR N=1 TO 20
+50 FOR I=0 TO 50
+60 FOR J=0 TO 50
+70 LET D(I,J)=I*J+N
+80 LET T=T+D(I,J)-D(J,I)
+90 NEXT J
+100 LET A(I)=A(I)+D(I,I)
+110 NEXT I
+120 NEXT N
+130 PRINT T;A(50)
+140 END
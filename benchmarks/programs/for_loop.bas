@@ -0,0 +1,9 @@
+10 REM TIGHT NESTED FOR LOOPS
+20 LET T=0
+30 FOR I=1 TO 200
+40 FOR J=1 TO 500
+50 LET T=T+J
+60 NEXT J
+70 NEXT I
+80 PRINT T
+90 END
@@ -0,0 +1,12 @@
+10 REM GOTO AND GOSUB HEAVY CONTROL FLOW
+20 LET K=0
+30 LET N=0
+40 GOSUB 100
+50 IF K<30000 THEN 40
+60 PRINT K;N
+70 END
+100 LET K=K+1
+110 IF K-INT(K/2)*2=0 THEN 140
+120 GO TO 150
+140 LET N=N+1
+150 RETURN
@@ -0,0 +1,17 @@
+10 REM STRING COMPARISONS
+20 DIM W$(8)
+30 FOR I=1 TO 8
+40 READ W$(I)
+50 NEXT I
+60 LET C=0
+70 FOR N=1 TO 3000
+80 FOR I=1 TO 8
+90 IF W$(I)="TROLL" THEN 120
+100 IF W$(I)<>"GNOME" THEN 120
+110 LET C=C+1
+120 NEXT I
+130 NEXT N
+140 PRINT C
+150 END
+200 DATA "MAN","GOBLIN","TROLL","SKELETON","BALROG","OCHRE JELLY"
+210 DATA "GREY OOZE","GNOME"
@@ -0,0 +1,313 @@
+"""Benchmark the parser and interpreter.
+
+    python benchmarks/run.py [-o RESULTS.json] [-r REPEAT] [-k FILTER]
+                             [--compare BASELINE.json]
+
+Each benchmark is run REPEAT times and its best time kept. Interpreter
+benchmarks also record how many BASIC statements a run executes, and so
+statements per second. Results are saved as JSON; with --compare, each is
+also shown relative to the same benchmark in an earlier results file.
+
+The benchmarks are:
+
+grammar.*   building the Parsley grammar, from scratch and from the disk
+            cache
+parse.*     Parser.parse on dnd1.basic and on synthetic programs of various
+            sizes, with each backend (Parsley only up to 1000 lines)
+run.*       running benchmarks/programs/*.bas, and a generated program of
+            DATA reads, on each engine
+session.*   playing benchmarks/sessions/*.txt through dnd1.basic on each
+            engine, from constructing the Interpreter to the end of the
+            input
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from basic import Parser  # noqa: E402
+from basic import parser as basic_parser  # noqa: E402
+from basic.interpreter import Interpreter  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DND1 = os.path.join(ROOT, 'dnd1.basic')
+SYNTHETIC_SIZES = (100, 1000, 10000)
+# Parsley takes several seconds for dnd1.basic alone, so it skips programs
+# larger than this.
+PARSLEY_MAX_LINES = 1000
+DATA_READS = 20000
+
+# A benchmark is a name and a function which runs it once, returning the
+# time taken by the part being measured.
+Benchmark = Tuple[str, Callable[[], float]]
+
+
+def timed(func: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def synthetic_program(num_lines: int) -> str:
+    # A mix of the statement forms found in dnd1.basic.
+    templates = [
+        'LET X{0}=INT(RND(0)*20+1)',
+        'IF X{0}<>{0} THEN {1}',
+        'PRINT "LINE";X{0};Y{0}',
+        'DIM A{0}(10,10)',
+        'FOR I=1 TO {0}',
+        'NEXT I',
+        'GOSUB {1}',
+        'READ #1,A{0}(I,J)',
+        'IF Q$="YES" THEN {1}',
+        'REM SYNTHETIC LINE {0}',
+    ]
+    lines = []
+    for i in range(num_lines):
+        statement = templates[i % len(templates)].format(i, (i + 1) * 10)
+        lines.append('{} {}\n'.format((i + 1) * 10, statement))
+    return ''.join(lines)
+
+
+def data_program() -> str:
+    values_per_line = 10
+    lines = ['10 FOR I=1 TO {}\n'.format(DATA_READS),
+             '20 READ X\n', '30 LET T=T+X\n', '40 NEXT I\n',
+             '50 PRINT T\n', '60 END\n']
+    for n in range(DATA_READS // values_per_line):
+        values = ','.join(str(n + v) for v in range(values_per_line))
+        lines.append('{} DATA {}\n'.format(100 + n, values))
+    return ''.join(lines)
+
+
+def grammar_benchmarks() -> Iterator[Benchmark]:
+    # load_grammar() bypasses the per-process grammar, so each call does
+    # the full work.
+    yield ('grammar.build',
+           lambda: timed(lambda: basic_parser.load_grammar(False)))
+    basic_parser.load_grammar(True)
+    yield ('grammar.cached',
+           lambda: timed(lambda: basic_parser.load_grammar(True)))
+
+
+def parse_benchmarks() -> Iterator[Benchmark]:
+    with open(DND1) as f:
+        sources = [('dnd1', f.read())]
+    for size in SYNTHETIC_SIZES:
+        sources.append(('synthetic{}'.format(size), synthetic_program(size)))
+    for name, text in sources:
+        for backend in Parser.BACKENDS:
+            if backend == 'parsley' and text.count('\n') > PARSLEY_MAX_LINES:
+                continue
+            parser = Parser(use_cache=False, backend=backend)
+            yield ('parse.{}.{}'.format(name, backend),
+                   lambda parser=parser, text=text: timed(
+                       lambda: parser.parse(text)))
+        parser = Parser(use_cache=False, lazy=True)
+        yield ('parse.{}.lazy'.format(name),
+               lambda parser=parser, text=text: timed(
+                   lambda: parser.parse(text)))
+
+
+def run_program(path: str, engine: str) -> float:
+    interpreter = Interpreter(path, engine=engine, stdout=io.StringIO())
+    return timed(interpreter.run)
+
+
+def count_statements(path: str) -> int:
+    # A trace buffer of one entry still counts every line executed.
+    interpreter = Interpreter(path, trace=True, trace_size=1,
+                              stdout=io.StringIO())
+    interpreter.run()
+    return interpreter.trace_count
+
+
+def run_benchmarks(work_dir: str,
+                   statements: Dict[str, int]) -> Iterator[Benchmark]:
+    programs_dir = os.path.join(HERE, 'programs')
+    paths = [os.path.join(programs_dir, name)
+             for name in sorted(os.listdir(programs_dir))
+             if name.endswith('.bas')]
+    data_path = os.path.join(work_dir, 'data.bas')
+    with open(data_path, 'w') as f:
+        f.write(data_program())
+    paths.append(data_path)
+    for path in paths:
+        program = os.path.splitext(os.path.basename(path))[0]
+        count = count_statements(path)
+        for engine in Interpreter.ENGINES:
+            name = 'run.{}.{}'.format(program, engine)
+            statements[name] = count
+            yield (name, lambda path=path, engine=engine: run_program(
+                path, engine))
+
+
+def play_session(script: str, engine: str, game_dir: str) -> float:
+    # Every run starts from the same empty saved game.
+    open(os.path.join(game_dir, 'GMSTR'), 'w').close()
+    start = time.perf_counter()
+    interpreter = Interpreter(DND1, engine=engine,
+                              stdin=script.splitlines(),
+                              stdout=io.StringIO(), stderr=io.StringIO(),
+                              seed=0)
+    interpreter.run()
+    return time.perf_counter() - start
+
+
+def session_benchmarks(game_dir: str) -> Iterator[Benchmark]:
+    # dnd1.basic opens its dungeon files relative to the current directory;
+    # give it empty dungeons to play in.
+    for n in range(1, 7):
+        with open(os.path.join(game_dir, 'DNG{}'.format(n)), 'w') as f:
+            f.write('0\n' * 26 * 26)
+    sessions_dir = os.path.join(HERE, 'sessions')
+    for name in sorted(os.listdir(sessions_dir)):
+        with open(os.path.join(sessions_dir, name)) as f:
+            script = f.read()
+        session = os.path.splitext(name)[0]
+        for engine in Interpreter.ENGINES:
+            yield ('session.{}.{}'.format(session, engine),
+                   lambda script=script, engine=engine: play_session(
+                       script, engine, game_dir))
+
+
+@contextlib.contextmanager
+def working_directory(path: str) -> Iterator[None]:
+    old_path = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old_path)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def run_all(repeat: int, name_filter: Optional[str] = None,
+            verbose: bool = True) -> Dict[str, Any]:
+    work_dir = tempfile.mkdtemp(prefix='basic-bench-')
+    statements: Dict[str, int] = {}
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        with working_directory(work_dir):
+            groups = [
+                grammar_benchmarks(),
+                parse_benchmarks(),
+                run_benchmarks(work_dir, statements),
+                session_benchmarks(work_dir),
+            ]
+            for group in groups:
+                for name, func in group:
+                    if name_filter and name_filter not in name:
+                        continue
+                    # Once untimed, to warm up caches (notably the
+                    # transpiled module cache).
+                    func()
+                    times = [func() for _ in range(repeat)]
+                    result: Dict[str, Any] = {
+                        'seconds': min(times),
+                        'times': times,
+                    }
+                    if name in statements:
+                        result['statements'] = statements[name]
+                        result['statements_per_second'] = (
+                            statements[name] / min(times))
+                    results[name] = result
+                    if verbose:
+                        print(format_result(name, result))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'benchmarks': results,
+    }
+
+
+def format_result(name: str, result: Dict[str, Any]) -> str:
+    text = '{:<32} {:>10.6f}s'.format(name, result['seconds'])
+    if 'statements_per_second' in result:
+        text += '  {:>12,.0f} stmt/s'.format(result['statements_per_second'])
+    return text
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: float) -> List[str]:
+    """Print each benchmark's time relative to the baseline, and return the
+    names of those slower by more than threshold (a fraction)."""
+    regressions = []
+    old = baseline['benchmarks']
+    print('\nCompared with {} ({}):'.format(
+        baseline['meta'].get('commit'), baseline['meta'].get('date')))
+    for name, result in results['benchmarks'].items():
+        if name not in old:
+            continue
+        ratio = result['seconds'] / old[name]['seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  SLOWER'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+        print('{:<32} {:>10.6f}s {:>10.6f}s {:>7.2f}x{}'.format(
+            name, old[name]['seconds'], result['seconds'], ratio, flag))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    arg_parser = argparse.ArgumentParser(
+        prog='benchmarks/run.py',
+        description='Benchmark the BASIC parser and interpreter.',
+    )
+    arg_parser.add_argument('-o', '--output', default='benchmark-results.json',
+                            help='file to write the results to')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=5,
+                            help='timed runs of each benchmark (default: 5)')
+    arg_parser.add_argument('-k', '--filter', default=None,
+                            help='only run benchmarks whose name contains'
+                                 ' this')
+    arg_parser.add_argument('--compare', metavar='BASELINE', default=None,
+                            help='results file from an earlier run to'
+                                 ' compare with')
+    arg_parser.add_argument('--threshold', type=float, default=0.1,
+                            help='slowdown counted as a regression by'
+                                 ' --compare (default: 0.1)')
+    args = arg_parser.parse_args(argv)
+    results = run_all(args.repeat, args.filter)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+    print('Results written to {}'.format(args.output))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Check that the fast parser and the Parsley grammar agree.
+
+Parses dnd1.basic and programs/*.bas (or the files given as arguments) with
+both backends and reports any line whose parse differs, then does the same
+for a set of single-line edge cases, including ones that must fail.
+tests/test_parsers.py runs the same checks under pytest.
+"""
+import glob
+import os
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+from basic import Parser  # noqa: E402
+
+EDGE_CASES = [
+    'PRINT', 'PRINT  ', 'PRINT A', 'PRINT A,', 'PRINT A;', 'PRINT A, B',
+    'PRINT A,B,', 'PRINT A;B;', 'PRINT A ,B', 'PRINT A, B ,C', 'PRINT A;B,C',
+    'PRINT "X";A$(1,2);', 'PRINT"X"', 'PRINT -A', 'PRINT - (A)',
+    'LET A=1+2*3-4/5', 'A=B-C-D', 'A=B/C/D', 'A=B\t+\tC', 'A = ( B + C ) * D',
+    'A=-B*-C', 'A=INT(B)', 'A=INT (B)', 'A=INT(B )', 'A=RND(0)+ABS(-1)',
+    'A=CLK(0)', 'A=.5+1.+2.25', 'A=B(1,C)', 'A=B(1)', 'A=B(1, C)', 'A(I)=3',
+    'LETTER=5', 'LET  X1 = 7', 'LET A$=B$', 'REM', 'REM  hello  ', 'REMARK',
+    'REM"quoted"', 'BASE 0', 'BASE X', 'RESTORE #1', 'RESTORE #D',
+    'DIM A(5),B$(2,3)', 'DIM A (5)', 'DIM A$(1)', 'READ A,B$,C(1)',
+    'READ #1,A', 'READ #D, A, B', 'WRITE #1,A$', 'FILE #1="A.DAT",#2="B"',
+    'FILE #1 = "A"', 'DATA 1,2.5,"X", .5', 'DATA 1 ,2', 'DATA -1', 'DATA ""',
+    'INPUT A,B$', 'FOR I=1 TO 10', 'FOR I= 1 TO 3', 'FOR I= (1) TO 3',
+    'FOR I=1TO3', 'NEXT I', 'NEXT', 'IF A=B THEN 10', 'IF A$="X" THEN 10',
+    'IF A$=B THEN 10', 'IF A<>B GOTO 10', 'IF A<=B GO TO 10', 'IF A<B THEN 1',
+    'IF A>=B THEN 1', 'IF A>B THEN 1', 'IF A=1 AND B=2 OR C=3 THEN 10',
+    'IF A=1 OR B=2 AND C=3 THEN 10', 'IF A=1 AND THEN 10', 'GOTO 10',
+    'GO TO 10', 'GOTO10', 'GOSUB 10', 'RETURN', 'STOP', 'END', 'END  ',
+    'ENDX', 'X', '',
+]
+
+
+def parse_lines(parser, text):
+    try:
+        return [repr(line) for line in parser.parse(text).lines]
+    except Exception:
+        # The backends raise different exception types; only compare that
+        # both rejected the text.
+        return 'error'
+
+
+fast = Parser(use_cache=False, backend='fast')
+parsley = Parser(use_cache=False, backend='parsley')
+
+
+def default_paths():
+    return ([os.path.join(root, 'dnd1.basic')]
+            + sorted(glob.glob(os.path.join(root, 'programs', '*.bas'))))
+
+
+def compare_program(path):
+    """Return a description of each difference in the parses of the file."""
+    with open(path) as f:
+        text = f.read()
+    expected = parse_lines(parsley, text)
+    actual = parse_lines(fast, text)
+    if expected == actual:
+        return []
+    if isinstance(expected, str) or isinstance(actual, str):
+        return ['  parsley: {}\n  fast:    {}'.format(
+            str(expected)[:200], str(actual)[:200])]
+    return ['  parsley: {}\n  fast:    {}'.format(expected_line, actual_line)
+            for expected_line, actual_line in zip(expected, actual)
+            if expected_line != actual_line]
+
+
+def compare_edge_case(case):
+    """Return a description of the difference in the parses of the
+    statement, or None if they agree."""
+    text = '10 {}\n'.format(case)
+    expected = parse_lines(parsley, text)
+    actual = parse_lines(fast, text)
+    if expected == actual:
+        return None
+    return '  parsley: {}\n  fast:    {}'.format(expected, actual)
+
+
+def main():
+    failures = 0
+    for path in sys.argv[1:] or default_paths():
+        differences = compare_program(path)
+        if not differences:
+            print('ok    {}'.format(path))
+            continue
+        failures += 1
+        print('FAIL  {}'.format(path))
+        for difference in differences:
+            print(difference)
+    for case in EDGE_CASES:
+        difference = compare_edge_case(case)
+        if difference is not None:
+            failures += 1
+            print('FAIL  {!r}\n{}'.format(case, difference))
+    print('{} edge cases checked'.format(len(EDGE_CASES)))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Serve dnd1.basic over TCP, one game per connection, from one event loop.
+
+    python bin/line_server.py [PORT]
+
+Then connect with e.g. "nc localhost 8023". Each connection gets its own
+Interpreter, run with run_async() so that a session waiting for its player
+to type doesn't hold up the others.
+"""
+import asyncio
+import os
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import basic  # noqa: E402
+from basic.channels import FeedInput  # noqa: E402
+
+path = os.path.join(root, 'dnd1.basic')
+
+
+class StreamInput(FeedInput):
+    """Feeds the interpreter lines read from a client connection."""
+
+    def __init__(self, reader, writer):
+        super().__init__()
+        self.reader = reader
+        self.writer = writer
+
+    async def wait(self):
+        # The prompt has been written by now; make sure it is sent.
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if line:
+            self.feed(line.decode('utf-8', 'replace').rstrip('\r\n'))
+        else:
+            self.close()
+
+
+class StreamOutput:
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, text):
+        self.writer.write(text.replace('\n', '\r\n').encode('utf-8'))
+
+
+async def play(reader, writer):
+    interpreter = basic.Interpreter(path, stdin=StreamInput(reader, writer),
+                                    stdout=StreamOutput(writer))
+    try:
+        await interpreter.run_async()
+        await writer.drain()
+    except Exception as e:
+        writer.write('\r\nError: {}\r\n'.format(e).encode('utf-8'))
+    finally:
+        writer.close()
+
+
+async def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8023
+    server = await asyncio.start_server(play, '127.0.0.1', port)
+    print('Serving dnd1.basic on 127.0.0.1:{}'.format(port))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+"""Show the basic blocks and unreachable lines of a BASIC program.
+
+    python bin/show_cfg.py [PROGRAM]
+
+Each block is listed as its first and last line numbers, followed by the
+lines control may pass to after it. PROGRAM defaults to dnd1.basic.
+"""
+import os
+import sys
+
+root = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, root)
+
+from basic.interpreter import Interpreter
+
+
+def main(path):
+    interpreter = Interpreter(path)
+    cfg = interpreter.cfg
+    numbers = interpreter.line_numbers
+
+    def number(index):
+        return numbers[index] if index < len(numbers) else 'end'
+
+    for block in cfg.blocks:
+        successors = ' '.join(str(number(i)) for i in block.successors)
+        print('{:>6}-{:<6} -> {}{}'.format(
+            number(block.start), number(block.end - 1), successors or '-',
+            '' if block.reachable else '  (unreachable)'))
+    unreachable = cfg.unreachable_lines()
+    print('{} lines, {} blocks in {} fall-through chains, {} no-op lines,'
+          ' {} unreachable lines'.format(
+              len(numbers), len(cfg.blocks), len(cfg.fall_through_chains()),
+              len(cfg.noop_lines()), len(unreachable)))
+    if unreachable:
+        print('Unreachable:', ' '.join(str(numbers[i]) for i in unreachable))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else os.path.join(root, 'dnd1.basic'))
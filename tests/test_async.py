@@ -0,0 +1,99 @@
+"""Interpreter.run_async(), and bin/line_server.py built on it."""
+import asyncio
+import importlib.util
+import io
+import os
+import pytest
+from basic.channels import AsyncQueueInput
+from basic.interpreter import Interpreter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+spec = importlib.util.spec_from_file_location(
+    'line_server', os.path.join(ROOT, 'bin', 'line_server.py'))
+line_server = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(line_server)
+
+PROGRAM = '''\
+10 INPUT N$
+20 FOR I=1 TO 2
+30 INPUT X
+40 PRINT N$;X*I
+50 NEXT I
+60 END
+'''
+
+
+@pytest.fixture
+def program(tmp_path):
+    path = tmp_path / 'test.bas'
+    path.write_text(PROGRAM)
+    return str(path)
+
+
+def test_concurrent_sessions(program):
+    async def main():
+        queues = [asyncio.Queue(), asyncio.Queue()]
+        outputs = [io.StringIO(), io.StringIO()]
+        sessions = asyncio.gather(*[
+            Interpreter(program, stdin=AsyncQueueInput(queue),
+                        stdout=output).run_async()
+            for queue, output in zip(queues, outputs)
+        ])
+        # Interleaved, so each session waits on the other at every INPUT.
+        for lines in zip(['A', '1', '2'], ['B', '10', '20']):
+            for queue, line in zip(queues, lines):
+                await queue.put(line)
+                await asyncio.sleep(0)
+        await asyncio.wait_for(sessions, 5)
+        return [output.getvalue() for output in outputs]
+
+    first, second = asyncio.run(main())
+    assert first.split('\n< Program terminated >')[0].split() == [
+        '??A', '1', '?A', '4']
+    assert second.split('\n< Program terminated >')[0].split() == [
+        '??B', '10', '?B', '40']
+
+
+def test_end_of_input_ends_the_program(program):
+    async def main():
+        queue = asyncio.Queue()
+        output = io.StringIO()
+        interpreter = Interpreter(program, stdin=AsyncQueueInput(queue),
+                                  stdout=output)
+        session = asyncio.ensure_future(interpreter.run_async())
+        await queue.put('A')
+        await queue.put(None)
+        await asyncio.wait_for(session, 5)
+        return output.getvalue()
+
+    assert asyncio.run(main()) == '??\n< Program terminated >\n'
+
+
+def test_line_server(program, monkeypatch):
+    monkeypatch.setattr(line_server, 'path', program)
+
+    async def client(port, lines):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for line in lines:
+            writer.write(line.encode('utf-8') + b'\r\n')
+            await writer.drain()
+            await asyncio.sleep(0.01)
+        output = await reader.read()
+        writer.close()
+        return output.decode('utf-8')
+
+    async def main():
+        server = await asyncio.start_server(line_server.play, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await asyncio.wait_for(asyncio.gather(
+                client(port, ['A', '1', '2']),
+                client(port, ['B', '10', '20'])), 5)
+
+    first, second = asyncio.run(main())
+    assert '\r\n' in first
+    assert first.split('< Program terminated >')[0].split() == [
+        '??A', '1', '?A', '4']
+    assert second.split('< Program terminated >')[0].split() == [
+        '??B', '10', '?B', '40']
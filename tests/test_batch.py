@@ -0,0 +1,42 @@
+from basic import batch
+
+PROGRAM = '''\
+10 FILE #1="COUNT"
+20 READ #1,N
+30 INPUT X
+40 RESTORE #1
+45 LET N=N+X
+50 WRITE #1,N
+60 RESTORE #1
+70 READ #1,N
+80 PRINT N
+90 END
+'''
+
+
+def test_sessions_get_their_own_copy_of_the_data(tmp_path):
+    program = tmp_path / 'count.bas'
+    program.write_text(PROGRAM)
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    (data_dir / 'COUNT').write_text('10\n')
+    script_dir = tmp_path / 'scripts'
+    script_dir.mkdir()
+    for n in range(1, 7):
+        (script_dir / 's{}'.format(n)).write_text('{}\n'.format(n))
+    summary = batch.run_batch(str(program), str(script_dir),
+                              str(tmp_path / 'results'), jobs=3,
+                              data_dir=str(data_dir))
+    # Every session started from the original count.
+    assert [result['status'] for result in summary] == ['ok'] * 6
+    outputs = [(tmp_path / 'results' / 's{}.out'.format(n)).read_text()
+               for n in range(1, 7)]
+    assert [output.split()[:2] for output in outputs] == [
+        ['?', str(10 + n)] for n in range(1, 7)]
+    assert (data_dir / 'COUNT').read_text() == '10\n'
+
+
+def test_data_files(tmp_path):
+    program = tmp_path / 'count.bas'
+    program.write_text('10 FILE #1="B",#2="A"\n20 FILE #3="B"\n30 END\n')
+    assert batch.data_files(str(program)) == ['A', 'B']
@@ -0,0 +1,98 @@
+import pickle
+from basic import cache, parser, transpile
+from basic.parser import Parser
+from basic.interpreter import Interpreter
+
+
+def cached_modules(tmp_path):
+    return sorted(path.name for path in
+                  (tmp_path / cache.CACHE_DIR_NAME).glob('*.python-*.py'))
+
+
+def test_transpiled_module_is_keyed_on_the_generator(tmp_path, monkeypatch,
+                                                     capsys):
+    path = tmp_path / 'test.bas'
+    path.write_text('10 PRINT 1\n20 END\n')
+    Interpreter(str(path), engine='python').run()
+    first = cached_modules(tmp_path)
+    assert len(first) == 1
+    Interpreter(str(path), engine='python').run()
+    assert cached_modules(tmp_path) == first
+    # As if the optimizer, say, had changed.
+    monkeypatch.setattr(transpile, 'generator_digest', lambda: 'changed')
+    Interpreter(str(path), engine='python').run()
+    second = cached_modules(tmp_path)
+    assert len(second) == 1 and second != first
+    assert capsys.readouterr().out.count(' 1 ') == 3
+
+
+def test_source_digest(tmp_path):
+    digest = cache.source_digest(cache, transpile)
+    assert digest == cache.source_digest(cache, transpile)
+    assert digest != cache.source_digest(transpile, cache)
+    assert digest != cache.source_digest(cache)
+
+
+def parse_cache_files(tmp_path):
+    return sorted(path.name for path in
+                  (tmp_path / cache.CACHE_DIR_NAME).glob('*.parse*'))
+
+
+def test_parse_cache_is_kept_per_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(parser, '_parsed', {})
+    path = tmp_path / 'test.bas'
+    path.write_text('10 PRINT 1\n20 END\n')
+    for backend in Parser.BACKENDS:
+        parser.Parser(backend=backend).parse_file(str(path),
+                                                  path.read_text())
+    assert [name.split('-')[0] for name in parse_cache_files(tmp_path)] == [
+        'test.bas.parse.fast', 'test.bas.parse.parsley']
+
+
+class Planted:
+
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return (open, (self.path, 'w'))
+
+
+def test_parse_cache_refuses_other_classes(tmp_path, monkeypatch):
+    monkeypatch.setattr(parser, '_parsed', {})
+    path = tmp_path / 'test.bas'
+    text = '10 PRINT 1\n20 END\n'
+    path.write_text(text)
+    parser.Parser().parse_file(str(path), text)
+    [name] = parse_cache_files(tmp_path)
+    marker = tmp_path / 'marker'
+    (tmp_path / cache.CACHE_DIR_NAME / name).write_bytes(
+        pickle.dumps(Planted(str(marker))))
+    monkeypatch.setattr(parser, '_parsed', {})
+    program = parser.Parser().parse_file(str(path), text)
+    assert not marker.exists()
+    assert [line.number for line in program.lines] == [10, 20]
+
+
+def test_user_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.delenv('BASIC_CACHE_DIR', raising=False)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    assert cache.user_cache_dir() == str(tmp_path / 'basic')
+    monkeypatch.setenv('BASIC_CACHE_DIR', str(tmp_path / 'elsewhere'))
+    assert cache.user_cache_dir() == str(tmp_path / 'elsewhere')
+
+
+def test_grammar_is_cached_outside_the_package(monkeypatch, tmp_path):
+    monkeypatch.setenv('BASIC_CACHE_DIR', str(tmp_path))
+    grammar = parser.load_grammar(True)
+    assert [path.name.split('-')[0] for path in tmp_path.glob('*.py')] == [
+        'basic.grammar']
+    assert grammar('10 END\n').program().lines[0].number == 10
+
+
+def test_grammar_without_a_writable_cache(monkeypatch, tmp_path):
+    # A file where the directory should be, so it can't be created.
+    (tmp_path / 'file').write_text('')
+    monkeypatch.setenv('BASIC_CACHE_DIR', str(tmp_path / 'file' / 'cache'))
+    grammar = parser.load_grammar(True)
+    assert grammar('10 END\n').program().lines[0].number == 10
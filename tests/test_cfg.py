@@ -0,0 +1,68 @@
+import io
+from basic.interpreter import Interpreter
+
+PROGRAM = '''\
+10 REM START
+20 FOR I=1 TO 2
+25 REM LOOP
+30 GOSUB 100
+40 NEXT I
+50 GOTO 80
+60 PRINT "NEVER"
+70 REM
+80 END
+100 REM SUB
+110 PRINT I
+120 RETURN
+'''
+
+
+def interpreter(tmp_path, **kwargs):
+    path = tmp_path / 'test.bas'
+    path.write_text(PROGRAM)
+    return Interpreter(str(path), stdout=io.StringIO(),
+                       stderr=io.StringIO(), **kwargs)
+
+
+def numbers(interpreter, indices):
+    return [interpreter.line_numbers[i] if i < len(interpreter.line_numbers)
+            else None for i in indices]
+
+
+def test_successors(tmp_path):
+    interp = interpreter(tmp_path)
+    cfg = interp.cfg
+    # The graph shares the interpreter's tables rather than building its own.
+    assert cfg.line_map is interp.line_map
+    assert cfg.next_indices is interp.next_indices
+    successors = {interp.line_numbers[i]: numbers(interp, s)
+                  for i, s in enumerate(cfg.successors)}
+    assert successors == {
+        10: [20], 20: [25, 50], 25: [30], 30: [100, 40], 40: [25, 50],
+        50: [80], 60: [70], 70: [80], 80: [], 100: [110], 110: [120],
+        120: [],
+    }
+
+
+def test_blocks_and_reachability(tmp_path):
+    interp = interpreter(tmp_path)
+    cfg = interp.cfg
+    assert numbers(interp, cfg.unreachable_lines()) == [60, 70]
+    assert numbers(interp, cfg.noop_lines()) == [10, 25, 70, 100]
+    assert [(interp.line_numbers[b.start], interp.line_numbers[b.end - 1])
+            for b in cfg.blocks] == [
+        (10, 20), (25, 30), (40, 40), (50, 50), (60, 70), (80, 80),
+        (100, 120)]
+    block = cfg.block_of(interp.line_map[110])
+    assert interp.line_numbers[block.start] == 100
+    assert not cfg.block_starts[interp.line_map[60]].reachable
+
+
+def test_profiler_counts_only_jumps_as_edges(tmp_path):
+    interp = interpreter(tmp_path, profile=True,
+                         profile_output=str(tmp_path / 'profile'))
+    interp.run()
+    edges = {(r['from'], r['to']): r['count']
+             for r in interp.profiler.results(interp)['edges']}
+    # Running on past a no-op (from 20 to 30, skipping 25) isn't a jump.
+    assert edges == {(30, 110): 2, (120, 40): 2, (40, 30): 1, (50, 80): 1}
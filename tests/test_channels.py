@@ -0,0 +1,68 @@
+import queue
+import threading
+from basic.channels import QueueInput, QueueOutput
+from basic.interpreter import Interpreter
+
+PROGRAM = '''\
+10 PRINT "NAME";
+20 INPUT A$
+30 PRINT "HELLO ";A$
+40 END
+'''
+
+
+def write_program(tmp_path, text=PROGRAM):
+    path = tmp_path / 'test.bas'
+    path.write_text(text)
+    return str(path)
+
+
+def read_until(output, text):
+    # Fails, rather than hanging, if the text never arrives.
+    received = ''
+    while text not in received:
+        received += output.get(timeout=5)
+    return received
+
+
+def test_queue_channels(tmp_path):
+    # The driver only answers once it has seen the prompt, so this hangs
+    # unless the interpreter flushes its output before waiting for input.
+    input_queue = queue.Queue()
+    output_queue = queue.Queue()
+    interpreter = Interpreter(write_program(tmp_path),
+                              stdin=QueueInput(input_queue),
+                              stdout=QueueOutput(output_queue))
+    thread = threading.Thread(target=interpreter.run, daemon=True)
+    thread.start()
+    try:
+        assert read_until(output_queue, '?') == 'NAME?'
+        input_queue.put('BOB')
+        assert 'HELLO BOB\n' in read_until(output_queue, 'terminated')
+    finally:
+        input_queue.put(None)
+        thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def test_queue_input_end(tmp_path):
+    # None on the queue ends the input, which ends the program.
+    input_queue = queue.Queue()
+    input_queue.put(None)
+    output_queue = queue.Queue()
+    interpreter = Interpreter(write_program(tmp_path),
+                              stdin=QueueInput(input_queue),
+                              stdout=QueueOutput(output_queue))
+    interpreter.run()
+    output = ''
+    while not output_queue.empty():
+        output += output_queue.get()
+    assert output == 'NAME?\n< Program terminated >\n'
+
+
+def test_run_until_input(tmp_path):
+    interpreter = Interpreter(write_program(tmp_path))
+    assert interpreter.run_until_input() == ('NAME?', True)
+    output, waiting = interpreter.run_until_input('BOB')
+    assert not waiting
+    assert output.startswith('HELLO BOB\n')
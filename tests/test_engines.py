@@ -0,0 +1,58 @@
+import glob
+import io
+import os
+import pytest
+from basic.interpreter import Interpreter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PROGRAMS = sorted(glob.glob(os.path.join(ROOT, 'programs', '*.bas')) +
+                  glob.glob(os.path.join(ROOT, 'benchmarks', 'programs',
+                                         '*.bas')))
+SESSIONS = sorted(glob.glob(os.path.join(ROOT, 'benchmarks', 'sessions',
+                                         '*.txt')))
+
+
+def run(path, engine, **kwargs):
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    try:
+        Interpreter(path, engine=engine, stdout=stdout, stderr=stderr,
+                    seed=0, **kwargs).run()
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+    else:
+        error = None
+    return stdout.getvalue(), stderr.getvalue(), error
+
+
+@pytest.mark.parametrize('path', PROGRAMS, ids=os.path.basename)
+def test_programs(path):
+    outputs = [run(path, engine) for engine in Interpreter.ENGINES]
+    assert outputs[0][0]
+    assert outputs[1:] == outputs[:1] * (len(outputs) - 1)
+
+
+def play(script, engine, game_dir):
+    # Like the session benchmarks: empty dungeons and no saved game.
+    for n in range(1, 7):
+        (game_dir / 'DNG{}'.format(n)).write_text('0\n' * 26 * 26)
+    (game_dir / 'GMSTR').write_text('')
+    output = run(os.path.join(ROOT, 'dnd1.basic'), engine,
+                 stdin=script.splitlines())
+    files = {path.name: path.read_bytes() for path in game_dir.iterdir()
+             if path.is_file()}
+    return output, files
+
+
+@pytest.mark.parametrize('path', SESSIONS, ids=os.path.basename)
+def test_dnd1_sessions(path, tmp_path, monkeypatch):
+    with open(path) as f:
+        script = f.read()
+    results = []
+    for engine in Interpreter.ENGINES:
+        game_dir = tmp_path / engine
+        game_dir.mkdir()
+        monkeypatch.chdir(game_dir)
+        results.append(play(script, engine, game_dir))
+    assert 'DUNGEONS AND DRAGONS' in results[0][0][0]
+    assert results[1:] == results[:1] * (len(results) - 1)
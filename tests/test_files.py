@@ -0,0 +1,26 @@
+import pytest
+from basic.interpreter import Interpreter
+
+PROGRAM = '''\
+10 FILE #1="DATA"
+20 READ #1,A,B
+30 RESTORE #1
+35 LET C=A+B
+40 WRITE #1,B,A,C
+50 RESTORE #1
+60 READ #1,X,Y,Z
+70 PRINT X;Y;Z
+80 END
+'''
+
+
+@pytest.mark.parametrize('file_backend', Interpreter.FILE_BACKENDS)
+@pytest.mark.parametrize('engine', Interpreter.ENGINES)
+def test_write_then_read_back(tmp_path, monkeypatch, capsys, engine,
+                              file_backend):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'test.bas').write_text(PROGRAM)
+    (tmp_path / 'DATA').write_text('1\n2\n')
+    Interpreter('test.bas', engine=engine, file_backend=file_backend).run()
+    assert capsys.readouterr().out.splitlines()[0] == ' 2 1 3'
+    assert (tmp_path / 'DATA').read_text().split() == ['2.0', '1.0', '3.0']
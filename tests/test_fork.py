@@ -0,0 +1,53 @@
+import pytest
+from basic.interpreter import Interpreter
+
+PROGRAM = '''\
+10 DIM A(3)
+20 LET A(1)=5
+30 INPUT X
+40 LET A(1)=A(1)+X
+50 PRINT A(1);RND(0)
+60 END
+'''
+
+
+@pytest.fixture
+def program(tmp_path):
+    path = tmp_path / 'test.bas'
+    path.write_text(PROGRAM)
+    return str(path)
+
+
+def suspended(program, engine):
+    interpreter = Interpreter(program, engine=engine, seed=1)
+    assert interpreter.run_until_input() == ('?', True)
+    return interpreter
+
+
+@pytest.mark.parametrize('engine', Interpreter.ENGINES)
+def test_branches_are_independent(program, engine):
+    parent = suspended(program, engine)
+    first = parent.fork()
+    second = parent.fork()
+    first_output, _ = first.run_until_input('1')
+    second_output, _ = second.run_until_input('2')
+    parent_output, _ = parent.run_until_input('3')
+    # Each array write went to a private copy.
+    assert first_output.startswith(' 6 ')
+    assert second_output.startswith(' 7 ')
+    assert parent_output.startswith(' 8 ')
+
+
+@pytest.mark.parametrize('engine', Interpreter.ENGINES)
+def test_rnd_does_not_depend_on_order(program, engine):
+    parent = suspended(program, engine)
+    forks = [parent.fork() for _ in range(3)]
+    outputs = [f.run_until_input('1')[0] for f in reversed(forks)]
+    assert outputs[0] == outputs[1] == outputs[2]
+    assert parent.run_until_input('1')[0] == outputs[0]
+
+
+def test_fork_map(program):
+    parent = suspended(program, 'closure')
+    expected = [parent.fork().run_until_input(line) for line in '123']
+    assert parent.fork_map(['1', '2', '3'], processes=2) == expected
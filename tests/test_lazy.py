@@ -0,0 +1,86 @@
+import io
+import pytest
+from basic.fastparser import BasicSyntaxError, LazyLines
+from basic.interpreter import BasicRuntimeError, Interpreter
+
+
+def run(tmp_path, text, stdin=()):
+    path = tmp_path / 'test.bas'
+    path.write_text(text)
+    stdout = io.StringIO()
+    interpreter = Interpreter(str(path), lazy=True, stdin=list(stdin),
+                              stdout=stdout)
+    interpreter.run()
+    return interpreter, stdout.getvalue()
+
+
+def printed(output):
+    return output.split('\n< Program terminated >')[0].split()
+
+
+def test_lines_are_parsed_when_first_run(tmp_path):
+    interpreter, output = run(tmp_path, '10 PRINT 1\n20 END\n30 PRINT 3\n')
+    assert isinstance(interpreter.program.lines, LazyLines)
+    assert printed(output) == ['1']
+    assert interpreter.program.lines.lines[2] is None
+
+
+def test_syntax_error_on_line_never_run(tmp_path):
+    _, output = run(tmp_path, '10 PRINT 1\n20 GOTO 40\n30 PRINT (((\n'
+                              '40 END\n')
+    assert printed(output) == ['1']
+
+
+def test_syntax_error_on_line_run(tmp_path):
+    path = tmp_path / 'test.bas'
+    path.write_text('10 PRINT 1\n20 PRINT (((\n30 END\n')
+    stdout = io.StringIO()
+    interpreter = Interpreter(str(path), lazy=True, stdout=stdout)
+    with pytest.raises(BasicSyntaxError, match='line 2'):
+        interpreter.run()
+    assert interpreter.current_line_number() == 20
+    assert printed(stdout.getvalue()) == ['1']
+
+
+def test_jumps_to_lines_not_yet_parsed(tmp_path):
+    _, output = run(tmp_path, '''\
+10 GOSUB 100
+20 GOTO 200
+100 PRINT "SUB"
+110 RETURN
+200 PRINT "END"
+210 END
+''')
+    assert printed(output) == ['SUB', 'END']
+
+
+def test_jump_to_missing_line(tmp_path):
+    with pytest.raises(BasicRuntimeError, match='Line 99 referenced on line'
+                                                ' 10'):
+        run(tmp_path, '10 GOTO 99\n20 END\n')
+
+
+def test_data_and_loops_are_found_without_parsing_everything(tmp_path):
+    interpreter, output = run(tmp_path, '''\
+10 FOR I=1 TO 3
+20 READ X
+30 PRINT X
+40 NEXT I
+50 END
+60 PRINT (((
+70 DATA 4,5
+80 REM DATA 9
+90 DATA 6
+''')
+    assert printed(output) == ['4', '5', '6']
+    assert interpreter.next_indices == {0: 3}
+    assert interpreter.data_pool == [4, 5, 6]
+    # Neither scan parsed the broken line.
+    assert interpreter.program.lines.lines[5] is None
+
+
+def test_loop_errors_are_still_found_at_load_time(tmp_path):
+    with pytest.raises(BasicRuntimeError, match='line 10 has no matching'):
+        run(tmp_path, '10 FOR I=1 TO 3\n20 PRINT I\n30 END\n')
+    with pytest.raises(BasicRuntimeError, match='line 30 has mismatched'):
+        run(tmp_path, '10 FOR I=1 TO 3\n20 PRINT I\n30 NEXT J\n40 END\n')
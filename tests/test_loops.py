@@ -0,0 +1,32 @@
+import pytest
+from basic.interpreter import (
+    BasicNotImplementedError, BasicRuntimeError, Interpreter
+)
+
+
+@pytest.fixture
+def program(tmp_path):
+    path = tmp_path / 'test.bas'
+    path.write_text('10 PRINT 1\n20 NEXT I\n30 END\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('options', [
+    {'engine': engine} for engine in Interpreter.ENGINES
+] + [{'lazy': True}])
+def test_next_without_for_fails_at_load_time(program, options):
+    with pytest.raises(BasicRuntimeError,
+                       match='line 20 has no matching FOR'):
+        Interpreter(program, **options)
+
+
+def test_transpiled_next_without_for(program, monkeypatch):
+    # Should pair_loops() let one through, the generated code fails cleanly
+    # rather than reading an unassigned variable.
+    def pair_loops(interpreter):
+        interpreter.next_indices = {}
+    monkeypatch.setattr(Interpreter, 'pair_loops', pair_loops)
+    interpreter = Interpreter(program, engine='python')
+    with pytest.raises(BasicNotImplementedError,
+                       match='NEXT without FOR on line 20'):
+        interpreter.run()
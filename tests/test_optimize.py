@@ -0,0 +1,155 @@
+import math
+import pytest
+from basic import lang
+from basic.interpreter import Interpreter
+from basic.optimize import optimize_program
+from basic.parser import Parser
+
+
+def optimized(expression):
+    program = Parser().parse('10 LET X={}\n'.format(expression))
+    return optimize_program(program).lines[0].statement.expression
+
+
+def same_float(value, expected):
+    # Also tells 0.0 and -0.0 apart.
+    return (type(value) is float and value == expected
+            and math.copysign(1.0, value) == math.copysign(1.0, expected))
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('2', 2.0),
+    ('2*3+4', 10.0),
+    ('(1+2)*(3-5)', -6.0),
+    ('7/2', 3.5),
+    ('ABS(-3)', 3.0),
+    ('-(2)', -2.0),
+    ('--2', 2.0),
+])
+def test_constants_are_folded(expression, expected):
+    assert same_float(optimized(expression), expected)
+
+
+@pytest.mark.parametrize('condition, expected', [
+    ('1<2', 1.0),
+    ('2<=1', 0.0),
+    ('1+1=2', 1.0),
+    ('-0=0', 1.0),
+    ('"A"="a"', 1.0),
+    ('"A"<>"B"', 1.0),
+])
+def test_comparisons_are_folded(condition, expected):
+    program = Parser().parse('10 IF {} THEN 10\n'.format(condition))
+    statement = optimize_program(program).lines[0].statement
+    assert same_float(statement.expr, expected)
+
+
+def test_division_by_zero_is_left_for_run_time():
+    expr = optimized('1/0')
+    assert type(expr) is lang.Div
+    assert expr.a == 1.0 and expr.b == 0.0
+
+
+def test_int_folds_to_an_int():
+    # As at run time.
+    assert type(optimized('INT(7/2)')) is int
+    assert optimized('INT(7/2)') == 3
+    assert type(optimized('INT(7/2)*INT(5/2)')) is int
+    assert same_float(optimized('INT(7/2)+1'), 4.0)
+    assert same_float(optimized('-INT(7/2)'), -3.0)
+
+
+@pytest.mark.parametrize('expression', ['X*1', '1*X', 'X/1', 'X-0', '(X)',
+                                        '--X', '-(-X)'])
+def test_identities_are_dropped(expression):
+    # Y/2 is always a float.
+    expr = optimized(expression.replace('X', '(Y/2)'))
+    assert type(expr) is lang.Div and expr.a.variable == 'Y'
+
+
+@pytest.mark.parametrize('expression', ['Y*1', '1*Y', 'Y/1', 'Y-0', '--Y'])
+def test_identities_are_kept_for_variables(expression):
+    # Y may hold an int from INT, which these would make a float.
+    assert type(optimized(expression)) is not lang.Reference
+
+
+def test_negation_becomes_multiplication():
+    expr = optimized('-Y')
+    assert type(expr) is lang.Mul
+    assert type(expr.a) is lang.Reference and expr.a.variable == 'Y'
+    assert same_float(expr.b, -1.0)
+
+
+def test_negative_zero():
+    assert same_float(optimized('-0'), -0.0)
+    assert same_float(optimized('0-0'), 0.0)
+    assert same_float(optimized('-0-0'), -0.0)
+    assert same_float(optimized('-0+0'), 0.0)
+    assert same_float(optimized('-0*1'), -0.0)
+
+
+@pytest.mark.parametrize('expression', ['Y+0', 'Y-(-0)'])
+def test_additions_of_zero_are_kept(expression):
+    # Either turns -0 into 0.
+    assert type(optimized(expression)) in (lang.Add, lang.Sub)
+
+
+def test_zero_and_negative_zero_stay_distinct():
+    expr = optimized('Y*0+Y*-0')
+    assert same_float(expr.a.b, 0.0)
+    assert same_float(expr.b.b, -0.0)
+
+
+PROGRAM = '''\
+10 LET Y=0
+20 LET W=-Y
+30 LET A=W+0
+40 LET B=W-0
+50 LET C=W-(-0)
+60 LET D=-W
+70 LET E=Y*-0
+80 LET F=W*1
+90 LET G=--W
+100 LET H=-W*-1
+110 LET I=2*3+INT(7/2)
+120 END
+'''
+
+EXPECTED = {'W': -0.0, 'A': 0.0, 'B': -0.0, 'C': 0.0, 'D': 0.0, 'E': -0.0,
+            'F': -0.0, 'G': -0.0, 'H': -0.0, 'I': 9.0}
+
+
+@pytest.mark.parametrize('engine', Interpreter.ENGINES)
+def test_engines_agree(tmp_path, engine):
+    path = tmp_path / 'test.bas'
+    path.write_text(PROGRAM)
+    interpreter = Interpreter(str(path), engine=engine)
+    interpreter.run()
+    for name, expected in EXPECTED.items():
+        value = interpreter.scalars[interpreter.scalar_slots[name]]
+        assert same_float(value, expected), name
+
+
+WRITE_PROGRAM = '''\
+10 FILE #1="OUT"
+20 LET A=3.5
+30 LET X=INT(3.5)
+40 LET Y=INT(A)
+50 LET Z=INT(3.5)*1
+60 LET W=INT(A)*1
+70 LET V=-(-INT(3.5))
+80 LET U=-(-INT(A))
+90 WRITE #1,X,Y,Z,W,V,U
+100 END
+'''
+
+
+@pytest.mark.parametrize('engine', Interpreter.ENGINES)
+def test_folding_keeps_the_run_time_type(tmp_path, monkeypatch, engine):
+    # WRITE # shows ints and floats differently.
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'test.bas').write_text(WRITE_PROGRAM)
+    (tmp_path / 'OUT').write_text('')
+    Interpreter('test.bas', engine=engine).run()
+    assert (tmp_path / 'OUT').read_text().split() == [
+        '3', '3', '3.0', '3.0', '3.0', '3.0']
@@ -0,0 +1,126 @@
+import io
+import pytest
+from basic.interpreter import Interpreter
+from basic.output import NumberFormatter, OutputBuffer
+
+NUMBERS = [0.0, -0.0, 1.0, -1.0, 3, -3, 0.5, -0.25, 1 / 3, -2 / 3,
+           1234567.0, 12345678.0, -98765432.0, 1e20, -1.5e-10, 2.5e100,
+           float('inf'), float('-inf')]
+
+
+def print_values(stream, values, zone, newline):
+    # PRINT as it was before output was buffered.
+    write = stream.write
+    for value in values:
+        if not isinstance(value, str):
+            value = "{: .7g}".format(value)
+        if zone:
+            write('%-14s' % value)
+        else:
+            write(value)
+    if newline:
+        write('\n')
+
+
+def test_number_formatter():
+    formatter = NumberFormatter()
+    # Twice, the second time from the cache.
+    for _ in range(2):
+        for value in NUMBERS:
+            assert formatter.format(value) == "{: .7g}".format(value)
+    assert formatter.format(float('nan')) == "{: .7g}".format(float('nan'))
+
+
+@pytest.mark.parametrize('zone', [False, True])
+@pytest.mark.parametrize('newline', [False, True])
+def test_print_values(tmp_path, zone, newline):
+    path = tmp_path / 'test.bas'
+    path.write_text('10 END\n')
+    stdout = io.StringIO()
+    interpreter = Interpreter(str(path), stdout=stdout)
+    expected = io.StringIO()
+    for values in (NUMBERS, ['A', -1.0, 'BC', 2.0], [], NUMBERS[::-1]):
+        interpreter.print_values(values, zone, newline)
+        print_values(expected, values, zone, newline)
+    interpreter.output.flush()
+    assert stdout.getvalue() == expected.getvalue()
+
+
+PROGRAM = '''\
+10 LET A=-1.5
+15 LET E=A/10000000000
+20 PRINT 1;-2;A;"X";12345678;E*-100000000000000000000
+30 PRINT 1,-2,A,"X",12345678,E
+40 PRINT "NO NEWLINE";
+50 PRINT -0;A*0
+60 END
+'''
+
+
+@pytest.mark.parametrize('engine', Interpreter.ENGINES)
+def test_program_output(tmp_path, engine):
+    path = tmp_path / 'test.bas'
+    path.write_text(PROGRAM)
+    stdout = io.StringIO()
+    Interpreter(str(path), engine=engine, stdout=stdout).run()
+    expected = io.StringIO()
+    print_values(expected, [1.0, -2.0, -1.5, 'X', 12345678.0, 1.5e10],
+                 False, True)
+    print_values(expected, [1.0, -2.0, -1.5, 'X', 12345678.0, -1.5e-10],
+                 True, True)
+    print_values(expected, ['NO NEWLINE'], False, False)
+    print_values(expected, [-0.0, -0.0], False, True)
+    expected.write('\n< Program terminated >\n')
+    assert stdout.getvalue() == expected.getvalue()
+
+
+def test_buffer_limit():
+    stream = io.StringIO()
+    buffer = OutputBuffer(stream, limit=10)
+    buffer.write('12345')
+    assert stream.getvalue() == ''
+    buffer.write('67890')
+    assert stream.getvalue() == '1234567890'
+    buffer.write('X')
+    buffer.flush()
+    assert stream.getvalue() == '1234567890X'
+    unbuffered = OutputBuffer(stream, limit=0)
+    unbuffered.write('Y')
+    assert stream.getvalue() == '1234567890XY'
+
+
+class RecordingInput:
+    "Input channel which records the output written before each read."
+
+    def __init__(self, stdout, lines):
+        self.stdout = stdout
+        self.lines = list(lines)
+        self.seen = []
+
+    def read_line(self):
+        self.seen.append(self.stdout.getvalue())
+        if not self.lines:
+            raise EOFError
+        return self.lines.pop(0)
+
+
+@pytest.mark.parametrize('engine', Interpreter.ENGINES)
+def test_flushed_before_input(tmp_path, engine):
+    path = tmp_path / 'test.bas'
+    path.write_text('10 PRINT "NAME";\n20 INPUT N$\n30 PRINT N$\n'
+                    '40 INPUT X\n50 END\n')
+    stdout = io.StringIO()
+    stdin = RecordingInput(stdout, ['BOB', '1'])
+    Interpreter(str(path), engine=engine, stdin=stdin, stdout=stdout).run()
+    assert stdin.seen == ['NAME?', 'NAME?' + '%-14s' % 'BOB' + '\n?']
+
+
+@pytest.mark.parametrize('engine', Interpreter.ENGINES)
+def test_flushed_on_error(tmp_path, engine):
+    path = tmp_path / 'test.bas'
+    path.write_text('10 PRINT "BEFORE";\n20 LET X=1/0\n30 END\n')
+    stdout = io.StringIO()
+    interpreter = Interpreter(str(path), engine=engine, stdout=stdout)
+    with pytest.raises(ZeroDivisionError):
+        interpreter.run()
+    assert stdout.getvalue() == 'BEFORE'
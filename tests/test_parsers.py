@@ -0,0 +1,25 @@
+"""The fast parser must produce the same programs as the Parsley grammar.
+
+The checks are those of bin/compare_parsers.py.
+"""
+import importlib.util
+import os
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+spec = importlib.util.spec_from_file_location(
+    'compare_parsers', os.path.join(ROOT, 'bin', 'compare_parsers.py'))
+compare_parsers = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(compare_parsers)
+
+
+@pytest.mark.parametrize('path', compare_parsers.default_paths(),
+                         ids=os.path.basename)
+def test_program(path):
+    assert compare_parsers.compare_program(path) == []
+
+
+@pytest.mark.parametrize('case', compare_parsers.EDGE_CASES)
+def test_edge_case(case):
+    assert compare_parsers.compare_edge_case(case) is None
@@ -0,0 +1,64 @@
+import io
+import json
+import re
+from basic.interpreter import Interpreter
+
+PROGRAM = '''\
+10 FOR I=1 TO 3
+20 GOSUB 100
+30 NEXT I
+40 END
+100 LET X=X+I
+110 RETURN
+'''
+
+
+def profiled(tmp_path):
+    path = tmp_path / 'test.bas'
+    path.write_text(PROGRAM)
+    stderr = io.StringIO()
+    Interpreter(str(path), profile=True, stderr=stderr, stdout=io.StringIO(),
+                profile_output=str(tmp_path / 'profile')).run()
+    return str(path), stderr.getvalue()
+
+
+def test_report(tmp_path):
+    path, report = profiled(tmp_path)
+    assert report.startswith('Profile of {}: 14 lines run in '.format(path))
+
+
+def test_json(tmp_path):
+    path, _ = profiled(tmp_path)
+    with open(tmp_path / 'profile.json') as f:
+        results = json.load(f)
+    assert set(results) == {'program', 'total_time', 'lines', 'handlers',
+                            'edges'}
+    assert results['program'] == path
+    counts = {r['line']: r['count'] for r in results['lines']}
+    assert counts == {10: 1, 20: 3, 30: 3, 40: 1, 100: 3, 110: 3}
+    for r in results['lines']:
+        assert set(r) == {'line', 'statement', 'handler', 'count', 'time'}
+    line_20 = next(r for r in results['lines'] if r['line'] == 20)
+    assert line_20['handler'] == 'stmt_Gosub'
+    assert line_20['statement'] == 'GOSUB 100'
+    # Hottest first.
+    times = [r['time'] for r in results['lines']]
+    assert times == sorted(times, reverse=True)
+    assert results['handlers']['stmt_Next']['count'] == 3
+    assert results['handlers']['stmt_Let']['count'] == 3
+    edges = {(r['from'], r['to']): r['count'] for r in results['edges']}
+    assert edges == {(20, 100): 3, (110, 30): 3, (30, 20): 2}
+    assert abs(results['total_time'] -
+               sum(r['time'] for r in results['lines'])) < 1e-9
+
+
+def test_folded(tmp_path):
+    profiled(tmp_path)
+    with open(tmp_path / 'profile.folded') as f:
+        lines = f.read().splitlines()
+    stacks = set()
+    for line in lines:
+        assert re.fullmatch(r'(GOSUB \d+;)*line \d+ \d+', line), line
+        stacks.add(line.rsplit(' ', 1)[0])
+    assert stacks == {'line 10', 'line 20', 'line 30', 'line 40',
+                      'GOSUB 20;line 100', 'GOSUB 20;line 110'}
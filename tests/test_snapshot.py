@@ -0,0 +1,65 @@
+import random
+import pytest
+from basic.interpreter import Interpreter
+
+# Suspends at INPUT inside a GOSUB inside a FOR loop, with arrays, strings
+# and RND in play.
+PROGRAM = '''\
+10 DIM A(5),B$(2)
+20 READ B$(1)
+30 FOR I=1 TO 3
+40 GOSUB 100
+50 NEXT I
+60 PRINT A(1);A(2);A(3);B$(1)
+70 END
+100 INPUT X
+110 LET A(I)=X+RND(0)
+120 PRINT I;RND(0)
+130 RETURN
+200 DATA "DONE"
+'''
+
+
+@pytest.fixture
+def program(tmp_path):
+    path = tmp_path / 'test.bas'
+    path.write_text(PROGRAM)
+    return str(path)
+
+
+@pytest.mark.parametrize('engine', Interpreter.ENGINES)
+def test_round_trip(program, engine):
+    parent = Interpreter(program, engine=engine, seed=1)
+    assert parent.run_until_input() == ('?', True)
+    parent.run_until_input('10')
+    blob = parent.snapshot()
+    expected = [parent.run_until_input(line) for line in ('20', '30')]
+    # A different seed, so RND only matches if its state was restored.
+    child = Interpreter(program, engine=engine, seed=2)
+    child.restore(blob)
+    assert [child.run_until_input(line) for line in ('20', '30')] == expected
+    assert not expected[-1][1]
+
+
+@pytest.mark.parametrize('engine', Interpreter.ENGINES)
+def test_restore_leaves_other_generators_alone(program, engine):
+    parent = Interpreter(program, engine=engine, seed=1)
+    parent.run_until_input()
+    blob = parent.snapshot()
+    other = Interpreter(program, engine=engine, seed=3)
+    expected = random.Random(3).random()
+    random.seed(4)
+    expected_global = random.Random(4).random()
+    Interpreter(program, engine=engine).restore(blob)
+    assert other.random.random() == expected
+    assert random.random() == expected_global
+
+
+def test_restore_rejects_other_programs(program, tmp_path):
+    blob = Interpreter(program).snapshot()
+    other_path = tmp_path / 'other.bas'
+    other_path.write_text('10 END\n')
+    with pytest.raises(ValueError):
+        Interpreter(str(other_path)).restore(blob)
+    with pytest.raises(ValueError):
+        Interpreter(program).restore(b'not a snapshot')
@@ -0,0 +1,92 @@
+import io
+import pytest
+from basic.interpreter import Interpreter
+
+
+@pytest.fixture
+def program(tmp_path):
+    path = tmp_path / 'test.bas'
+    path.write_text('10 PRINT 1\n20 END\n')
+    return str(path)
+
+
+def test_basic_trace_value_is_not_the_size(program, monkeypatch):
+    monkeypatch.setenv('BASIC_TRACE', '5')
+    interpreter = Interpreter(program)
+    assert interpreter.trace
+    assert len(interpreter.trace_buffer) == Interpreter.DEFAULT_TRACE_SIZE
+
+
+def test_basic_trace_size(program, monkeypatch):
+    monkeypatch.setenv('BASIC_TRACE', '1')
+    monkeypatch.setenv('BASIC_TRACE_SIZE', '5')
+    assert len(Interpreter(program).trace_buffer) == 5
+    assert len(Interpreter(program, trace_size=7).trace_buffer) == 7
+
+
+@pytest.mark.parametrize('engine', ['vm', 'python'])
+@pytest.mark.parametrize('variable', ['BASIC_TRACE', 'BASIC_PROFILE'])
+def test_environment_is_ignored_by_other_engines(program, monkeypatch,
+                                                 capsys, engine, variable):
+    monkeypatch.setenv(variable, '1')
+    interpreter = Interpreter(program, engine=engine)
+    assert not interpreter.trace
+    assert interpreter.profiler is None
+    interpreter.run()
+    assert capsys.readouterr().out.startswith(' 1 ')
+
+
+@pytest.mark.parametrize('engine', ['vm', 'python'])
+@pytest.mark.parametrize('option', ['trace', 'profile'])
+def test_explicit_options_require_closure_engine(program, engine, option):
+    with pytest.raises(ValueError):
+        Interpreter(program, engine=engine, **{option: True})
+
+
+def test_environment_profiling_yields_to_tracing(program, monkeypatch):
+    monkeypatch.setenv('BASIC_PROFILE', '1')
+    interpreter = Interpreter(program, trace=True)
+    assert interpreter.profiler is None
+
+
+LOOP = '''\
+10 FOR I=1 TO 5
+20 LET X=X+I
+30 NEXT I
+40 LET Y=1/0
+50 END
+'''
+
+
+def dumped_lines(text):
+    header, *lines = text.splitlines()
+    return header, [line.split(None, 2)[1:] for line in lines]
+
+
+def test_dump_on_error_keeps_only_the_last_lines(tmp_path):
+    path = tmp_path / 'test.bas'
+    path.write_text(LOOP)
+    stderr = io.StringIO()
+    interpreter = Interpreter(str(path), trace=True, trace_size=3,
+                              stderr=stderr)
+    with pytest.raises(ZeroDivisionError):
+        interpreter.run()
+    header, lines = dumped_lines(stderr.getvalue())
+    # FOR, then five each of LET and NEXT, then the failing line.
+    assert header == 'Last 3 of 12 lines executed:'
+    assert lines == [['20', 'LET X=X+I'], ['30', 'NEXT I'],
+                     ['40', 'LET Y=1/0']]
+
+
+def test_dump_on_demand(tmp_path):
+    path = tmp_path / 'test.bas'
+    path.write_text('10 LET X=1\n20 LET Y=2\n30 END\n')
+    interpreter = Interpreter(str(path), trace=True, stdout=io.StringIO())
+    interpreter.run()
+    stream = io.StringIO()
+    interpreter.dump_trace(stream)
+    header, lines = dumped_lines(stream.getvalue())
+    assert header == 'Last 3 of 3 lines executed:'
+    assert [number for number, _ in lines] == ['10', '20', '30']
+    # Times are relative to the last line.
+    assert stream.getvalue().splitlines()[-1].startswith('+0.000000s')